@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# --coding:utf-8--
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import resource
+import tempfile
+import importlib
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
+import convert_itis_to_jsongraph as converter
+from generate_itis import generate_itis
+from jsongraph import graph_writer
+
+WRITERS = [
+    converter.write_kingdom_nodes,
+    converter.write_rank_nodes,
+    converter.write_rank_edges,
+    converter.write_geographic_div_nodes,
+    converter.write_language_nodes,
+    converter.write_author_nodes,
+    converter.write_taxonomic_unit_nodes,
+    converter.write_taxonomic_unit_edges,
+    converter.write_vernacular_nodes,
+    converter.write_vernacular_edges,
+]
+
+GRAPH_JSON = 'graph.json'
+
+
+class Counter:
+    """Counts the attributes, nodes and edges written into it."""
+
+    def __init__(self):
+        self.count = 0
+
+    def write(self, *args):
+        self.count += 1
+
+    @contextlib.contextmanager
+    def subobject(self, *args):
+        yield self
+
+    @contextlib.contextmanager
+    def subarray(self, *args):
+        yield self
+
+
+class StubResponse:
+    def is_succeeded(self) -> bool:
+        return True
+
+    def error_msg(self) -> str:
+        return ''
+
+
+class StubSession:
+    """Accepts every statement like a Nebula Graph session, so that only the importer itself is timed."""
+
+    def execute(self, statement: str) -> StubResponse:
+        return StubResponse()
+
+    def release(self):
+        pass
+
+
+def __writer_stage(write: Callable) -> Callable[[sqlite3.Connection, str], int]:
+    def run(itis: sqlite3.Connection, workdir: str) -> int:
+        counter = Counter()
+        write(itis, counter)
+        return counter.count
+    return run
+
+
+def __convert_itis(itis: sqlite3.Connection, workdir: str) -> int:
+    counter = Counter()
+    with open(os.path.join(workdir, GRAPH_JSON), 'w', encoding='ascii', buffering=1 << 20) as f, \
+            graph_writer(f, 2) as graph:
+        converter.convert_itis(itis, 'benchmark', converter.FanOut(graph, counter), spool_dir=workdir)
+    return counter.count
+
+
+def __convert_to_dot(itis: sqlite3.Connection, workdir: str) -> int:
+    converter.convert_to_dot(os.path.join(workdir, GRAPH_JSON), os.path.join(workdir, 'graph.dot'))
+    with open(os.path.join(workdir, 'graph.dot'), 'r', encoding='utf-8') as f:
+        # Every node and edge is a line, besides the opening and closing of the digraph.
+        return sum(1 for _ in f) - 1
+
+
+def __import(itis: sqlite3.Connection, workdir: str) -> int:
+    # The module is named after a keyword. Creating the space is skipped, as it only waits for the server.
+    importer = importlib.import_module('import')
+    rate = importer.StatementRate()
+    session = StubSession()
+    importer.create_ranks(session, itis)
+    importer.create_taxonomic_units(session, itis, rate=rate)
+    return sum(rate.rows.values())
+
+
+def stages() -> Dict[str, Callable[[sqlite3.Connection, str], int]]:
+    """The timed stages by name; each takes the dump and a working directory and returns the rows it produced.
+
+    convert_to_dot reads the document written by convert_itis, so it has to run after it.
+    """
+    result = {write.__name__: __writer_stage(write) for write in WRITERS}
+    result['convert_itis'] = __convert_itis
+    result['convert_to_dot'] = __convert_to_dot
+    result['import'] = __import
+    return result
+
+
+def run_stage(name: str, database: str, workdir: str) -> Tuple[float, int, int]:
+    """Runs a stage and returns its duration, its number of rows and the peak RSS of the process in KiB."""
+    # Progress bars would garble the report.
+    sys.stderr = open(os.devnull, 'w')
+    itis = sqlite3.connect(database)
+    start = time.perf_counter()
+    rows = stages()[name](itis, workdir)
+    elapsed = time.perf_counter() - start
+    itis.close()
+    # ru_maxrss is in KiB on Linux.
+    return elapsed, rows, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def benchmark(database: str, repeat: int = 3, selected: Optional[list] = None) -> Dict[str, dict]:
+    """Runs every stage repeat times, each in a fresh process so that its peak RSS is its own."""
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in stages():
+            if selected and name not in selected and not (name == 'convert_itis' and 'convert_to_dot' in selected):
+                continue
+            timings = []
+            for _ in range(repeat):
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+                    (elapsed, rows, peak_rss) = pool.submit(run_stage, name, database, workdir).result()
+                timings.append(elapsed)
+            best = min(timings)
+            results[name] = {
+                'seconds': best,
+                'rows': rows,
+                'rows_per_second': rows / max(best, 1e-9),
+                'peak_rss_mb': peak_rss / 1024,
+            }
+            print(f'{name:>28}: {best:8.3f} s {rows:>10} rows {rows / max(best, 1e-9):>12,.0f} rows/s '
+                  f'{peak_rss / 1024:8.1f} MB')
+    return results
+
+
+def regressions(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float):
+    """Yields a message for every stage that got slower or used more memory than the baseline allows."""
+    for (name, result) in results.items():
+        if name not in baseline:
+            continue
+        expected = baseline[name]
+        if result['rows_per_second'] < expected['rows_per_second'] * (1 - tolerance):
+            yield f'{name}: {result["rows_per_second"]:,.0f} rows/s, baseline {expected["rows_per_second"]:,.0f} rows/s'
+        if result['peak_rss_mb'] > expected['peak_rss_mb'] * (1 + tolerance):
+            yield f'{name}: peak RSS {result["peak_rss_mb"]:.1f} MB, baseline {expected["peak_rss_mb"]:.1f} MB'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Times the converter and the importer on a synthetic or given ITIS dump.')
+    parser.add_argument('--database', help='the ITIS SQLite dump to use instead of generating one')
+    parser.add_argument('--scale', type=float, default=1., help='scale factor of the generated dump')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs per stage')
+    parser.add_argument('--stage', action='append', help='only run this stage; repeat for several')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='relative loss of throughput or growth of peak RSS reported as a regression')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = args.database
+        if database is None:
+            database = os.path.join(directory, 'ITIS.sqlite')
+            generate_itis(database, args.scale)
+        results = benchmark(database, args.repeat, args.stage)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            found = list(regressions(results, json.load(f), args.tolerance))
+        for message in found:
+            print(f'REGRESSION {message}')
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
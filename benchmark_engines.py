@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# --coding:utf-8--
+
+import io
+import time
+import sqlite3
+import argparse
+from typing import Dict, List
+
+import convert_itis_to_jsongraph as converter
+from jsongraph import ENGINES, EdgeCollector, NodeCollector, graph_writer
+
+
+def read_records(itis: sqlite3.Connection):
+    nodes = NodeCollector()
+    edges = EdgeCollector()
+    for scan in converter.SCANS:
+        scan(itis, nodes, edges)
+    return nodes, edges
+
+
+def render(nodes: Dict[str, dict], edges: List[dict], indent, engine: str) -> str:
+    out = io.StringIO()
+    with graph_writer(out, indent, engine) as graph:
+        graph.write('id', 'benchmark')
+        with graph.subobject('nodes') as node_writer:
+            for (key, node) in nodes.items():
+                node_writer.write(key, node)
+        with graph.subarray('edges') as edge_writer:
+            for edge in edges:
+                edge_writer.write(edge)
+    return out.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares the serialisation engines of the converter on the same rows.')
+    parser.add_argument('input', help='the ITIS SQLite database to read the nodes and edges from')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs per engine')
+    parser.add_argument('--pretty', action='store_true', help='benchmark the indented layout instead of the compact one')
+    args = parser.parse_args()
+    indent = 2 if args.pretty else None
+
+    # The rows are read once up front, so only the serialisation is timed.
+    nodes, edges = read_records(sqlite3.connect(args.input))
+    records = len(nodes) + len(edges)
+
+    outputs = {}
+    for engine in ENGINES:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            outputs[engine] = render(nodes, edges, indent, engine)
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        print(f'{engine:>12}: {best:.3f} s, {records / best:,.0f} records/s, '
+              f'{len(outputs[engine]) / best / (1 << 20):.1f} MB/s')
+
+    reference = outputs[ENGINES[0]]
+    for engine in ENGINES[1:]:
+        assert outputs[engine] == reference, f'{engine} output differs from {ENGINES[0]}'
+    print(f'{records} records, {len(reference)} bytes, identical output')
+
+
+if __name__ == '__main__':
+    main()
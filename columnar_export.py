@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# --coding:utf-8--
+
+import os
+import sqlite3
+import argparse
+import datetime
+from typing import Iterable, Iterator, List, Optional, Tuple
+from dateutil.parser import parse as parse_time
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+import convert_itis_to_jsongraph as converter
+from itis_source import open_source, prepare_indexes
+from jsongraph import Discard
+
+DEFAULT_ROW_GROUP_ROWS = 64 * 1024
+
+# The rank groups of ITIS.ipynb: ranks with an id in [first, last) belong to the group of the given rank.
+RANK_GROUPS = [
+    (10, 27, 'Kingdom', 10),
+    (27, 50, 'Division', 30),
+    (50, 90, 'Class', 60),
+    (90, 140, 'Order', 100),
+    (140, 160, 'Family', 140),
+    (160, 180, 'Tribe', 160),
+    (180, 200, 'Genus', 180),
+    (200, 220, 'Section', 200),
+    (220, 240, 'Species', 220),
+    (240, 260, 'Variety', 240),
+    (260, 271, 'Form', 260),
+]
+
+# The columns of the node metadata of write_taxonomic_unit_nodes, with the kingdom and rank to filter on.
+# Rows are sorted by kingdom, rank and TSN, so that the statistics of the row groups skip other kingdoms and ranks.
+TAXONOMIC_UNIT_COLUMNS_QUERY = '''
+    SELECT tu.kingdom_id, tu.rank_id, tu.tsn, tu.parent_tsn,
+           tu.complete_name, tu.name_usage,
+           tu.unit_ind1, tu.unit_name1,
+           tu.unit_ind2, tu.unit_name2,
+           tu.unit_ind3, tu.unit_name3,
+           tu.unit_ind4, tu.unit_name4,
+           tu.initial_time_stamp, tu.update_date,
+           nodc.nodc_id, nodc.update_date,
+           tu.taxon_author_id, tu.hybrid_author_id
+    FROM main.taxonomic_units AS tu
+    LEFT JOIN (SELECT tsn, nodc_id, update_date, MAX(rowid) FROM nodc_ids GROUP BY tsn) AS nodc
+        ON nodc.tsn = tu.tsn
+    WHERE tu.kingdom_id = ?
+    ORDER BY tu.rank_id, tu.tsn
+    '''
+
+
+def __require_pyarrow():
+    if pa is None:
+        raise RuntimeError('the columnar export requires the pyarrow package')
+
+
+def rank_group(rank_id: Optional[int]) -> Tuple[Optional[str], Optional[int]]:
+    """The name and rank id of the group of a rank, as computed in ITIS.ipynb."""
+    for (first, last, name, group_rank_id) in RANK_GROUPS:
+        if rank_id is not None and first <= rank_id < last:
+            return name, group_rank_id
+    return None, None
+
+
+# Missing parts of partial dates, like the year alone that some rows hold, are the first month or day.
+EARLIEST = datetime.datetime(1, 1, 1)
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime.datetime]:
+    if value is None:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return parse_time(value, default=EARLIEST)
+
+
+def parse_date(value: Optional[str]) -> Optional[datetime.date]:
+    return None if value is None else parse_timestamp(value).date()
+
+
+class ParquetTableWriter:
+    """Writes rows into a Parquet file, one row group per row_group_rows rows.
+
+    Only a row group is held in memory. String columns are dictionary encoded.
+    """
+
+    def __init__(self, path: str, columns: List[Tuple[str, 'pa.DataType']],
+                 row_group_rows: int = DEFAULT_ROW_GROUP_ROWS):
+        self.schema = pa.schema(columns)
+        self.row_group_rows = row_group_rows
+        self.columns = [[] for _ in columns]
+        self.rows = 0
+        self.writer = pq.ParquetWriter(path, self.schema, compression='zstd',
+                                       use_dictionary=[name for (name, column_type) in columns
+                                                       if column_type == pa.string()])
+
+    def write(self, row: tuple):
+        for (column, value) in zip(self.columns, row):
+            column.append(value)
+        self.rows += 1
+        if len(self.columns[0]) >= self.row_group_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.columns[0]:
+            return
+        self.writer.write_table(pa.Table.from_arrays(
+            [pa.array(column, type=field.type) for (column, field) in zip(self.columns, self.schema)],
+            schema=self.schema))
+        self.columns = [[] for _ in self.columns]
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, evalue, traceback):
+        self.close()
+
+
+def taxon_unit_type_rows(itis: sqlite3.Connection, kingdom_ids: List[int]) -> Iterator[tuple]:
+    for kingdom_id in kingdom_ids:
+        for (rank_id, rank_name, dir_parent_rank_id, req_parent_rank_id, update_date) in itis.execute('''
+                SELECT rank_id, rank_name, dir_parent_rank_id, req_parent_rank_id, update_date
+                FROM taxon_unit_types WHERE kingdom_id = ? ORDER BY rank_id''', (kingdom_id,)):
+            yield (kingdom_id, rank_id, rank_name, dir_parent_rank_id, req_parent_rank_id, parse_date(update_date),
+                   *rank_group(rank_id))
+
+
+def taxonomic_unit_rows(itis: sqlite3.Connection, kingdom_ids: List[int]) -> Iterator[tuple]:
+    for kingdom_id in kingdom_ids:
+        for unit in itis.execute(TAXONOMIC_UNIT_COLUMNS_QUERY, (kingdom_id,)):
+            (initial_time_stamp, update_date, nodc_id, nodc_update_date) = unit[14:18]
+            yield (*unit[:2], *rank_group(unit[1]), *unit[2:6], unit[5] == 'accepted', *unit[6:14],
+                   parse_timestamp(initial_time_stamp), parse_date(update_date), nodc_id, parse_date(nodc_update_date),
+                   *unit[18:])
+
+
+def vernacular_rows(itis: sqlite3.Connection, kingdom_ids: List[int]) -> Iterator[tuple]:
+    for kingdom_id in kingdom_ids:
+        for (tsn, vern_id, language, update_date, name) in itis.execute(converter.VERNACULAR_QUERY,
+                                                                        {'kingdom_id': kingdom_id}):
+            yield kingdom_id, tsn, vern_id, language, parse_date(update_date), name
+
+
+class EdgeRows:
+    """Turns the edges written into it into rows of the edge table."""
+
+    def __init__(self, table: ParquetTableWriter, kingdom_id: int):
+        self.table = table
+        self.kingdom_id = kingdom_id
+
+    def write(self, edge: dict):
+        metadata = edge.get('metadata', {})
+        self.table.write((self.kingdom_id, edge['source'], edge['target'], edge['relation'],
+                          parse_date(metadata.get('update_date')), metadata.get('author_type')))
+
+
+def __write_rows(path: str, columns: list, rows: Iterable[tuple], row_group_rows: int) -> int:
+    with ParquetTableWriter(path, columns, row_group_rows) as table:
+        for row in rows:
+            table.write(row)
+    return table.rows
+
+
+def export_columnar(itis: sqlite3.Connection, directory: str, kingdom_ids: Optional[List[int]] = None,
+                    row_group_rows: int = DEFAULT_ROW_GROUP_ROWS) -> dict:
+    """Writes the ranks, taxonomic units, vernaculars and taxonomic unit edges of kingdoms as Parquet files.
+
+    Returns the number of rows of each file.
+    """
+    __require_pyarrow()
+    os.makedirs(directory, exist_ok=True)
+    kingdom_ids = [kingdom_id for (kingdom_id, _) in converter.read_kingdoms(itis, kingdom_ids)]
+    rank_group_columns = [('rank_group', pa.string()), ('rank_group_id', pa.int16())]
+    counts = {}
+
+    counts['taxon_unit_types'] = __write_rows(os.path.join(directory, 'taxon_unit_types.parquet'), [
+        ('kingdom_id', pa.int16()), ('rank_id', pa.int16()), ('rank_name', pa.string()),
+        ('dir_parent_rank_id', pa.int16()), ('req_parent_rank_id', pa.int16()), ('update_date', pa.date32()),
+        *rank_group_columns,
+    ], taxon_unit_type_rows(itis, kingdom_ids), row_group_rows)
+
+    counts['taxonomic_units'] = __write_rows(os.path.join(directory, 'taxonomic_units.parquet'), [
+        ('kingdom_id', pa.int16()), ('rank_id', pa.int16()), *rank_group_columns,
+        ('tsn', pa.int64()), ('parent_tsn', pa.int64()), ('complete_name', pa.string()), ('name_usage', pa.string()),
+        ('accepted', pa.bool_()),
+        *[(f'unit_{part}{i}', pa.string()) for i in range(1, 5) for part in ('ind', 'name')],
+        ('initial_time_stamp', pa.timestamp('ms')), ('update_date', pa.date32()),
+        ('nodc_id', pa.string()), ('nodc_update_date', pa.date32()),
+        ('taxon_author_id', pa.int64()), ('hybrid_author_id', pa.int64()),
+    ], taxonomic_unit_rows(itis, kingdom_ids), row_group_rows)
+
+    counts['vernaculars'] = __write_rows(os.path.join(directory, 'vernaculars.parquet'), [
+        ('kingdom_id', pa.int16()), ('tsn', pa.int64()), ('vern_id', pa.int64()), ('language', pa.string()),
+        ('update_date', pa.date32()), ('vernacular_name', pa.string()),
+    ], vernacular_rows(itis, kingdom_ids), row_group_rows)
+
+    # The edges come from the scan of the converter itself, so they are the edges of the JSON Graph documents.
+    with ParquetTableWriter(os.path.join(directory, 'taxonomic_unit_edges.parquet'), [
+        ('kingdom_id', pa.int16()), ('source', pa.string()), ('target', pa.string()), ('relation', pa.string()),
+        ('update_date', pa.date32()), ('author_type', pa.string()),
+    ], row_group_rows) as edges:
+        for kingdom_id in kingdom_ids:
+            converter.scan_taxonomic_units(itis, Discard(), EdgeRows(edges, kingdom_id), kingdom_id)
+    counts['taxonomic_unit_edges'] = edges.rows
+    return counts
+
+
+def __parse_kingdoms(value: str) -> Optional[List[int]]:
+    return None if value == 'all' else [int(kingdom_id) for kingdom_id in value.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Exports ITIS into Parquet files for analysis.')
+    parser.add_argument('input', help='the ITIS SQLite dump')
+    parser.add_argument('output', help='the directory to write the Parquet files into')
+    parser.add_argument('--kingdoms', type=__parse_kingdoms, default=None,
+                        help='comma separated ITIS kingdom ids, or "all" (the default)')
+    parser.add_argument('--row-group-rows', type=int, default=DEFAULT_ROW_GROUP_ROWS, help='rows per row group')
+    args = parser.parse_args()
+
+    itis = open_source(args.input)
+    prepare_indexes(itis)
+    counts = export_columnar(itis, args.output, args.kingdoms, args.row_group_rows)
+    itis.close()
+    for (name, count) in counts.items():
+        print(f'{name}: {count} rows')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# --coding:utf-8--
+
+import io
+import gzip
+import queue
+import threading
+from typing import BinaryIO, Optional, TextIO
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIONS = ['none', 'gzip', 'zstd']
+
+EXTENSIONS = {
+    'none': '',
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def compressed_path(path: str, compression: str) -> str:
+    return path + EXTENSIONS[compression]
+
+
+def compression_of(path: str) -> str:
+    for (compression, extension) in EXTENSIONS.items():
+        if extension and path.endswith(extension):
+            return compression
+    return 'none'
+
+
+def __require_zstandard():
+    if zstandard is None:
+        raise RuntimeError('zstd compression requires the zstandard package')
+
+
+class BackgroundWriter(io.RawIOBase):
+    """A binary sink that hands its writes to a thread, which passes them on to another file.
+
+    Compressing in that thread overlaps with producing the data; zlib and zstd release the GIL
+    while they compress.
+    """
+
+    def __init__(self, target: BinaryIO, name: str, queue_size: int = 16):
+        super().__init__()
+        self.target = target
+        self.name = name
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self.__run, name=f'compress {name}', daemon=True)
+        self.thread.start()
+
+    def __run(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                break
+            if self.error is None:
+                try:
+                    self.target.write(chunk)
+                except Exception as e:
+                    self.error = e
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if self.error is not None:
+            raise RuntimeError(f'Writing {self.name} failed') from self.error
+        self.queue.put(bytes(data))
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.target.close()
+        super().close()
+        if self.error is not None:
+            raise RuntimeError(f'Writing {self.name} failed') from self.error
+
+
+def open_output(path: str, compression: Optional[str] = None, encoding: str = 'utf-8',
+                background: bool = True) -> TextIO:
+    """Opens a text file for writing, compressed as given or as told by the extension of the path.
+
+    Compressed output is compressed in a background thread unless background is False.
+    """
+    if compression is None:
+        compression = compression_of(path)
+    if compression == 'none':
+        return open(path, 'w', encoding=encoding, buffering=1 << 20)
+
+    if compression == 'gzip':
+        target = gzip.open(path, 'wb', compresslevel=6)
+    else:
+        __require_zstandard()
+        target = zstandard.ZstdCompressor(level=3).stream_writer(open(path, 'wb'), closefd=True)
+    if background:
+        target = BackgroundWriter(target, path)
+    return io.TextIOWrapper(io.BufferedWriter(target, buffer_size=1 << 20), encoding=encoding)
+
+
+def open_input(path: str, encoding: str = 'utf-8') -> TextIO:
+    """Opens a text file for reading, decompressing gzip or zstd according to its first bytes."""
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+    if magic.startswith(GZIP_MAGIC):
+        return io.TextIOWrapper(io.BufferedReader(gzip.open(path, 'rb'), buffer_size=1 << 20), encoding=encoding)
+    if magic.startswith(ZSTD_MAGIC):
+        __require_zstandard()
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+        return io.TextIOWrapper(io.BufferedReader(reader, buffer_size=1 << 20), encoding=encoding)
+    return open(path, 'r', encoding=encoding)
@@ -2,14 +2,34 @@
 # --coding:utf-8--
 
 import os
+import sys
+import json
 import sqlite3
+import argparse
+import tempfile
+import contextlib
 import jsonstreams
 import datetime
 import hashlib
-import json
-from dateutil.parser import parse as parse_time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
 from tqdm import tqdm
 
+from compression import COMPRESSIONS, compressed_path, open_input, open_output
+from csr_graph import CsrGraphWriter, export_csr
+from hierarchy_index import HierarchyIndex, HierarchyNodeWriter, build_hierarchy_index
+from itis_source import DEFAULT_KINGDOM_ID, SOURCE_MODES, attach_index_database, connect_read_only, open_source, \
+    prepare_index_database, prepare_indexes, print_query_plans
+from metrics import METRICS
+from ndjson_graph import NdjsonGraphWriter, export_ndjson
+from row_source import iso_timestamps, record_batches
+from section_cache import RANGE_UNITS, SectionCache
+from synonyms import AcceptedNodeWriter, SynonymTable, build_synonym_table
+from validate_graph import validate_graph
+
+from jsongraph import ENGINES, Discard, DotEdgeWriter, DotGraphWriter, DotNodeWriter, EdgeSpool, FanOut, FragmentSplicer, \
+    JsonArrayWriter, JsonObjectWriter, NodeCollector, copy_graph, fragment_writer, graph_writer
+
 GEOGRAPHIC_DIVS = {
     'East Pacific': 'east-pacific',
     'North America': 'north-america',
@@ -59,31 +79,65 @@ LANGUAGES = {
 }
 
 
-def convert_itis(itis: sqlite3.Connection, itis_md5: str, graph: jsonstreams.Object):
+def convert_itis(itis: sqlite3.Connection, itis_md5: str, graph: JsonObjectWriter, spool_dir: Optional[str] = None,
+                 kingdom_id: int = DEFAULT_KINGDOM_ID, kingdom_name: Optional[str] = None,
+                 shared_nodes: Optional[Dict[str, Dict[str, dict]]] = None, hierarchy: Optional[HierarchyIndex] = None,
+                 synonyms: Optional[SynonymTable] = None):
+    """Writes the graph of a kingdom.
+
+    shared_nodes holds nodes collected beforehand with collect_shared_nodes; these are written
+    instead of running the corresponding scans again. With a hierarchy index, the numbering of each
+    taxonomic unit is added to its metadata, and with a synonym table its accepted TSN.
+    """
     #   "$schema": "http://json-schema.org/draft-07/schema#",
     #   "$id": "http://jsongraphformat.info/v2.1/json-graph-schema.json",
-    write_graph_attributes(graph, itis_md5)
-
-    with graph.subobject('nodes') as nodes:
-        write_kingdom_nodes(itis, nodes)
-        write_rank_nodes(itis, nodes)
-        write_geographic_div_nodes(itis, nodes)
-        write_language_nodes(itis, nodes)
-        write_author_nodes(itis, nodes)
-        write_taxonomic_unit_nodes(itis, nodes)
-        write_vernacular_nodes(itis, nodes)
-
-    with graph.subarray('edges') as edges:
-        write_rank_edges(itis, edges)
-        write_taxonomic_unit_edges(itis, edges)
-        write_vernacular_edges(itis, edges)
+    write_graph_attributes(graph, itis_md5, kingdom_name)
+
+    # Every table is read once. The edges found while writing the nodes are spooled to a temporary
+    # file and copied into the edges array afterwards, in the order in which they were found.
+    with EdgeSpool(spool_dir) as spool:
+        with graph.subobject('nodes') as nodes:
+            if hierarchy is not None:
+                nodes = HierarchyNodeWriter(nodes, hierarchy)
+            if synonyms is not None:
+                nodes = AcceptedNodeWriter(nodes, synonyms)
+            for scan in SCANS:
+                with METRICS.stage(scan.__name__) as stage:
+                    if shared_nodes is not None and scan.__name__ in shared_nodes:
+                        stage_nodes = METRICS.writer(nodes, stage)
+                        for (key, node) in shared_nodes[scan.__name__].items():
+                            stage_nodes.write(key, node)
+                    else:
+                        scan(METRICS.connection(itis, stage), METRICS.writer(nodes, stage),
+                             METRICS.writer(spool, stage), kingdom_id)
+
+        with graph.subarray('edges') as edges, METRICS.stage('edges') as stage:
+            spool.replay(METRICS.writer(edges, stage))
+
+
+def __estimate_rows(itis: sqlite3.Connection, table: str) -> Optional[int]:
+    """Estimates the number of rows in a table for a progress bar, without scanning the table.
+
+    Uses the statistics gathered by ANALYZE if there are any, and the range of rowids otherwise.
+    """
+    try:
+        stat = itis.execute('SELECT stat FROM main.sqlite_stat1 WHERE tbl = ? LIMIT 1', (table,)).fetchone()
+        if stat is not None:
+            return int(stat[0].split()[0])
+    except sqlite3.OperationalError:
+        pass
+    try:
+        (first, last) = itis.execute(f'SELECT MIN(rowid), MAX(rowid) FROM main.{table}').fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return None if first is None else last - first + 1
 
 
 def __kingdom_label(kingdom_id: int) -> str:
     return f'kingdom-{kingdom_id}'
 
 
-def write_kingdom_nodes(itis: sqlite3.Connection, nodes: jsonstreams.Object):
+def write_kingdom_nodes(itis: sqlite3.Connection, nodes: JsonObjectWriter):
     kingdoms = itis.execute('''
         SELECT kingdom_id, kingdom_name, update_date
         FROM kingdoms 
@@ -91,60 +145,68 @@ def write_kingdom_nodes(itis: sqlite3.Connection, nodes: jsonstreams.Object):
         ''')
 
     for (kingdom_id, kingdom_name, update_date) in kingdoms:
-        with nodes.subobject(__kingdom_label(kingdom_id)) as kingdom:
-            kingdom.write('label', kingdom_name)
-            with kingdom.subobject('metadata') as meta:
-                meta.write('type', 'kingdom')
-                meta.write('itis_kingdom_id', kingdom_id)
-                meta.write('update_date', update_date)
+        nodes.write(__kingdom_label(kingdom_id), {
+            'label': kingdom_name,
+            'metadata': {
+                'type': 'kingdom',
+                'itis_kingdom_id': kingdom_id,
+                'update_date': update_date,
+            }
+        })
 
 
 def __rank_label(kingdom_id: int, rank_id: int) -> str:
     return f'rank-{kingdom_id}.{rank_id}'
 
 
-def write_rank_nodes(itis: sqlite3.Connection, nodes: jsonstreams.Object):
-    # Fetch all ranks from the Plantae kingdom (kingdom_id = 3)
-    taxon_unit_types = itis.execute('''
-        SELECT kingdom_id, rank_id, rank_name, update_date
-        FROM taxon_unit_types 
-        WHERE kingdom_id = 3 ORDER BY rank_id
-        ''')
+RANK_QUERY = '''
+    SELECT kingdom_id, rank_id, rank_name, update_date, dir_parent_rank_id, req_parent_rank_id
+    FROM taxon_unit_types 
+    WHERE kingdom_id = :kingdom_id ORDER BY rank_id
+    '''
 
-    for (kingdom_id, rank_id, rank_name, update_date) in taxon_unit_types:
-        with nodes.subobject(__rank_label(kingdom_id, rank_id)) as rank:
-            rank.write('label', rank_name)
-            with rank.subobject('metadata') as meta:
-                meta.write('type', 'taxon_unit_type')
-                meta.write('itis_rank_id', rank_id)
-                meta.write('update_date', update_date)
-
-
-def write_rank_edges(itis: sqlite3.Connection, edges: jsonstreams.Array):
-    # Fetch all ranks from the Plantae kingdom (kingdom_id = 3)
-    taxon_unit_types = itis.execute('''
-        SELECT kingdom_id, rank_id, dir_parent_rank_id, req_parent_rank_id
-        FROM taxon_unit_types 
-        WHERE kingdom_id = 3 ORDER BY rank_id
-        ''')
 
-    for (kingdom_id, rank_id, dir_parent_rank_id, req_parent_rank_id) in taxon_unit_types:
-        with edges.subobject() as edge:
-            edge.write('source', __kingdom_label(kingdom_id))
-            edge.write('target', __rank_label(kingdom_id, rank_id))
-            edge.write('relation', 'uses')
+def scan_ranks(itis: sqlite3.Connection, nodes: JsonObjectWriter, edges: JsonArrayWriter,
+               kingdom_id: int = DEFAULT_KINGDOM_ID):
+    taxon_unit_types = itis.execute(RANK_QUERY, {'kingdom_id': kingdom_id})
+
+    for (kingdom_id, rank_id, rank_name, update_date, dir_parent_rank_id, req_parent_rank_id) in taxon_unit_types:
+        nodes.write(__rank_label(kingdom_id, rank_id), {
+            'label': rank_name,
+            'metadata': {
+                'type': 'taxon_unit_type',
+                'itis_rank_id': rank_id,
+                'update_date': update_date,
+            }
+        })
+
+        edges.write({
+            'source': __kingdom_label(kingdom_id),
+            'target': __rank_label(kingdom_id, rank_id),
+            'relation': 'uses'
+        })
 
         if dir_parent_rank_id != rank_id:
-            with edges.subobject() as edge:
-                edge.write('source', __rank_label(kingdom_id, dir_parent_rank_id))
-                edge.write('target', __rank_label(kingdom_id, rank_id))
-                edge.write('relation', 'direct_parent_of')
+            edges.write({
+                'source': __rank_label(kingdom_id, dir_parent_rank_id),
+                'target': __rank_label(kingdom_id, rank_id),
+                'relation': 'direct_parent_of'
+            })
 
         if req_parent_rank_id != rank_id:
-            with edges.subobject() as edge:
-                edge.write('source', __rank_label(kingdom_id, req_parent_rank_id))
-                edge.write('target', __rank_label(kingdom_id, rank_id))
-                edge.write('relation', 'required_parent_of')
+            edges.write({
+                'source': __rank_label(kingdom_id, req_parent_rank_id),
+                'target': __rank_label(kingdom_id, rank_id),
+                'relation': 'required_parent_of'
+            })
+
+
+def write_rank_nodes(itis: sqlite3.Connection, nodes: JsonObjectWriter, kingdom_id: int = DEFAULT_KINGDOM_ID):
+    scan_ranks(itis, nodes, Discard(), kingdom_id)
+
+
+def write_rank_edges(itis: sqlite3.Connection, edges: JsonArrayWriter, kingdom_id: int = DEFAULT_KINGDOM_ID):
+    scan_ranks(itis, Discard(), edges, kingdom_id)
 
 
 def __geo_label(geographic_value: str) -> str:
@@ -152,13 +214,15 @@ def __geo_label(geographic_value: str) -> str:
     return GEOGRAPHIC_DIVS[geographic_value]
 
 
-def write_geographic_div_nodes(itis: sqlite3.Connection, nodes: jsonstreams.Object):
+def write_geographic_div_nodes(itis: sqlite3.Connection, nodes: JsonObjectWriter):
     geos = itis.execute('SELECT DISTINCT geographic_value FROM geographic_div')
     for (value,) in geos:
-        with nodes.subobject(__geo_label(value)) as geo:
-            geo.write('label', value)
-            with geo.subobject('metadata') as meta:
-                meta.write('type', 'geographic-division')
+        nodes.write(__geo_label(value), {
+            'label': value,
+            'metadata': {
+                'type': 'geographic-division'
+            }
+        })
 
 
 def __language_label(value: str) -> str:
@@ -166,223 +230,251 @@ def __language_label(value: str) -> str:
     return LANGUAGES[value]
 
 
-def write_language_nodes(itis: sqlite3.Connection, nodes: jsonstreams.Object):
+def write_language_nodes(itis: sqlite3.Connection, nodes: JsonObjectWriter):
     langs = itis.execute('SELECT DISTINCT language FROM vernaculars')
     for (value,) in langs:
-        with nodes.subobject(__language_label(value)) as language:
-            language.write('label', value)
-            with language.subobject('metadata') as meta:
-                meta.write('type', 'language')
+        nodes.write(__language_label(value), {
+            'label': value,
+            'metadata': {
+                'type': 'language'
+            }
+        })
 
 
 def __taxonomic_unit_label(tsn: int) -> str:
     return f'tu-{tsn}'
 
 
-def write_taxonomic_unit_nodes(itis: sqlite3.Connection, nodes: jsonstreams.Object):
-    count = itis.execute('SELECT COUNT(*) FROM taxonomic_units WHERE kingdom_id = 3').fetchone()[0]
-
-    nodc_ids = itis.execute('SELECT tsn, nodc_id, update_date FROM nodc_ids')
-    nodc_ids = {t[0]: (t[1], t[2]) for t in nodc_ids}
-
-    units = itis.execute('''
-                        SELECT tu.tsn,
-                               tu.complete_name, name_usage, 
-                               unit_ind1, unit_name1,
-                               unit_ind2, unit_name2,
-                               unit_ind3, unit_name3,
-                               unit_ind4, unit_name4,
-                               initial_time_stamp, tu.update_date,
-                               ln.completename
-                        FROM taxonomic_units AS tu
-                        LEFT JOIN longnames AS ln ON ln.tsn = tu.tsn
-                        WHERE tu.kingdom_id = 3''')
-
-    for unit in tqdm(units, desc='Units', total=count):
-        tsn = unit[0]
-        complete_name = unit[1]
-        name_usage = unit[2]
-        unit_ind1 = unit[3]
-        unit_name1 = unit[4]
-        unit_ind2 = unit[5]
-        unit_name2 = unit[6]
-        unit_ind3 = unit[7]
-        unit_name3 = unit[8]
-        unit_ind4 = unit[9]
-        unit_name4 = unit[10]
-        initial_time_stamp = unit[11]
-        update_date = unit[12]
-        completename = unit[13]
-
-        assert complete_name == completename
-
-        initial_time_stamp = parse_time(initial_time_stamp)
-        is_accepted = True if name_usage == 'accepted' else False
-
-        with nodes.subobject(__taxonomic_unit_label(tsn)) as unit:
-            unit.write('label', complete_name)
-            with unit.subobject('metadata') as meta:
-                meta.write('type', 'taxonomic-unit')
-                if unit_ind1:
-                    meta.write('ind1', unit_ind1)
-                if unit_name1:
-                    meta.write('name1', unit_name1)
-                if unit_ind2:
-                    meta.write('ind2', unit_ind2)
-                if unit_name2:
-                    meta.write('name2', unit_name2)
-                if unit_ind3:
-                    meta.write('ind3', unit_ind3)
-                if unit_name3:
-                    meta.write('name3', unit_name3)
-                if unit_ind4:
-                    meta.write('ind4', unit_ind4)
-                if unit_name4:
-                    meta.write('name4', unit_name4)
-
-                meta.write('tsn', tsn)
-                meta.write('initial_time_stamp', initial_time_stamp.isoformat())
-                meta.write('update_date', update_date)
-                meta.write('accepted', is_accepted)
-
-                if tsn in nodc_ids:
-                    with meta.subobject('nodc') as nodc:
-                        nodc.write('id', nodc_ids[tsn][0])
-                        nodc.write('update_date', nodc_ids[tsn][1])
-
-
-def write_taxonomic_unit_edges(itis: sqlite3.Connection, edges: jsonstreams.Array):
-    count = itis.execute('SELECT COUNT(*) FROM taxonomic_units WHERE kingdom_id = 3').fetchone()[0]
-    units = itis.execute('''
-        SELECT 
-            tu.rank_id, tu.tsn, tu.parent_tsn, 
-            sl.tsn_accepted, sl.update_date,
-            gd.geographic_value, gd.update_date,
-            tu.taxon_author_id, tu.hybrid_author_id
-        FROM taxonomic_units AS tu
-        LEFT JOIN synonym_links AS sl ON tu.tsn = sl.tsn
-        LEFT JOIN geographic_div AS gd ON tu.tsn = gd.tsn  
-        WHERE kingdom_id = 3
-        ''')
-    for unit in tqdm(units, desc='Unit Relationships', total=count):
-        rank_id = unit[0]
-        tsn = unit[1]
-        parent_tsn = unit[2]
-        accepted_tsn = unit[3]
-        update_date = unit[4]
-        geo_div_value = unit[5]
-        geo_div_date = unit[6]
-        taxon_author = unit[7]
-        hybrid_author = unit[8]
-
-        with edges.subobject() as edge:
-            edge.write('source', __taxonomic_unit_label(parent_tsn))
-            edge.write('target', __taxonomic_unit_label(tsn))
-            edge.write('relation', 'parent_of')
-
-        with edges.subobject() as edge:
-            edge.write('source', __taxonomic_unit_label(tsn))
-            edge.write('target', __rank_label(kingdom_id=3, rank_id=rank_id))
-            edge.write('relation', 'has_rank')
-
-        if accepted_tsn:
-            with edges.subobject() as edge:
-                edge.write('source', __taxonomic_unit_label(tsn))
-                edge.write('target', __taxonomic_unit_label(accepted_tsn))
-                edge.write('relation', 'synonym_of')
-                with edge.subobject('metadata') as meta:
-                    meta.write('update_date', update_date)
-
-        if geo_div_value:
-            with edges.subobject() as edge:
-                edge.write('source', __taxonomic_unit_label(tsn))
-                edge.write('target', __geo_label(geo_div_value))
-                edge.write('relation', 'has_geographic_div')
-                with edge.subobject('metadata') as meta:
-                    meta.write('update_date', geo_div_date)
-
-        if taxon_author > 0:
-            with edges.subobject() as edge:
-                edge.write('source', __taxonomic_unit_label(tsn))
-                edge.write('target', __author_label(taxon_author))
-                edge.write('relation', 'author')
-                with edge.subobject('metadata') as meta:
-                    meta.write('author_type', 'taxon')
-
-        if hybrid_author > 0:
-            with edges.subobject() as edge:
-                edge.write('source', __taxonomic_unit_label(tsn))
-                edge.write('target', __author_label(hybrid_author))
-                edge.write('relation', 'author')
-                with edge.subobject('metadata') as meta:
-                    meta.write('author_type', 'hybrid')
+# The NODC id is the one with the highest rowid, i.e. the last one in table order; SQLite takes
+# the bare columns of an aggregate query from the row holding the MAX().
+TAXONOMIC_UNIT_QUERY = '''
+    SELECT tu.tsn,
+           tu.complete_name, name_usage, 
+           unit_ind1, unit_name1,
+           unit_ind2, unit_name2,
+           unit_ind3, unit_name3,
+           unit_ind4, unit_name4,
+           initial_time_stamp, tu.update_date,
+           ln.completename,
+           nodc.nodc_id, nodc.update_date AS nodc_update_date,
+           tu.rank_id, tu.parent_tsn, 
+           sl.tsn_accepted, sl.update_date AS synonym_update_date,
+           gd.geographic_value, gd.update_date AS geographic_update_date,
+           tu.taxon_author_id, tu.hybrid_author_id
+    FROM taxonomic_units AS tu
+    LEFT JOIN longnames AS ln ON ln.tsn = tu.tsn
+    LEFT JOIN (SELECT tsn, nodc_id, update_date, MAX(rowid) FROM nodc_ids GROUP BY tsn) AS nodc
+        ON nodc.tsn = tu.tsn
+    LEFT JOIN synonym_links AS sl ON tu.tsn = sl.tsn
+    LEFT JOIN geographic_div AS gd ON tu.tsn = gd.tsn  
+    WHERE tu.kingdom_id = :kingdom_id
+    ORDER BY tu.tsn
+    '''
+
+
+def scan_taxonomic_units(itis: sqlite3.Connection, nodes: JsonObjectWriter, edges: JsonArrayWriter,
+                         kingdom_id: int = DEFAULT_KINGDOM_ID):
+    # The synonym and geographic division joins repeat a unit once per combination of their rows;
+    # ordered by TSN the rows of a unit are adjacent, so its node is written on the first of them.
+    units = itis.execute(TAXONOMIC_UNIT_QUERY, {'kingdom_id': kingdom_id})
+    total = itis.execute('SELECT COUNT(*) FROM taxonomic_units WHERE kingdom_id = ?', (kingdom_id,)).fetchone()[0]
+
+    previous_tsn = None
+    with tqdm(desc='Units', total=total) as progress:
+        for batch in record_batches(units, {'initial_time_stamp': iso_timestamps}):
+            assert batch['complete_name'] == batch['completename']
+            for unit in batch.rows():
+                tsn = unit[0]
+                if tsn != previous_tsn:
+                    previous_tsn = tsn
+                    __write_taxonomic_unit_node(nodes, unit)
+                    progress.update()
+                __write_taxonomic_unit_edges(edges, unit, kingdom_id)
+
+
+def __write_taxonomic_unit_node(nodes: JsonObjectWriter, unit: tuple):
+    # The initial timestamp is already in ISO form.
+    (tsn, complete_name, name_usage,
+     unit_ind1, unit_name1, unit_ind2, unit_name2, unit_ind3, unit_name3, unit_ind4, unit_name4,
+     initial_time_stamp, update_date, _, nodc_id, nodc_update_date) = unit[:16]
+
+    is_accepted = True if name_usage == 'accepted' else False
+
+    meta = {'type': 'taxonomic-unit'}
+    if unit_ind1:
+        meta['ind1'] = unit_ind1
+    if unit_name1:
+        meta['name1'] = unit_name1
+    if unit_ind2:
+        meta['ind2'] = unit_ind2
+    if unit_name2:
+        meta['name2'] = unit_name2
+    if unit_ind3:
+        meta['ind3'] = unit_ind3
+    if unit_name3:
+        meta['name3'] = unit_name3
+    if unit_ind4:
+        meta['ind4'] = unit_ind4
+    if unit_name4:
+        meta['name4'] = unit_name4
+
+    meta['tsn'] = tsn
+    meta['initial_time_stamp'] = initial_time_stamp
+    meta['update_date'] = update_date
+    meta['accepted'] = is_accepted
+
+    if nodc_id is not None:
+        meta['nodc'] = {
+            'id': nodc_id,
+            'update_date': nodc_update_date
+        }
+
+    nodes.write(__taxonomic_unit_label(tsn), {
+        'label': complete_name,
+        'metadata': meta
+    })
+
+
+def __write_taxonomic_unit_edges(edges: JsonArrayWriter, unit: tuple, kingdom_id: int):
+    tsn = unit[0]
+    (rank_id, parent_tsn, accepted_tsn, update_date, geo_div_value, geo_div_date, taxon_author,
+     hybrid_author) = unit[16:]
+
+    edges.write({
+        'source': __taxonomic_unit_label(parent_tsn),
+        'target': __taxonomic_unit_label(tsn),
+        'relation': 'parent_of'
+    })
+
+    edges.write({
+        'source': __taxonomic_unit_label(tsn),
+        'target': __rank_label(kingdom_id=kingdom_id, rank_id=rank_id),
+        'relation': 'has_rank'
+    })
+
+    if accepted_tsn:
+        edges.write({
+            'source': __taxonomic_unit_label(tsn),
+            'target': __taxonomic_unit_label(accepted_tsn),
+            'relation': 'synonym_of',
+            'metadata': {
+                'update_date': update_date
+            }
+        })
+
+    if geo_div_value:
+        edges.write({
+            'source': __taxonomic_unit_label(tsn),
+            'target': __geo_label(geo_div_value),
+            'relation': 'has_geographic_div',
+            'metadata': {
+                'update_date': geo_div_date
+            }
+        })
+
+    if taxon_author > 0:
+        edges.write({
+            'source': __taxonomic_unit_label(tsn),
+            'target': __author_label(taxon_author),
+            'relation': 'author',
+            'metadata': {
+                'author_type': 'taxon'
+            }
+        })
+
+    if hybrid_author > 0:
+        edges.write({
+            'source': __taxonomic_unit_label(tsn),
+            'target': __author_label(hybrid_author),
+            'relation': 'author',
+            'metadata': {
+                'author_type': 'hybrid'
+            }
+        })
+
+
+def write_taxonomic_unit_nodes(itis: sqlite3.Connection, nodes: JsonObjectWriter,
+                               kingdom_id: int = DEFAULT_KINGDOM_ID):
+    scan_taxonomic_units(itis, nodes, Discard(), kingdom_id)
+
+
+def write_taxonomic_unit_edges(itis: sqlite3.Connection, edges: JsonArrayWriter,
+                               kingdom_id: int = DEFAULT_KINGDOM_ID):
+    scan_taxonomic_units(itis, Discard(), edges, kingdom_id)
 
 
 def __vernacular_label(vern_id: int) -> str:
     return f'vn-{vern_id}'
 
 
-def write_vernacular_nodes(itis: sqlite3.Connection, nodes: jsonstreams.Object):
-    count = itis.execute('SELECT COUNT(*) FROM taxonomic_units AS tu JOIN vernaculars AS v ON tu.tsn = v.tsn WHERE kingdom_id = 3').fetchone()[0]
-
-    vernaculars = itis.execute('''
-                            SELECT v.vern_id,
-                                   v.update_date,
-                                   v.vernacular_name
-                            FROM taxonomic_units AS tu
-                            JOIN vernaculars AS v ON tu.tsn = v.tsn
-                            WHERE tu.kingdom_id = 3''')
-    for entry in tqdm(vernaculars, desc='Vernaculars', total=count):
-        vern_id = entry[0]
-        update_date = entry[1]
-        name = entry[2]
-
-        with nodes.subobject(__vernacular_label(vern_id)) as vern:
-            vern.write('label', name)
-            with vern.subobject('metadata') as meta:
-                meta.write('type', 'vernacular_name')
-                meta.write('update_date', update_date)
-
-
-def write_vernacular_edges(itis: sqlite3.Connection, edges: jsonstreams.Array):
-    count = itis.execute('SELECT COUNT(*) FROM taxonomic_units AS tu JOIN vernaculars AS v ON tu.tsn = v.tsn WHERE kingdom_id = 3').fetchone()[0]
-    vernaculars = itis.execute('''
-                            SELECT tu.tsn,
-                                   v.vern_id,
-                                   v.language
-                            FROM taxonomic_units AS tu
-                            JOIN vernaculars AS v ON tu.tsn = v.tsn
-                            WHERE tu.kingdom_id = 3''')
-    for entry in tqdm(vernaculars, desc='Vernacular Relationships', total=count):
+VERNACULAR_QUERY = '''
+    SELECT tu.tsn,
+           v.vern_id,
+           v.language,
+           v.update_date,
+           v.vernacular_name
+    FROM taxonomic_units AS tu
+    JOIN vernaculars AS v ON tu.tsn = v.tsn
+    WHERE tu.kingdom_id = :kingdom_id
+    '''
+
+
+def scan_vernaculars(itis: sqlite3.Connection, nodes: JsonObjectWriter, edges: JsonArrayWriter,
+                     kingdom_id: int = DEFAULT_KINGDOM_ID):
+    vernaculars = itis.execute(VERNACULAR_QUERY, {'kingdom_id': kingdom_id})
+    for entry in tqdm(vernaculars, desc='Vernaculars', total=__estimate_rows(itis, 'vernaculars')):
         tsn = entry[0]
         vern_id = entry[1]
         language = entry[2]
+        update_date = entry[3]
+        name = entry[4]
 
-        with edges.subobject() as edge:
-            edge.write('source', __vernacular_label(vern_id))
-            edge.write('target', __taxonomic_unit_label(tsn))
-            edge.write('relation', 'vernacular_of')
+        nodes.write(__vernacular_label(vern_id), {
+            'label': name,
+            'metadata': {
+                'type': 'vernacular_name',
+                'update_date': update_date
+            }
+        })
 
-        with edges.subobject() as edge:
-            edge.write('source', __taxonomic_unit_label(tsn))
-            edge.write('target', __language_label(language))
-            edge.write('relation', 'has_language')
+        edges.write({
+            'source': __vernacular_label(vern_id),
+            'target': __taxonomic_unit_label(tsn),
+            'relation': 'vernacular_of'
+        })
+
+        edges.write({
+            'source': __taxonomic_unit_label(tsn),
+            'target': __language_label(language),
+            'relation': 'has_language'
+        })
+
+
+def write_vernacular_nodes(itis: sqlite3.Connection, nodes: JsonObjectWriter, kingdom_id: int = DEFAULT_KINGDOM_ID):
+    scan_vernaculars(itis, nodes, Discard(), kingdom_id)
+
+
+def write_vernacular_edges(itis: sqlite3.Connection, edges: JsonArrayWriter, kingdom_id: int = DEFAULT_KINGDOM_ID):
+    scan_vernaculars(itis, Discard(), edges, kingdom_id)
 
 
 def __author_label(author_id: int) -> str:
     return f'author-{author_id}'
 
 
-def write_author_nodes(itis: sqlite3.Connection, nodes: jsonstreams.Object):
-    count = itis.execute('SELECT COUNT(*) FROM taxon_authors_lkp WHERE kingdom_id = 3').fetchone()[0]
-    authors = itis.execute('''
-                            SELECT ta.taxon_author_id,
-                                   ta.short_author, ta.taxon_author, ta.update_date,
-                                   s.shortauthor
-                            FROM taxon_authors_lkp AS ta
-                            LEFT JOIN strippedauthor s on ta.taxon_author_id = s.taxon_author_id
-                            WHERE ta.kingdom_id = 3''')
-    for entry in tqdm(authors, desc='Authors', total=count):
+AUTHOR_QUERY = '''
+    SELECT ta.taxon_author_id,
+           ta.short_author, ta.taxon_author, ta.update_date,
+           s.shortauthor
+    FROM taxon_authors_lkp AS ta
+    LEFT JOIN strippedauthor s on ta.taxon_author_id = s.taxon_author_id
+    WHERE ta.kingdom_id = :kingdom_id
+    '''
+
+
+def write_author_nodes(itis: sqlite3.Connection, nodes: JsonObjectWriter, kingdom_id: int = DEFAULT_KINGDOM_ID):
+    authors = itis.execute(AUTHOR_QUERY, {'kingdom_id': kingdom_id})
+    for entry in tqdm(authors, desc='Authors', total=__estimate_rows(itis, 'taxon_authors_lkp')):
         author_id = entry[0]
         short_author = entry[1]
         long_author = entry[2]
@@ -390,78 +482,584 @@ def write_author_nodes(itis: sqlite3.Connection, nodes: jsonstreams.Object):
         stripped = entry[4]
         assert stripped == short_author
 
-        with nodes.subobject(__author_label(author_id)) as author:
-            author.write('label', short_author)
-            with author.subobject('metadata') as meta:
-                meta.write('type', 'author')
-                meta.write('name', long_author)
-                meta.write('update_date', update_date)
+        nodes.write(__author_label(author_id), {
+            'label': short_author,
+            'metadata': {
+                'type': 'author',
+                'name': long_author,
+                'update_date': update_date
+            }
+        })
+
+
+def graph_id(kingdom_name: Optional[str] = None) -> str:
+    return 'itis-042721' if kingdom_name is None else f'itis-042721-{kingdom_name.lower()}'
 
 
-def write_graph_attributes(graph, itis_md5):
-    graph.write('id', 'itis-042721')
+def write_graph_attributes(graph, itis_md5, kingdom_name: Optional[str] = None):
+    # Without a kingdom name this is the graph of the Plantae kingdom, as it has always been written.
+    graph.write('id', graph_id(kingdom_name))
     graph.write('type', 'ITIS')
-    graph.write('label', 'ITIS (2021-04-27)')
+    graph.write('label', 'ITIS (2021-04-27)' if kingdom_name is None else f'ITIS (2021-04-27) {kingdom_name}')
     graph.write('directed', True)
     write_graph_metadata(graph, itis_md5)
 
 
 def write_graph_metadata(graph, itis_md5):
-    with graph.subobject('metadata') as graph_meta:
-        graph_meta.write('created', datetime.datetime.now().isoformat())
-        with graph_meta.subobject('metadata') as source:
-            source.write('type', 'sqlite')
-            source.write('md5', itis_md5)
+    graph.write('metadata', {
+        'created': datetime.datetime.now().isoformat(),
+        'metadata': {
+            'type': 'sqlite',
+            'md5': itis_md5
+        }
+    })
 
 
 def __md5(fname: str) -> str:
     hash_md5 = hashlib.md5()
-    with open(fname, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
+    # Large reads into one buffer; hashlib releases the GIL while hashing them, so other threads keep running.
+    buffer = bytearray(1 << 20)
+    view = memoryview(buffer)
+    with open(fname, "rb", buffering=0) as f:
+        for size in iter(lambda: f.readinto(buffer), 0):
+            hash_md5.update(view[:size])
     return hash_md5.hexdigest()
 
 
-def convert_to_dot(input_file: str, output_file: str):
-    with open(input_file, 'r', encoding='utf-8') as f:
-        j = json.load(f)
+def __start_md5(fname: str, cache: Optional[SectionCache] = None) -> Future:
+    """Hashes a file in a background thread; with a cache, the hash of an unchanged file is looked up instead."""
+    hasher = ThreadPoolExecutor(max_workers=1)
+    future = hasher.submit(__md5, fname) if cache is None else hasher.submit(cache.source_md5, fname, __md5)
+    # The thread exits once the hash is done.
+    hasher.shutdown(wait=False)
+    return future
+
+
+def __wait_md5(future: Future) -> str:
+    with METRICS.stage('md5'):
+        return future.result()
+
+
+def scan_kingdoms(itis: sqlite3.Connection, nodes: JsonObjectWriter, edges: JsonArrayWriter,
+                  kingdom_id: int = DEFAULT_KINGDOM_ID):
+    write_kingdom_nodes(itis, nodes)
+
+
+def scan_geographic_divs(itis: sqlite3.Connection, nodes: JsonObjectWriter, edges: JsonArrayWriter,
+                         kingdom_id: int = DEFAULT_KINGDOM_ID):
+    write_geographic_div_nodes(itis, nodes)
+
+
+def scan_languages(itis: sqlite3.Connection, nodes: JsonObjectWriter, edges: JsonArrayWriter,
+                   kingdom_id: int = DEFAULT_KINGDOM_ID):
+    write_language_nodes(itis, nodes)
+
 
-    graph = j['graph']
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(f'digraph "{graph["id"]}" {{\n')
-        nodes = graph['nodes']
-        for key in nodes:
-            node = nodes[key]
-            f.write(f'"{key}" [label="{node["label"]}"];\n')
+def scan_authors(itis: sqlite3.Connection, nodes: JsonObjectWriter, edges: JsonArrayWriter,
+                 kingdom_id: int = DEFAULT_KINGDOM_ID):
+    write_author_nodes(itis, nodes, kingdom_id)
 
-        edges = graph['edges']
-        for edge in edges:
-            f.write(f'"{edge["source"]}" -> "{edge["target"]}" [label="{edge["relation"]}"];\n')
 
-        f.write('}')
+# Scans in document order. Each reads its tables once and writes both the nodes and the edges
+# found in them; the edges of all scans form the edges array in the same order.
+SCANS = [
+    scan_kingdoms,
+    scan_ranks,
+    scan_geographic_divs,
+    scan_languages,
+    scan_authors,
+    scan_taxonomic_units,
+    scan_vernaculars,
+]
+
+# Scans whose rows all belong to a taxonomic unit; these can be split into TSN ranges.
+RANGED_SCANS = [
+    scan_taxonomic_units,
+    scan_vernaculars,
+]
+
+# Scans of nodes that do not depend on the kingdom; these are read once and shared by all kingdoms.
+SHARED_SCANS = [
+    scan_kingdoms,
+    scan_geographic_divs,
+    scan_languages,
+]
+
+# The queries joining tables, for the query plan report.
+SCAN_QUERIES = {
+    'ranks': RANK_QUERY,
+    'authors': AUTHOR_QUERY,
+    'taxonomic units': TAXONOMIC_UNIT_QUERY,
+    'vernaculars': VERNACULAR_QUERY,
+}
+
+
+def collect_shared_nodes(itis: sqlite3.Connection) -> Dict[str, Dict[str, dict]]:
+    shared = {}
+    for scan in SHARED_SCANS:
+        nodes = NodeCollector()
+        scan(itis, nodes, Discard())
+        shared[scan.__name__] = nodes
+    return shared
+
+
+def read_kingdoms(itis: sqlite3.Connection, kingdom_ids: Optional[List[int]] = None) -> List[Tuple[int, str]]:
+    """Returns the ids and names of the given kingdoms, or of all kingdoms."""
+    kingdoms = itis.execute('SELECT kingdom_id, kingdom_name FROM kingdoms ORDER BY kingdom_id').fetchall()
+    if kingdom_ids is None:
+        return kingdoms
+    names = dict(kingdoms)
+    missing = [kingdom_id for kingdom_id in kingdom_ids if kingdom_id not in names]
+    if missing:
+        raise ValueError(f'Unknown kingdom ids: {missing}')
+    return [(kingdom_id, names[kingdom_id]) for kingdom_id in kingdom_ids]
+
+
+def convert_kingdom(input_path: str, itis_md5: str, kingdom_id: int, kingdom_name: str,
+                    shared_nodes: Dict[str, Dict[str, dict]], json_path: str, dot_path: str,
+                    indent: Optional[int], engine: str, source_mode: str, merged: bool, compression: str = 'none'):
+    """Writes the graph of one kingdom into a JSON Graph document and a DOT file.
+
+    With merged, the JSON is instead written as a fragment of the "graphs" array of a
+    multi-graph document, to be spliced with FragmentSplicer.
+    """
+    itis = open_source(input_path, source_mode)
+    prepare_indexes(itis)
+
+    with open_output(json_path, compression, 'ascii') as json_file, \
+            open_output(dot_path, compression) as dot_file, \
+            contextlib.ExitStack() as stack:
+        if merged:
+            graphs = stack.enter_context(fragment_writer(json_file, 'graphs', indent, indent is not None, engine, depth=1))
+            graph = stack.enter_context(graphs.subobject())
+        else:
+            graph = stack.enter_context(graph_writer(json_file, indent, engine))
+        with DotGraphWriter(dot_file) as dot:
+            convert_itis(itis, itis_md5, FanOut(graph, dot), os.path.dirname(json_path),
+                         kingdom_id, kingdom_name, shared_nodes)
+    itis.close()
+
+
+def convert_kingdoms(input_path: str, itis_md5: str, kingdom_ids: Optional[List[int]], output_prefix: str,
+                     jobs: int, indent: Optional[int] = 2, engine: str = 'jsonstreams', source_mode: str = 'disk',
+                     merged: bool = False, compression: str = 'none'):
+    """Converts several kingdoms in worker processes, one graph per kingdom.
+
+    The nodes that do not depend on the kingdom are read once and passed to every worker. Each kingdom
+    is written to <output_prefix>-<kingdom>.json and .dot, listed in <output_prefix>.manifest.json.
+    With merged, the graphs are instead spliced into the multi-graph document <output_prefix>-kingdoms.json,
+    and the digraphs into <output_prefix>-kingdoms.dot.
+    """
+    itis = open_source(input_path, source_mode)
+    kingdoms = read_kingdoms(itis, kingdom_ids)
+    shared_nodes = collect_shared_nodes(itis)
+    itis.close()
+
+    output_dir = os.path.dirname(os.path.abspath(output_prefix))
+    with tempfile.TemporaryDirectory(dir=output_dir) as fragments, \
+            ProcessPoolExecutor(max_workers=jobs, initializer=__silence_worker) as pool:
+        futures = []
+        for (kingdom_id, kingdom_name) in kingdoms:
+            # Fragments are spliced into the merged document, so only that is compressed.
+            if merged:
+                paths = (os.path.join(fragments, f'{kingdom_id}.json'), os.path.join(fragments, f'{kingdom_id}.dot'))
+            else:
+                paths = (compressed_path(f'{output_prefix}-{kingdom_name.lower()}.json', compression),
+                         compressed_path(f'{output_prefix}-{kingdom_name.lower()}.dot', compression))
+            futures.append((kingdom_id, kingdom_name, paths,
+                            pool.submit(convert_kingdom, input_path, itis_md5, kingdom_id, kingdom_name, shared_nodes,
+                                        *paths, indent, engine, source_mode, merged,
+                                        'none' if merged else compression)))
+
+        progress = tqdm(total=len(futures), desc='Kingdoms')
+        if merged:
+            with open_output(compressed_path(f'{output_prefix}-kingdoms.json', compression), compression, 'ascii') \
+                    as json_file, \
+                    open_output(compressed_path(f'{output_prefix}-kingdoms.dot', compression), compression) as dot_file:
+                with jsonstreams.Stream(jsonstreams.Type.OBJECT, fd=json_file, indent=indent, pretty=indent is not None,
+                                        close_fd=False) as s, s.subarray('graphs'):
+                    splicer = FragmentSplicer(json_file, 'graphs', indent, indent is not None, depth=1)
+                    for (i, (_, _, (json_path, dot_path), future)) in enumerate(futures):
+                        future.result()
+                        splicer.splice(json_path)
+                        with open(dot_path, 'r', encoding='utf-8') as f:
+                            dot_file.write(('\n' if i else '') + f.read())
+                        os.remove(json_path)
+                        os.remove(dot_path)
+                        progress.update()
+        else:
+            graphs = []
+            for (kingdom_id, kingdom_name, (json_path, dot_path), future) in futures:
+                future.result()
+                graphs.append({
+                    'id': graph_id(kingdom_name),
+                    'kingdom_id': kingdom_id,
+                    'kingdom': kingdom_name,
+                    'json': os.path.basename(json_path),
+                    'dot': os.path.basename(dot_path),
+                })
+                progress.update()
+            with open(f'{output_prefix}.manifest.json', 'w', encoding='utf-8') as f:
+                json.dump({
+                    'created': datetime.datetime.now().isoformat(),
+                    'source': os.path.basename(input_path),
+                    'md5': itis_md5,
+                    'graphs': graphs,
+                }, f, indent=2)
+        progress.close()
+
+
+def restrict_to_tsn_range(itis: sqlite3.Connection, first_tsn: int, last_tsn: int):
+    # Unqualified table names resolve to the temp schema first, so all queries only see this range.
+    itis.execute(f'''
+        CREATE TEMP VIEW taxonomic_units AS
+        SELECT * FROM main.taxonomic_units
+        WHERE tsn BETWEEN {int(first_tsn)} AND {int(last_tsn)}''')
+
+
+def split_tsn_ranges(itis: sqlite3.Connection, count: int, kingdom_id: int = DEFAULT_KINGDOM_ID) -> List[Tuple[int, int]]:
+    total = itis.execute('SELECT COUNT(*) FROM taxonomic_units WHERE kingdom_id = ?', (kingdom_id,)).fetchone()[0]
+    if total == 0:
+        return [(0, 0)]
+    bounds = [itis.execute('SELECT tsn FROM taxonomic_units WHERE kingdom_id = ? ORDER BY tsn LIMIT 1 OFFSET ?',
+                           (kingdom_id, total * i // count)).fetchone()[0]
+              for i in range(count)]
+    bounds = sorted(set(bounds))
+    return [(first, bounds[i + 1] - 1) for (i, first) in enumerate(bounds[:-1])] + [(bounds[-1], sys.maxsize)]
+
+
+def __silence_worker():
+    # Progress bars of several processes would garble each other; progress is reported per fragment instead.
+    sys.stderr = open(os.devnull, 'w')
+
+
+# The connection of a fragment worker process to the dump, opened once by __start_fragment_worker.
+__fragment_source: Optional[sqlite3.Connection] = None
+
+
+def __start_fragment_worker(input_path: str, source_mode: str, index_path: Optional[str]):
+    """Opens the dump for all fragments rendered by this worker process.
+
+    index_path names a database of prepare_index_database to attach; without one, the connection
+    gets its own indexes, as an in-memory copy of the dump does.
+    """
+    global __fragment_source
+    __silence_worker()
+    __fragment_source = open_source(input_path, source_mode)
+    if index_path is None:
+        prepare_indexes(__fragment_source)
+    else:
+        attach_index_database(__fragment_source, index_path)
+
+
+def render_fragment(scan: Callable, tsn_range: Optional[Tuple[int, int]], paths: Dict[str, Tuple[str, str]],
+                    indent: Optional[int], pretty: bool, engine: str = 'jsonstreams',
+                    hierarchy_path: Optional[str] = None, synonyms_path: Optional[str] = None,
+                    metrics: bool = False) -> Optional[Dict[str, dict]]:
+    """Writes the nodes and edges of a scan into the JSON and DOT fragment files named in paths by section.
+
+    Runs in a worker process started by __start_fragment_worker. The files are written under a .partial
+    suffix and renamed once complete. With metrics, returns the measurements of the scan as a stage.
+    """
+    if metrics:
+        METRICS.enable()
+    itis = __fragment_source
+    if tsn_range is not None:
+        restrict_to_tsn_range(itis, *tsn_range)
+
+    ((nodes_json, nodes_dot), (edges_json, edges_dot)) = [[f'{path}.partial' for path in paths[section]]
+                                                          for section in ('nodes', 'edges')]
+    try:
+        with open(nodes_json, 'w', encoding='ascii') as nodes_json_file, \
+                open(nodes_dot, 'w', encoding='utf-8') as nodes_dot_file, \
+                open(edges_json, 'w', encoding='ascii') as edges_json_file, \
+                open(edges_dot, 'w', encoding='utf-8') as edges_dot_file, \
+                METRICS.stage(scan.__name__) as stage:
+            with fragment_writer(METRICS.output(nodes_json_file), 'nodes', indent, pretty, engine) as nodes, \
+                    fragment_writer(METRICS.output(edges_json_file), 'edges', indent, pretty, engine) as edges:
+                nodes = FanOut(nodes, DotNodeWriter(METRICS.output(nodes_dot_file)))
+                if hierarchy_path is not None:
+                    nodes = HierarchyNodeWriter(nodes, HierarchyIndex.load(hierarchy_path))
+                if synonyms_path is not None:
+                    nodes = AcceptedNodeWriter(nodes, SynonymTable.load(synonyms_path))
+                scan(METRICS.connection(itis, stage), METRICS.writer(nodes, stage),
+                     METRICS.writer(FanOut(edges, DotEdgeWriter(METRICS.output(edges_dot_file))), stage))
+    finally:
+        # The connection renders the next fragments of this worker.
+        if tsn_range is not None:
+            itis.execute('DROP VIEW temp.taxonomic_units')
+    for section in ('nodes', 'edges'):
+        for path in paths[section]:
+            os.replace(f'{path}.partial', path)
+    return {scan.__name__: stage.as_dict()} if metrics else None
+
+
+def __splice_fragments(json_file, dot_file, section: str, fragments: list, indent: Optional[int], pretty: bool,
+                       progress: tqdm, keep: bool = False):
+    # Fragments found in a cache have no future.
+    splicer = FragmentSplicer(json_file, section, indent, pretty)
+    for (paths, future) in fragments:
+        if future is not None:
+            future.result()
+        (json_path, dot_path) = paths[section]
+        splicer.splice(json_path)
+        with open(dot_path, 'r', encoding='utf-8') as f:
+            dot_file.write(f.read())
+        if not keep:
+            os.remove(json_path)
+            os.remove(dot_path)
+        progress.update()
+
+
+def convert_itis_parallel(input_path: str, itis_md5: str, json_file, dot_file, jobs: int,
+                          indent: Optional[int] = 2, pretty: bool = True, engine: str = 'jsonstreams',
+                          source_mode: str = 'disk', hierarchy_path: Optional[str] = None,
+                          synonyms_path: Optional[str] = None, cache: Optional[SectionCache] = None):
+    """Runs the scans of the graph in worker processes and splices the fragments into one document.
+
+    Each scan, and each TSN range of the large scans, is run by a worker with its own read-only
+    connection, writing its nodes and its edges into fragment files. The result is identical to
+    convert_itis. hierarchy_path and synonyms_path name a saved HierarchyIndex and SynonymTable to
+    annotate the taxonomic units with. With a cache, fragments rendered before from the same dump,
+    converter and options are spliced from it, and the others are rendered into it; the large scans
+    are then split into ranges of RANGE_UNITS units instead of 4 * jobs ranges, so the fragments do
+    not depend on jobs.
+    """
+    itis = connect_read_only(input_path)
+    if cache is None:
+        tsn_ranges = split_tsn_ranges(itis, 4 * jobs)
+    else:
+        total = itis.execute('SELECT COUNT(*) FROM taxonomic_units WHERE kingdom_id = ?',
+                             (DEFAULT_KINGDOM_ID,)).fetchone()[0]
+        tsn_ranges = split_tsn_ranges(itis, max(1, (total + RANGE_UNITS - 1) // RANGE_UNITS))
+    itis.close()
+
+    tasks = []
+    for scan in SCANS:
+        for tsn_range in (tsn_ranges if scan in RANGED_SCANS else [None]):
+            tasks.append((scan, tsn_range))
+
+    options = {'indent': indent, 'pretty': pretty, 'engine': engine,
+               'hierarchy': hierarchy_path is not None, 'synonyms': synonyms_path is not None}
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(json_file.name))) as fragments, \
+            contextlib.ExitStack() as stack:
+        rendered = []
+        for (i, (scan, tsn_range)) in enumerate(tasks):
+            if cache is None:
+                paths = {section: (os.path.join(fragments, f'{i}.{section}.json'),
+                                   os.path.join(fragments, f'{i}.{section}.dot'))
+                         for section in ('nodes', 'edges')}
+            else:
+                key = cache.key(itis_md5, scan.__name__, tsn_range, options)
+                paths = cache.paths(key)
+                if cache.contains(key):
+                    rendered.append((scan, tsn_range, paths, False))
+                    continue
+            rendered.append((scan, tsn_range, paths, True))
+
+        # The tables lacking an index are copied and indexed once for all workers; an in-memory copy of
+        # the dump is made by each worker anyway, and indexed in place.
+        pool = None
+        if any(render for (_, _, _, render) in rendered):
+            index_path = None
+            if source_mode != 'memory':
+                index_path = os.path.join(fragments, 'indexes.sqlite')
+                prepare_index_database(input_path, index_path)
+            pool = stack.enter_context(ProcessPoolExecutor(max_workers=jobs, initializer=__start_fragment_worker,
+                                                           initargs=(input_path, source_mode, index_path)))
+        futures = [(paths, pool.submit(render_fragment, scan, tsn_range, paths, indent, pretty, engine,
+                                       hierarchy_path, synonyms_path, METRICS.enabled) if render else None)
+                   for (scan, tsn_range, paths, render) in rendered]
+
+        with jsonstreams.Stream(jsonstreams.Type.OBJECT, fd=json_file, indent=indent, pretty=pretty,
+                                close_fd=False) as s:
+            with s.subobject('graph') as graph, DotGraphWriter(dot_file) as dot:
+                write_graph_attributes(FanOut(JsonObjectWriter(graph), dot), itis_md5)
+                progress = tqdm(total=2 * len(futures), desc='Fragments')
+                with graph.subobject('nodes'), dot.subobject('nodes'), METRICS.stage('splice nodes'):
+                    __splice_fragments(json_file, dot_file, 'nodes', futures, indent, pretty, progress,
+                                       cache is not None)
+                with graph.subarray('edges'), dot.subarray('edges'), METRICS.stage('splice edges'):
+                    __splice_fragments(json_file, dot_file, 'edges', futures, indent, pretty, progress,
+                                       cache is not None)
+                progress.close()
+
+        # The stages of the workers add up over the TSN ranges of a scan, so their times are CPU time.
+        for (_, future) in futures:
+            if future is not None:
+                METRICS.merge(future.result() or {})
+
+
+def convert_to_dot(input_file: str, output_file: str, compression: Optional[str] = None):
+    """Converts a JSON Graph document into DOT.
+
+    The input may be compressed with gzip or zstd. The output is compressed as given, or according
+    to the extension of output_file.
+    """
+    # The JSON is read back incrementally, so only a single node or edge is held in memory at a time.
+    with open_input(input_file) as f, open_output(output_file, compression) as out:
+        with DotGraphWriter(out) as dot:
+            copy_graph(f, dot)
+
+
+def __validate(json_path: str) -> bool:
+    with METRICS.stage('validate'):
+        report = validate_graph(json_path)
+    report.print()
+    return report.valid
+
+
+def __parse_kingdoms(value: str):
+    return 'all' if value == 'all' else [int(kingdom_id) for kingdom_id in value.split(',')]
+
+
+# Options exporting, annotating, measuring, checking or caching the conversion of a single graph.
+SINGLE_GRAPH_OPTIONS = ['csr', 'ndjson', 'hierarchy', 'accepted', 'metrics', 'validate', 'cache']
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Converts the ITIS database to JSON Graph and DOT.')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of worker processes rendering sections of the graph, or kingdoms, in parallel')
+    parser.add_argument('--engine', choices=ENGINES, default='jsonstreams',
+                        help='how nodes and edges are serialised; "fast" encodes each of them in one shot '
+                             'and writes the same bytes as "jsonstreams"')
+    parser.add_argument('--compact', action='store_true', help='write the JSON without indentation')
+    parser.add_argument('--source-mode', choices=SOURCE_MODES, default='disk',
+                        help='read the dump from disk, map it into memory, or copy it into memory first')
+    parser.add_argument('--kingdoms', type=__parse_kingdoms,
+                        help='comma separated ITIS kingdom ids, or "all"; converts each kingdom into its own graph, '
+                             'using up to --jobs worker processes, and writes a manifest')
+    parser.add_argument('--merged', action='store_true',
+                        help='with --kingdoms, write one multi-graph document instead of a file per kingdom')
+    parser.add_argument('--compression', choices=COMPRESSIONS, default='none',
+                        help='compress the .json and .dot outputs in a background thread')
+    parser.add_argument('--csr', metavar='DIR',
+                        help='also export the graph as memory-mappable CSR arrays into this directory')
+    parser.add_argument('--ndjson', metavar='DIR',
+                        help='also write the nodes and edges as sharded newline-delimited JSON with an index of the '
+                             'byte offset of each node into this directory')
+    parser.add_argument('--hierarchy', action='store_true',
+                        help='build the nested set and Euler tour index of the hierarchy, save it next to the '
+                             'output and add the numbering of each taxonomic unit to its metadata')
+    parser.add_argument('--accepted', action='store_true',
+                        help='resolve every taxonomic unit to its accepted unit, save the table next to the output '
+                             'and add the accepted TSN to the metadata of each unit')
+    parser.add_argument('--metrics', metavar='PATH',
+                        help='record wall time, rows, bytes, SQLite and writer time and peak memory per stage and '
+                             'write them to PATH, in the Prometheus text format if it ends with .prom, as JSON otherwise')
+    parser.add_argument('--cache', metavar='DIR',
+                        help='keep the rendered sections of the graph in this directory, keyed on the MD5 of the dump, '
+                             'the converter and the options, and reuse them in later runs; renders through worker '
+                             'processes like --jobs')
+    parser.add_argument('--validate', action='store_true',
+                        help='check the written document against the JSON Graph schema, for unique node keys and '
+                             'for edges between existing nodes, and exit with status 1 if it is invalid')
+    parser.add_argument('--dot-from', metavar='JSON',
+                        help='only convert this JSON Graph document, which may be compressed, into DOT')
+    args = parser.parse_args()
+    if args.source_mode == 'memory' and args.jobs > 1:
+        parser.error('--source-mode memory would copy the database into every worker; use disk or mmap with --jobs')
+    single_graph = [f'--{option}' for option in SINGLE_GRAPH_OPTIONS if getattr(args, option)]
+    if single_graph and args.kingdoms is not None:
+        parser.error(f'{", ".join(single_graph)} only apply to a single graph and cannot be combined with --kingdoms; '
+                     f'convert the kingdoms one at a time, or run validate_graph.py on the graph of each kingdom')
+    if args.cache and args.source_mode == 'memory':
+        parser.error('--cache renders through worker processes; use disk or mmap with --cache')
+    if args.metrics:
+        METRICS.enable()
+    indent = None if args.compact else 2
+
     INPUT_DB = 'ITIS-042721.sqlite'
     OUTPUT_JSON = 'ITIS-042721.json'
     OUTPUT_DOT = 'ITIS-042721.dot'
 
-    input_path = os.path.join('data', INPUT_DB)
-    md5 = __md5(input_path)
-
-    # itis_disk = sqlite3.connect(input_path)
-    # itis = sqlite3.connect(':memory:')
-    # itis_disk.backup(itis)
-    # itis_disk.close()
-    itis = sqlite3.connect(input_path)
+    if args.dot_from:
+        name = os.path.basename(args.dot_from).split('.json')[0]
+        convert_to_dot(args.dot_from, compressed_path(os.path.join(os.path.dirname(args.dot_from), f'{name}.dot'),
+                                                      args.compression), args.compression)
+        return
 
+    input_path = os.path.join('data', INPUT_DB)
+    cache = None if args.cache is None else SectionCache(args.cache)
+    # The dump is hashed while the indexes and annotations are prepared.
+    md5 = __start_md5(input_path, cache)
     output_path = os.path.join('data', OUTPUT_JSON)
-
-    with jsonstreams.Stream(jsonstreams.Type.OBJECT, filename=output_path, indent=2, pretty=True) as s:
-        with s.subobject('graph') as graph:
-            convert_itis(itis, md5, graph)
-
-    convert_to_dot(output_path, os.path.join('data', OUTPUT_DOT))
+    json_path = compressed_path(output_path, args.compression)
+    dot_path = compressed_path(os.path.join('data', OUTPUT_DOT), args.compression)
+
+    if args.kingdoms is not None:
+        convert_kingdoms(input_path, __wait_md5(md5), None if args.kingdoms == 'all' else args.kingdoms,
+                         os.path.splitext(output_path)[0], args.jobs, indent, args.engine, args.source_mode, args.merged,
+                         args.compression)
+        return
+
+    hierarchy = None
+    hierarchy_path = None
+    if args.hierarchy:
+        itis = connect_read_only(input_path)
+        hierarchy = build_hierarchy_index(itis, DEFAULT_KINGDOM_ID)
+        itis.close()
+        hierarchy_path = os.path.splitext(output_path)[0] + '.hierarchy.npz'
+        hierarchy.save(hierarchy_path)
+
+    synonyms = None
+    synonyms_path = None
+    if args.accepted:
+        itis = connect_read_only(input_path)
+        synonyms = build_synonym_table(itis, DEFAULT_KINGDOM_ID)
+        itis.close()
+        synonyms_path = os.path.splitext(output_path)[0] + '.synonyms.npz'
+        synonyms.save(synonyms_path)
+
+    if args.jobs > 1 or cache is not None:
+        with open_output(json_path, args.compression, 'ascii') as json_file, \
+                open_output(dot_path, args.compression) as dot_file:
+            convert_itis_parallel(input_path, __wait_md5(md5), METRICS.output(json_file), METRICS.output(dot_file),
+                                  args.jobs,
+                                  indent=indent, pretty=not args.compact, engine=args.engine,
+                                  source_mode=args.source_mode, hierarchy_path=hierarchy_path,
+                                  synonyms_path=synonyms_path, cache=cache)
+        if cache is not None:
+            cache.prune()
+        # The fragments are rendered in the workers, so the CSR arrays and the NDJSON shards are built from the
+        # spliced document.
+        if args.csr:
+            with METRICS.stage('csr'):
+                export_csr(json_path, args.csr)
+        if args.ndjson:
+            with METRICS.stage('ndjson'):
+                export_ndjson(json_path, args.ndjson)
+        valid = not args.validate or __validate(json_path)
+        if args.metrics:
+            METRICS.save(args.metrics)
+        if not valid:
+            sys.exit(1)
+        return
+
+    itis = open_source(input_path, args.source_mode)
+    with METRICS.stage('prepare indexes'):
+        created = prepare_indexes(itis)
+    print_query_plans(itis, args.source_mode, SCAN_QUERIES, created, {'kingdom_id': DEFAULT_KINGDOM_ID})
+
+    # The DOT file is written in the same pass as the JSON, so the graph is never held in memory.
+    with open_output(json_path, args.compression, 'ascii') as json_file, \
+            open_output(dot_path, args.compression) as dot_file, \
+            contextlib.ExitStack() as stack:
+        graph = stack.enter_context(graph_writer(METRICS.output(json_file), indent, args.engine))
+        targets = [graph, stack.enter_context(DotGraphWriter(METRICS.output(dot_file)))]
+        if args.csr:
+            targets.append(stack.enter_context(CsrGraphWriter(args.csr)))
+        if args.ndjson:
+            targets.append(stack.enter_context(NdjsonGraphWriter(args.ndjson)))
+        convert_itis(itis, __wait_md5(md5), FanOut(*targets), spool_dir=os.path.dirname(output_path),
+                     hierarchy=hierarchy, synonyms=synonyms)
+    valid = not args.validate or __validate(json_path)
+    if args.metrics:
+        METRICS.save(args.metrics)
+    if not valid:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
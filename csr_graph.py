@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# --coding:utf-8--
+
+import os
+import json
+import array
+import numpy as np
+from typing import Iterator, List, Optional, Tuple
+
+from compression import open_input
+from jsongraph import copy_graph
+
+MANIFEST = 'graph.json'
+
+# Written for every node in the order the nodes were written; node ids are indices into these.
+NODE_ID_DTYPE = np.int32
+OFFSET_DTYPE = np.int64
+NO_TSN = -1
+
+DIRECTIONS = ['out', 'in']
+
+
+def write_string_table(directory: str, name: str, values: List[str]):
+    """Writes strings as one UTF-8 blob, <name>.bin, and the offsets of each string within it."""
+    offsets = np.zeros(len(values) + 1, dtype=OFFSET_DTYPE)
+    with open(os.path.join(directory, f'{name}.bin'), 'wb') as f:
+        position = 0
+        for (i, value) in enumerate(values):
+            encoded = value.encode('utf-8')
+            f.write(encoded)
+            position += len(encoded)
+            offsets[i + 1] = position
+    np.save(os.path.join(directory, f'{name}.offsets.npy'), offsets)
+
+
+class StringTable:
+    """A memory-mapped string table written by write_string_table."""
+
+    def __init__(self, directory: str, name: str):
+        path = os.path.join(directory, f'{name}.bin')
+        # An empty file cannot be mapped.
+        self.blob = np.memmap(path, dtype=np.uint8, mode='r') if os.path.getsize(path) else np.zeros(0, dtype=np.uint8)
+        self.offsets = np.load(os.path.join(directory, f'{name}.offsets.npy'), mmap_mode='r')
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def bytes(self, i: int) -> bytes:
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+    def __getitem__(self, i: int) -> str:
+        return self.bytes(i).decode('utf-8')
+
+
+class CsrNodeWriter:
+    def __init__(self, graph: 'CsrGraphWriter'):
+        self.graph = graph
+
+    def write(self, key: str, node: dict):
+        self.graph.add_node(key, node)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, evalue, traceback):
+        pass
+
+
+class CsrEdgeWriter:
+    def __init__(self, graph: 'CsrGraphWriter'):
+        self.graph = graph
+
+    def write(self, edge: dict):
+        self.graph.add_edge(edge)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, evalue, traceback):
+        pass
+
+
+class CsrGraphWriter:
+    """Writes the nodes and edges of a graph into a directory of flat arrays that can be memory-mapped.
+
+    Nodes get dense ids in the order they are written. Their keys and labels are stored in string tables,
+    their TSNs in an array. The edges of each relation are stored in compressed sparse row form, once by
+    source and once by target. Edge metadata is not exported. Edges to keys that are not nodes of the graph
+    (such as the parent of a root unit) get a node with an empty label.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.attributes = {}
+        self.ids = {}
+        self.keys = []
+        self.labels = []
+        self.tsns = array.array('q')
+        self.edges = {}
+
+    def write(self, key: str, value):
+        self.attributes[key] = value
+
+    def add_node(self, key: str, node: dict):
+        # Of several nodes with the same key, the first is kept, as in the index of ndjson_graph.
+        if key in self.ids:
+            return
+        self.ids[key] = len(self.keys)
+        self.keys.append(key)
+        self.labels.append(node.get('label') or '')
+        self.tsns.append(node.get('metadata', {}).get('tsn', NO_TSN))
+
+    def __node_id(self, key: str) -> int:
+        node_id = self.ids.get(key)
+        if node_id is None:
+            node_id = len(self.keys)
+            self.add_node(key, {})
+        return node_id
+
+    def add_edge(self, edge: dict):
+        if edge['relation'] not in self.edges:
+            self.edges[edge['relation']] = (array.array('i'), array.array('i'))
+        (sources, targets) = self.edges[edge['relation']]
+        sources.append(self.__node_id(edge['source']))
+        targets.append(self.__node_id(edge['target']))
+
+    def subobject(self, key: str) -> CsrNodeWriter:
+        assert key == 'nodes', key
+        return CsrNodeWriter(self)
+
+    def subarray(self, key: str) -> CsrEdgeWriter:
+        assert key == 'edges', key
+        return CsrEdgeWriter(self)
+
+    @staticmethod
+    def __csr(directory: str, name: str, sources: np.ndarray, targets: np.ndarray, node_count: int):
+        """Writes edges as offsets into the targets, grouped by source and in the order they were written."""
+        order = np.argsort(sources, kind='stable')
+        offsets = np.zeros(node_count + 1, dtype=OFFSET_DTYPE)
+        np.cumsum(np.bincount(sources, minlength=node_count), out=offsets[1:])
+        np.save(os.path.join(directory, f'{name}.offsets.npy'), offsets)
+        np.save(os.path.join(directory, f'{name}.targets.npy'), targets[order].astype(NODE_ID_DTYPE))
+
+    def close(self):
+        os.makedirs(self.directory, exist_ok=True)
+        node_count = len(self.keys)
+        write_string_table(self.directory, 'keys', self.keys)
+        write_string_table(self.directory, 'labels', self.labels)
+        tsns = np.frombuffer(self.tsns, dtype=np.int64)
+        np.save(os.path.join(self.directory, 'tsn.npy'), tsns)
+        # Node ids of the taxonomic units ordered by TSN, for lookups with a binary search.
+        by_tsn = np.flatnonzero(tsns != NO_TSN)
+        by_tsn = by_tsn[np.argsort(tsns[by_tsn], kind='stable')].astype(NODE_ID_DTYPE)
+        np.save(os.path.join(self.directory, 'tsn.index.npy'), by_tsn)
+        np.save(os.path.join(self.directory, 'tsn.sorted.npy'), tsns[by_tsn])
+        np.save(os.path.join(self.directory, 'keys.index.npy'),
+                np.array(sorted(range(node_count), key=self.keys.__getitem__), dtype=NODE_ID_DTYPE))
+
+        relations = {}
+        for (relation, (sources, targets)) in self.edges.items():
+            sources = np.frombuffer(sources, dtype=np.int32)
+            targets = np.frombuffer(targets, dtype=np.int32)
+            self.__csr(self.directory, f'{relation}.out', sources, targets, node_count)
+            self.__csr(self.directory, f'{relation}.in', targets, sources, node_count)
+            relations[relation] = len(sources)
+
+        with open(os.path.join(self.directory, MANIFEST), 'w', encoding='utf-8') as f:
+            json.dump({
+                'attributes': self.attributes,
+                'nodes': node_count,
+                'relations': relations,
+            }, f, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, evalue, traceback):
+        if etype is None:
+            self.close()
+
+
+def export_csr(json_path: str, directory: str):
+    """Exports a JSON Graph document, which may be compressed, into a CSR directory."""
+    with open_input(json_path) as f, CsrGraphWriter(directory) as csr:
+        copy_graph(f, csr)
+
+
+class CsrGraph:
+    """Reads a graph written by CsrGraphWriter.
+
+    All arrays are memory-mapped read-only, so opening the graph does not read it and the
+    neighbours returned are views into the mapped files rather than copies.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        self.attributes = manifest['attributes']
+        self.node_count = manifest['nodes']
+        self.relations = manifest['relations']
+        self.keys = StringTable(directory, 'keys')
+        self.labels = StringTable(directory, 'labels')
+        self.tsns = self.__array('tsn.npy')
+        self.tsn_index = self.__array('tsn.index.npy')
+        self.sorted_tsns = self.__array('tsn.sorted.npy')
+        self.key_index = self.__array('keys.index.npy')
+        self.adjacency = {(relation, direction): (self.__array(f'{relation}.{direction}.offsets.npy'),
+                                                  self.__array(f'{relation}.{direction}.targets.npy'))
+                          for relation in self.relations for direction in DIRECTIONS}
+
+    def __array(self, name: str) -> np.ndarray:
+        return np.load(os.path.join(self.directory, name), mmap_mode='r')
+
+    def __len__(self) -> int:
+        return self.node_count
+
+    def key(self, node: int) -> str:
+        return self.keys[node]
+
+    def label(self, node: int) -> str:
+        return self.labels[node]
+
+    def tsn(self, node: int) -> Optional[int]:
+        tsn = int(self.tsns[node])
+        return None if tsn == NO_TSN else tsn
+
+    def node(self, key: str) -> Optional[int]:
+        """Returns the id of the node with the given key, or None."""
+        (low, high) = (0, self.node_count)
+        while low < high:
+            middle = (low + high) // 2
+            if self.key(self.key_index[middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.node_count and self.key(self.key_index[low]) == key:
+            return int(self.key_index[low])
+        return None
+
+    def node_by_tsn(self, tsn: int) -> Optional[int]:
+        """Returns the id of the taxonomic unit with the given TSN, or None."""
+        position = int(np.searchsorted(self.sorted_tsns, tsn))
+        if position < len(self.sorted_tsns) and self.sorted_tsns[position] == tsn:
+            return int(self.tsn_index[position])
+        return None
+
+    def neighbours(self, node: int, relation: str, direction: str = 'out') -> np.ndarray:
+        """Returns the ids of the nodes connected to a node by a relation, as a view into the mapped targets.
+
+        With direction 'out' these are the targets of the edges from the node, with 'in' the sources
+        of the edges to it. Relations without edges have no neighbours.
+        """
+        assert direction in DIRECTIONS, direction
+        if relation not in self.relations:
+            return np.zeros(0, dtype=NODE_ID_DTYPE)
+        (offsets, targets) = self.adjacency[(relation, direction)]
+        return targets[offsets[node]:offsets[node + 1]]
+
+    def edges(self, node: int, relations: Optional[List[str]] = None,
+              direction: str = 'out') -> Iterator[Tuple[str, np.ndarray]]:
+        """Yields the relations of a node together with its neighbours by each, optionally only the given relations."""
+        for relation in self.relations if relations is None else relations:
+            neighbours = self.neighbours(node, relation, direction)
+            if len(neighbours):
+                yield relation, neighbours
+
+    def degrees(self, relation: str, direction: str = 'out') -> np.ndarray:
+        (offsets, _) = self.adjacency[(relation, direction)]
+        return np.diff(offsets)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# --coding:utf-8--
+
+import sqlite3
+import argparse
+from typing import List, Optional
+
+import convert_itis_to_jsongraph as converter
+from compression import COMPRESSIONS, open_output
+from hierarchy_index import HierarchyIndex, build_hierarchy_index
+from itis_source import connect_read_only, open_source, prepare_indexes
+from jsongraph import Discard, DotGraphWriter
+from validate_graph import KeySet
+
+# The scans writing the edges of each relation, and the scans writing the nodes at their ends.
+RELATION_SCANS = {
+    'uses': ([converter.scan_ranks], [converter.scan_kingdoms, converter.scan_ranks]),
+    'direct_parent_of': ([converter.scan_ranks], [converter.scan_ranks]),
+    'required_parent_of': ([converter.scan_ranks], [converter.scan_ranks]),
+    'parent_of': ([converter.scan_taxonomic_units], [converter.scan_taxonomic_units]),
+    'has_rank': ([converter.scan_taxonomic_units], [converter.scan_ranks, converter.scan_taxonomic_units]),
+    'synonym_of': ([converter.scan_taxonomic_units], [converter.scan_taxonomic_units]),
+    'has_geographic_div': ([converter.scan_taxonomic_units],
+                           [converter.scan_geographic_divs, converter.scan_taxonomic_units]),
+    'author': ([converter.scan_taxonomic_units], [converter.scan_authors, converter.scan_taxonomic_units]),
+    'vernacular_of': ([converter.scan_vernaculars], [converter.scan_taxonomic_units, converter.scan_vernaculars]),
+    'has_language': ([converter.scan_vernaculars], [converter.scan_languages, converter.scan_taxonomic_units]),
+}
+
+# Units looked up per query; below the default limit of SQLite on bound parameters.
+LOOKUP_BATCH = 500
+
+
+def write_rank_overview(itis: sqlite3.Connection, dot: DotGraphWriter, kingdom_id: int = converter.DEFAULT_KINGDOM_ID):
+    """Writes one node per rank with the number of its units, and the parent_of edges between units counted by ranks."""
+    dot.write('id', f'itis-ranks-{kingdom_id}')
+    ranks = itis.execute('''
+        SELECT r.rank_id, r.rank_name, COUNT(tu.tsn)
+        FROM taxon_unit_types AS r
+        LEFT JOIN main.taxonomic_units AS tu ON tu.kingdom_id = r.kingdom_id AND tu.rank_id = r.rank_id
+        WHERE r.kingdom_id = ?
+        GROUP BY r.rank_id ORDER BY r.rank_id''', (kingdom_id,))
+    with dot.subobject('nodes') as nodes:
+        for (rank_id, rank_name, count) in ranks:
+            nodes.write(f'rank-{kingdom_id}.{rank_id}', {'label': f'{rank_name} ({count})'})
+
+    links = itis.execute('''
+        SELECT parent.rank_id, child.rank_id, COUNT(*)
+        FROM main.taxonomic_units AS child
+        JOIN main.taxonomic_units AS parent ON parent.tsn = child.parent_tsn
+        WHERE child.kingdom_id = ?
+        GROUP BY parent.rank_id, child.rank_id ORDER BY parent.rank_id, child.rank_id''', (kingdom_id,))
+    with dot.subarray('edges') as edges:
+        for (parent_rank_id, rank_id, count) in links:
+            edges.write({
+                'source': f'rank-{kingdom_id}.{parent_rank_id}',
+                'target': f'rank-{kingdom_id}.{rank_id}',
+                'relation': f'parent_of ({count})',
+            })
+
+
+def write_subtree(itis: sqlite3.Connection, dot: DotGraphWriter, index: HierarchyIndex, tsn: int,
+                  max_depth: Optional[int] = None):
+    """Writes the units below a unit down to max_depth levels, with the parent_of edges between them.
+
+    The units are found in the hierarchy index; only their names are read from SQLite. Units at the
+    cutoff are labelled with the number of units below them.
+    """
+    dot.write('id', f'itis-subtree-{tsn}')
+    root = index.position(tsn)
+    start = index.pre[root]
+    positions = index.preorder[start:start + index.size[root]]
+    if max_depth is not None:
+        positions = positions[index.depth[positions] <= index.depth[root] + max_depth]
+    tsns = index.tsns[positions].tolist()
+    below = {int(index.tsns[position]): int(index.size[position]) - 1 for position in positions.tolist()
+             if max_depth is not None and index.depth[position] == index.depth[root] + max_depth}
+
+    with dot.subobject('nodes') as nodes:
+        for first in range(0, len(tsns), LOOKUP_BATCH):
+            batch = tsns[first:first + LOOKUP_BATCH]
+            names = dict(itis.execute(f'SELECT tsn, complete_name FROM main.taxonomic_units '
+                                      f'WHERE tsn IN ({",".join("?" * len(batch))})', batch))
+            for unit in batch:
+                label = names.get(unit, str(unit))
+                if below.get(unit):
+                    label = f'{label} (+{below[unit]})'
+                nodes.write(f'tu-{unit}', {'label': label})
+
+    with dot.subarray('edges') as edges:
+        for position in positions[1:].tolist():
+            edges.write({
+                'source': f'tu-{int(index.tsns[index.parents[position]])}',
+                'target': f'tu-{int(index.tsns[position])}',
+                'relation': 'parent_of',
+            })
+
+
+class RelationFilter:
+    """Passes on the edges of the given relations and collects the keys of their ends."""
+
+    def __init__(self, edges, relations: List[str], ends: KeySet):
+        self.edges = edges
+        self.relations = set(relations)
+        self.ends = ends
+
+    def write(self, edge: dict):
+        if edge['relation'] in self.relations:
+            self.ends.add(edge['source'])
+            self.ends.add(edge['target'])
+            self.edges.write(edge)
+
+
+class KeyFilter:
+    """Passes on the nodes whose keys are in a set."""
+
+    def __init__(self, nodes, keys: KeySet):
+        self.nodes = nodes
+        self.keys = keys
+
+    def write(self, key: str, node: dict):
+        if key in self.keys:
+            self.nodes.write(key, node)
+
+
+def __ordered_scans(scans: set) -> list:
+    return [scan for scan in converter.SCANS if scan in scans]
+
+
+def write_relations(itis: sqlite3.Connection, dot: DotGraphWriter, relations: List[str],
+                    kingdom_id: int = converter.DEFAULT_KINGDOM_ID):
+    """Writes the edges of the given relations and the nodes at their ends.
+
+    Only the scans writing these edges are run, and then the scans writing their end nodes, keeping
+    the nodes that are ends of an edge.
+    """
+    unknown = [relation for relation in relations if relation not in RELATION_SCANS]
+    if unknown:
+        raise ValueError(f'Unknown relations: {unknown}')
+    dot.write('id', f'itis-{"-".join(relations)}')
+    ends = KeySet()
+    # DOT does not need the nodes before the edges that use them.
+    with dot.subarray('edges') as edges:
+        for scan in __ordered_scans({scan for relation in relations for scan in RELATION_SCANS[relation][0]}):
+            scan(itis, Discard(), RelationFilter(edges, relations, ends), kingdom_id)
+    with dot.subobject('nodes') as nodes:
+        for scan in __ordered_scans({scan for relation in relations for scan in RELATION_SCANS[relation][1]}):
+            scan(itis, KeyFilter(nodes, ends), Discard(), kingdom_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Writes small DOT views of ITIS that Graphviz can render.')
+    subparsers = parser.add_subparsers(dest='view', required=True)
+    ranks = subparsers.add_parser('ranks', help='one node per rank with the number of its units')
+    subtree = subparsers.add_parser('subtree', help='the units below a unit')
+    subtree.add_argument('--tsn', type=int, required=True, help='the TSN of the root of the subtree')
+    subtree.add_argument('--depth', type=int, help='the number of levels below the root to include')
+    subtree.add_argument('--index', help='a hierarchy index saved by hierarchy_index.py, instead of building one')
+    relations = subparsers.add_parser('relations', help='only the edges of some relations and the nodes they join')
+    relations.add_argument('--relations', required=True, type=lambda value: value.split(','),
+                           help=f'comma separated relations among {", ".join(RELATION_SCANS)}')
+    for view in (ranks, subtree, relations):
+        view.add_argument('input', help='the ITIS SQLite dump')
+        view.add_argument('output', help='the .dot file to write')
+        view.add_argument('--kingdom', type=int, default=converter.DEFAULT_KINGDOM_ID, help='the ITIS kingdom id')
+        view.add_argument('--compression', choices=COMPRESSIONS, help='compress the output; by default according '
+                                                                      'to the extension of output')
+    args = parser.parse_args()
+
+    if args.view == 'relations':
+        itis = open_source(args.input)
+        prepare_indexes(itis)
+    else:
+        itis = connect_read_only(args.input)
+    with open_output(args.output, args.compression) as f, DotGraphWriter(f) as dot:
+        if args.view == 'ranks':
+            write_rank_overview(itis, dot, args.kingdom)
+        elif args.view == 'subtree':
+            index = HierarchyIndex.load(args.index) if args.index else build_hierarchy_index(itis, args.kingdom)
+            write_subtree(itis, dot, index, args.tsn, args.depth)
+        else:
+            write_relations(itis, dot, args.relations, args.kingdom)
+    itis.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# --coding:utf-8--
+
+import os
+import random
+import sqlite3
+import argparse
+import datetime
+from typing import List, Sequence
+
+from convert_itis_to_jsongraph import GEOGRAPHIC_DIVS, LANGUAGES
+
+# The tables read by the converter and the importer, with the keys of the ITIS SQLite download.
+SCHEMA = '''
+CREATE TABLE kingdoms (
+    kingdom_id INTEGER PRIMARY KEY, kingdom_name CHAR(10) NOT NULL, update_date DATE NOT NULL);
+CREATE TABLE taxon_unit_types (
+    kingdom_id INTEGER NOT NULL, rank_id SMALLINT NOT NULL, rank_name CHAR(15) NOT NULL,
+    dir_parent_rank_id SMALLINT NOT NULL, req_parent_rank_id SMALLINT NOT NULL, update_date DATE NOT NULL,
+    PRIMARY KEY (kingdom_id, rank_id));
+CREATE TABLE taxonomic_units (
+    tsn INTEGER PRIMARY KEY, unit_ind1 CHAR(1), unit_name1 CHAR(35) NOT NULL, unit_ind2 CHAR(1), unit_name2 VARCHAR(35),
+    unit_ind3 VARCHAR(7), unit_name3 VARCHAR(35), unit_ind4 VARCHAR(7), unit_name4 VARCHAR(35),
+    unnamed_taxon_ind CHAR(1), name_usage VARCHAR(12) NOT NULL, unaccept_reason VARCHAR(50),
+    credibility_rtng VARCHAR(40) NOT NULL, completeness_rtng CHAR(10), currency_rating CHAR(7),
+    phylo_sort_seq SMALLINT, initial_time_stamp TIMESTAMP NOT NULL, parent_tsn INTEGER,
+    taxon_author_id INTEGER, hybrid_author_id INTEGER, kingdom_id SMALLINT NOT NULL, rank_id SMALLINT NOT NULL,
+    update_date DATE NOT NULL, uncertain_prnt_ind CHAR(3), n_usage TEXT, complete_name TEXT);
+CREATE TABLE longnames (tsn INTEGER PRIMARY KEY, completename VARCHAR(164) NOT NULL);
+CREATE TABLE synonym_links (
+    tsn INTEGER NOT NULL, tsn_accepted INTEGER NOT NULL, update_date DATE NOT NULL, PRIMARY KEY (tsn, tsn_accepted));
+CREATE TABLE geographic_div (
+    tsn INTEGER NOT NULL, geographic_value VARCHAR(45) NOT NULL, update_date DATE NOT NULL,
+    PRIMARY KEY (tsn, geographic_value));
+CREATE TABLE vernaculars (
+    tsn INTEGER NOT NULL, vernacular_name VARCHAR(80) NOT NULL, language VARCHAR(15) NOT NULL,
+    approved_ind CHAR(1), update_date DATE NOT NULL, vern_id INTEGER NOT NULL, PRIMARY KEY (tsn, vern_id));
+CREATE TABLE taxon_authors_lkp (
+    taxon_author_id INTEGER NOT NULL, taxon_author VARCHAR(100) NOT NULL, update_date DATE NOT NULL,
+    kingdom_id SMALLINT NOT NULL, short_author VARCHAR(100), PRIMARY KEY (taxon_author_id, kingdom_id));
+CREATE TABLE strippedauthor (taxon_author_id INTEGER PRIMARY KEY, shortauthor VARCHAR(100));
+CREATE TABLE nodc_ids (
+    nodc_id CHAR(12) NOT NULL, update_date DATE NOT NULL, tsn INTEGER NOT NULL, PRIMARY KEY (nodc_id, tsn));
+'''
+
+KINGDOMS = {
+    1: 'Bacteria',
+    2: 'Protozoa',
+    3: 'Plantae',
+    4: 'Fungi',
+    5: 'Animalia',
+    6: 'Chromista',
+    7: 'Archaea',
+}
+
+# The ranks of each kingdom as (rank_id, rank_name, direct parent rank, required parent rank).
+RANKS = [
+    (10, 'Kingdom', 10, 10),
+    (20, 'Subkingdom', 10, 10),
+    (30, 'Division', 20, 10),
+    (40, 'Subdivision', 30, 30),
+    (60, 'Class', 40, 30),
+    (70, 'Subclass', 60, 60),
+    (100, 'Order', 70, 60),
+    (140, 'Family', 100, 100),
+    (150, 'Subfamily', 140, 140),
+    (180, 'Genus', 150, 140),
+    (220, 'Species', 180, 180),
+    (230, 'Subspecies', 220, 220),
+    (240, 'Variety', 230, 220),
+]
+
+# The levels of the generated trees as (rank_id, mean number of children of a unit on the level above,
+# chance of the level to be skipped). Optional ranks are skipped for some units, as in ITIS.
+LEVELS = [
+    (20, 1, 0.0),
+    (30, 10, 0.0),
+    (40, 2, 0.7),
+    (60, 3, 0.0),
+    (70, 2, 0.6),
+    (100, 4, 0.0),
+    (140, 4, 0.0),
+    (150, 2, 0.8),
+    (180, 5, 0.0),
+    (220, 5, 0.0),
+    (230, 0.3, 0.0),
+]
+
+# Units per kingdom at scale 1.
+UNITS_PER_SCALE = 10000
+
+SYNONYM_RATE = 0.35
+CHAINED_SYNONYM_RATE = 0.01
+VERNACULAR_RATE = 0.15
+GEOGRAPHIC_DIV_RATE = 0.25
+NODC_RATE = 0.05
+HYBRID_AUTHOR_RATE = 0.01
+
+# Vernaculars are mostly English, as in ITIS.
+LANGUAGE_WEIGHTS = {language: 1 for language in LANGUAGES}
+LANGUAGE_WEIGHTS.update({'English': 60, 'Spanish': 10, 'French': 6, 'unspecified': 4})
+
+SYLLABLES = ['ar', 'bo', 'ca', 'de', 'el', 'fi', 'ga', 'hu', 'is', 'lo', 'ma', 'ne', 'or', 'pa', 'qu', 'ri', 'sa',
+             'ta', 'um', 've', 'xy', 'zo']
+
+
+class Generator:
+    def __init__(self, itis: sqlite3.Connection, seed: int):
+        self.itis = itis
+        self.random = random.Random(seed)
+        self.next_tsn = 1
+        self.next_vern_id = 1
+        self.languages = list(LANGUAGE_WEIGHTS)
+        self.language_weights = list(LANGUAGE_WEIGHTS.values())
+        self.units = []
+        self.longnames = []
+        self.vernaculars = []
+        self.geographic_divs = []
+        self.nodc_ids = []
+        self.synonym_links = []
+
+    def __date(self, first_year: int = 1996) -> datetime.date:
+        return datetime.date(first_year, 1, 1) + datetime.timedelta(days=self.random.randrange(365 * 25))
+
+    def __word(self, syllables: int) -> str:
+        return ''.join(self.random.choice(SYLLABLES) for _ in range(syllables))
+
+    def __children(self, mean: float) -> int:
+        if mean < 1:
+            return 1 if self.random.random() < mean else 0
+        return self.random.randint(1, 2 * int(mean) - 1)
+
+    def add_unit(self, kingdom_id: int, rank_id: int, parent_tsn: int, names: Sequence[str], authors: List[int],
+                 accepted: bool = True) -> int:
+        tsn = self.next_tsn
+        self.next_tsn += 1
+        (name1, name2, name3) = (list(names) + [None, None])[:3]
+        complete_name = ' '.join(name for name in names if name)
+        created = datetime.datetime.combine(self.__date(), datetime.time(self.random.randrange(24),
+                                                                         self.random.randrange(60)))
+        hybrid_author = self.random.choice(authors) if self.random.random() < HYBRID_AUTHOR_RATE else 0
+        self.units.append((
+            tsn, 'x' if self.random.random() < 0.01 else None, name1, None, name2,
+            'ssp.' if name3 else None, name3, None, None, 'N',
+            'accepted' if accepted else 'not accepted', None if accepted else 'synonym',
+            'TWG standards met', 'unknown', 'unknown', 0, created.strftime('%Y-%m-%d %H:%M:%S'), parent_tsn,
+            self.random.choice(authors), hybrid_author, kingdom_id, rank_id,
+            max(created.date(), self.__date()).isoformat(), None, None, complete_name))
+        self.longnames.append((tsn, complete_name))
+
+        if self.random.random() < VERNACULAR_RATE:
+            for language in dict.fromkeys(self.random.choices(self.languages, self.language_weights,
+                                                              k=self.random.randint(1, 3))):
+                self.vernaculars.append((tsn, f'{self.__word(2)} {self.__word(3)}'.capitalize(), language, 'N',
+                                         self.__date(2000).isoformat(), self.next_vern_id))
+                self.next_vern_id += 1
+        if rank_id >= 220 and self.random.random() < GEOGRAPHIC_DIV_RATE:
+            for value in self.random.sample(list(GEOGRAPHIC_DIVS), self.random.randint(1, 3)):
+                self.geographic_divs.append((tsn, value, self.__date(2000).isoformat()))
+        if self.random.random() < NODC_RATE:
+            self.nodc_ids.append((f'{tsn:012d}', self.__date().isoformat(), tsn))
+        return tsn
+
+    def add_kingdom(self, kingdom_id: int, units: int):
+        authors = list(range(kingdom_id * 1000000 + 1, kingdom_id * 1000000 + max(10, units // 20) + 1))
+        for author_id in authors:
+            author = f'{self.__word(3).capitalize()}, {self.__word(1).upper()}.'
+            self.itis.execute('INSERT INTO taxon_authors_lkp VALUES (?, ?, ?, ?, ?)',
+                              (author_id, author, self.__date().isoformat(), kingdom_id, author))
+            self.itis.execute('INSERT INTO strippedauthor VALUES (?, ?)', (author_id, author))
+        self.itis.executemany('INSERT INTO taxon_unit_types VALUES (?, ?, ?, ?, ?, ?)',
+                              [(kingdom_id, rank_id, name, direct, required, self.__date().isoformat())
+                               for (rank_id, name, direct, required) in RANKS])
+
+        # The number of divisions is chosen so that the expected size of the tree matches the requested units.
+        below = 0.
+        for (_, mean, skip) in reversed(LEVELS[2:]):
+            below = (1 - skip) * mean * (1 + below) + skip * below
+        divisions = max(1, round((units - 2) / (1 + below)))
+
+        first = len(self.units)
+        root = self.add_unit(kingdom_id, 10, 0, [KINGDOMS[kingdom_id]], authors)
+        frontier = [(root, [KINGDOMS[kingdom_id]])]
+        genus = {}
+        for (rank_id, mean, skip) in LEVELS:
+            next_frontier = []
+            for (parent, names) in frontier:
+                if self.random.random() < skip:
+                    next_frontier.append((parent, names))
+                    continue
+                count = divisions if rank_id == 30 else self.__children(mean)
+                for _ in range(count):
+                    if rank_id == 220:
+                        child_names = [genus[parent], self.__word(3)]
+                    elif rank_id == 230:
+                        child_names = names + [self.__word(3)]
+                    else:
+                        child_names = [self.__word(3).capitalize() + ('aceae' if rank_id == 140 else '')]
+                    child = self.add_unit(kingdom_id, rank_id, parent, child_names, authors)
+                    if rank_id == 180:
+                        genus[child] = child_names[0]
+                    next_frontier.append((child, child_names))
+            # Units of skipped optional ranks are the parents of the next level.
+            frontier = next_frontier
+
+        # Synonyms of species are placed in the same genus as the accepted species.
+        species = [unit for unit in self.units[first:] if unit[21] == 220]
+        synonyms = []
+        for unit in species:
+            if self.random.random() < SYNONYM_RATE:
+                synonym = self.add_unit(kingdom_id, 220, unit[17], [unit[2], self.__word(3)], authors, False)
+                self.synonym_links.append((synonym, unit[0], self.__date().isoformat()))
+                synonyms.append(synonym)
+        for synonym in synonyms:
+            if self.random.random() < CHAINED_SYNONYM_RATE:
+                chained = self.add_unit(kingdom_id, 220, 0, [self.__word(3).capitalize(), self.__word(3)], authors,
+                                        False)
+                self.synonym_links.append((chained, synonym, self.__date().isoformat()))
+
+    def flush(self):
+        placeholders = ', '.join('?' * 26)
+        self.itis.executemany(f'INSERT INTO taxonomic_units VALUES ({placeholders})', self.units)
+        self.itis.executemany('INSERT INTO longnames VALUES (?, ?)', self.longnames)
+        self.itis.executemany('INSERT INTO vernaculars VALUES (?, ?, ?, ?, ?, ?)', self.vernaculars)
+        self.itis.executemany('INSERT INTO geographic_div VALUES (?, ?, ?)', self.geographic_divs)
+        self.itis.executemany('INSERT INTO nodc_ids VALUES (?, ?, ?)', self.nodc_ids)
+        self.itis.executemany('INSERT INTO synonym_links VALUES (?, ?, ?)', self.synonym_links)
+        self.itis.commit()
+
+
+def generate_itis(path: str, scale: float = 1., kingdom_ids: Sequence[int] = (3,), seed: int = 1):
+    """Writes a synthetic ITIS SQLite dump with about scale * UNITS_PER_SCALE taxonomic units per kingdom.
+
+    The dump has the tables and columns read by the converter and the importer. The trees follow the
+    main ITIS ranks with optional intermediate ranks, and a share of the species have synonyms,
+    vernacular names, geographic divisions and NODC ids. The same seed yields the same dump.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    itis = sqlite3.connect(path)
+    itis.executescript(SCHEMA)
+    itis.executemany('INSERT INTO kingdoms VALUES (?, ?, ?)',
+                     [(kingdom_id, name, '2007-09-21') for (kingdom_id, name) in KINGDOMS.items()])
+    generator = Generator(itis, seed)
+    for kingdom_id in kingdom_ids:
+        generator.add_kingdom(kingdom_id, max(3, int(scale * UNITS_PER_SCALE)))
+    generator.flush()
+    itis.execute('ANALYZE')
+    itis.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Writes a synthetic ITIS SQLite dump for benchmarks.')
+    parser.add_argument('output', help='the SQLite file to write')
+    parser.add_argument('--scale', type=float, default=1.,
+                        help=f'scale factor; each kingdom has about {UNITS_PER_SCALE} taxonomic units per unit of scale')
+    parser.add_argument('--kingdoms', type=lambda value: [int(k) for k in value.split(',')], default=[3],
+                        help='comma separated ITIS kingdom ids to generate units for')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the random generator')
+    args = parser.parse_args()
+    generate_itis(args.output, args.scale, args.kingdoms, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# --coding:utf-8--
+
+import sqlite3
+import argparse
+import numpy as np
+from typing import List, Optional
+
+from itis_source import DEFAULT_KINGDOM_ID, connect_read_only
+
+# Arrays saved by HierarchyIndex.save; the sparse table for the LCA is rebuilt by the first lca() after a load.
+ARRAYS = ['tsns', 'parents', 'pre', 'post', 'depth', 'size', 'first', 'preorder', 'euler']
+
+
+def read_parents(itis: sqlite3.Connection, kingdom_id: int = DEFAULT_KINGDOM_ID):
+    # main. is explicit as the converter shadows taxonomic_units with a view of a TSN range in workers.
+    rows = itis.execute('SELECT tsn, parent_tsn FROM main.taxonomic_units WHERE kingdom_id = ? ORDER BY tsn',
+                        (kingdom_id,)).fetchall()
+    tsns = np.array([tsn for (tsn, _) in rows], dtype=np.int64)
+    parent_tsns = np.array([parent_tsn or 0 for (_, parent_tsn) in rows], dtype=np.int64)
+    return tsns, parent_tsns
+
+
+class HierarchyIndex:
+    """Nested set and Euler tour numbering of the taxonomic units of a kingdom.
+
+    Units are addressed by their position in the sorted TSNs. The children of a unit are visited in
+    TSN order, and units whose parent is 0 or not part of the kingdom are roots of their own tree.
+    A unit u is an ancestor of v (or v itself) iff pre[u] <= pre[v] and post[v] <= post[u], the
+    subtree of u is preorder[pre[u]:pre[u] + size[u]], and the lowest common ancestor of two units
+    is the shallowest unit of the Euler tour between their first occurrences, found with a sparse table.
+    """
+
+    def __init__(self, arrays: dict):
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        self.__sparse = None
+
+    @property
+    def sparse(self) -> List[np.ndarray]:
+        # Only the LCA needs the table; the converter loads the index in every worker just for the numbering.
+        if self.__sparse is None:
+            self.__sparse = self.__sparse_table(self.depth[self.euler])
+        return self.__sparse
+
+    @staticmethod
+    def __sparse_table(depths: np.ndarray) -> List[np.ndarray]:
+        """Level k holds the position of the minimum depth in each window of 2^k entries of the tour."""
+        levels = [np.arange(len(depths), dtype=np.int32)]
+        width = 1
+        while 2 * width <= len(depths):
+            previous = levels[-1]
+            left = previous[:len(previous) - width]
+            right = previous[width:]
+            levels.append(np.where(depths[left] <= depths[right], left, right))
+            width *= 2
+        return levels
+
+    @classmethod
+    def build(cls, tsns: np.ndarray, parent_tsns: np.ndarray) -> 'HierarchyIndex':
+        """Numbers a forest given by the TSNs in ascending order and the TSN of each unit's parent."""
+        count = len(tsns)
+        positions = np.searchsorted(tsns, parent_tsns)
+        found = positions < count
+        found[found] = tsns[positions[found]] == parent_tsns[found]
+        parents = np.where(found, positions, -1).astype(np.int32)
+
+        # Children in TSN order as ranges of a list sorted by parent.
+        children = np.argsort(parents, kind='stable').astype(np.int32)
+        child_offsets = np.searchsorted(parents[children], np.arange(-1, count + 1))
+        roots = children[child_offsets[0]:child_offsets[1]]
+        (children, child_offsets) = (children.tolist(), child_offsets[1:].tolist())
+
+        pre = np.full(count, -1, dtype=np.int32)
+        post = np.zeros(count, dtype=np.int32)
+        depth = np.zeros(count, dtype=np.int32)
+        size = np.ones(count, dtype=np.int32)
+        first = np.zeros(count, dtype=np.int32)
+        preorder = np.zeros(count, dtype=np.int32)
+        euler = []
+        (pre_counter, post_counter) = (0, 0)
+
+        for root in roots.tolist():
+            # Stack entries are a unit and the offset of its next child to visit.
+            stack = [[root, child_offsets[root]]]
+            pre[root] = pre_counter
+            preorder[pre_counter] = root
+            pre_counter += 1
+            first[root] = len(euler)
+            euler.append(root)
+            while stack:
+                top = stack[-1]
+                (unit, next_child) = top
+                if next_child < child_offsets[unit + 1]:
+                    top[1] += 1
+                    child = children[next_child]
+                    depth[child] = depth[unit] + 1
+                    pre[child] = pre_counter
+                    preorder[pre_counter] = child
+                    pre_counter += 1
+                    first[child] = len(euler)
+                    euler.append(child)
+                    stack.append([child, child_offsets[child]])
+                else:
+                    stack.pop()
+                    post[unit] = post_counter
+                    post_counter += 1
+                    if stack:
+                        size[stack[-1][0]] += size[unit]
+                        euler.append(stack[-1][0])
+
+        if pre_counter < count:
+            raise ValueError(f'The parents of {count - pre_counter} taxonomic units form a cycle')
+
+        return cls({
+            'tsns': tsns, 'parents': parents, 'pre': pre, 'post': post, 'depth': depth, 'size': size,
+            'first': first, 'preorder': preorder, 'euler': np.array(euler, dtype=np.int32),
+        })
+
+    def save(self, path: str):
+        np.savez(path, **{name: getattr(self, name) for name in ARRAYS})
+
+    @classmethod
+    def load(cls, path: str) -> 'HierarchyIndex':
+        with np.load(path) as arrays:
+            return cls({name: arrays[name] for name in ARRAYS})
+
+    def __len__(self) -> int:
+        return len(self.tsns)
+
+    def position(self, tsn: int) -> int:
+        position = int(np.searchsorted(self.tsns, tsn))
+        if position == len(self.tsns) or self.tsns[position] != tsn:
+            raise KeyError(tsn)
+        return position
+
+    def metadata(self, tsn: int) -> dict:
+        """The numbering of a unit as written into the node metadata by the converter."""
+        position = self.position(tsn)
+        return {
+            'pre': int(self.pre[position]),
+            'post': int(self.post[position]),
+            'depth': int(self.depth[position]),
+            'euler': int(self.first[position]),
+        }
+
+    def is_ancestor(self, ancestor_tsn: int, tsn: int) -> bool:
+        """Tells whether a unit is an ancestor of another unit or the unit itself."""
+        (a, b) = (self.position(ancestor_tsn), self.position(tsn))
+        return bool(self.pre[a] <= self.pre[b] and self.post[b] <= self.post[a])
+
+    def descendants(self, tsn: int) -> np.ndarray:
+        """The TSNs of a unit and all units below it, in pre-order."""
+        position = self.position(tsn)
+        start = self.pre[position]
+        return self.tsns[self.preorder[start:start + self.size[position]]]
+
+    def ancestors(self, tsn: int) -> List[int]:
+        """The TSNs of the units above a unit, from its parent up to the root."""
+        position = self.parents[self.position(tsn)]
+        result = []
+        while position >= 0:
+            result.append(int(self.tsns[position]))
+            position = self.parents[position]
+        return result
+
+    def lca(self, tsn: int, other_tsn: int) -> Optional[int]:
+        """The TSN of the lowest common ancestor of two units, or None if they are in different trees."""
+        (u, v) = (self.position(tsn), self.position(other_tsn))
+        (left, right) = sorted((int(self.first[u]), int(self.first[v])))
+        level = (right - left + 1).bit_length() - 1
+        (a, b) = (self.sparse[level][left], self.sparse[level][right - (1 << level) + 1])
+        unit = self.euler[a if self.depth[self.euler[a]] <= self.depth[self.euler[b]] else b]
+        # The tour of a forest runs from one tree into the next; between trees the shallowest unit is a root
+        # that is not above both.
+        if not all(self.pre[unit] <= self.pre[w] and self.post[w] <= self.post[unit] for w in (u, v)):
+            return None
+        return int(self.tsns[unit])
+
+
+def build_hierarchy_index(itis: sqlite3.Connection, kingdom_id: int = DEFAULT_KINGDOM_ID) -> HierarchyIndex:
+    return HierarchyIndex.build(*read_parents(itis, kingdom_id))
+
+
+class HierarchyNodeWriter:
+    """Adds the numbering of the hierarchy index to the metadata of the taxonomic unit nodes written into it."""
+
+    def __init__(self, nodes, index: HierarchyIndex):
+        self.nodes = nodes
+        self.index = index
+
+    def write(self, key: str, node: dict):
+        metadata = node.get('metadata', {})
+        if metadata.get('type') == 'taxonomic-unit':
+            metadata['hierarchy'] = self.index.metadata(metadata['tsn'])
+        self.nodes.write(key, node)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Builds the nested set and Euler tour index of the ITIS hierarchy.')
+    parser.add_argument('input', help='the ITIS SQLite dump')
+    parser.add_argument('output', help='the .npz file to write')
+    parser.add_argument('--kingdom', type=int, default=DEFAULT_KINGDOM_ID, help='the ITIS kingdom id')
+    args = parser.parse_args()
+
+    itis = connect_read_only(args.input)
+    index = build_hierarchy_index(itis, args.kingdom)
+    itis.close()
+    index.save(args.output)
+    print(f'{len(index)} taxonomic units in {int((index.parents < 0).sum())} trees, '
+          f'{int(index.depth.max(initial=0)) + 1} levels')
+
+
+if __name__ == '__main__':
+    main()
@@ -7,12 +7,94 @@
 # attached with Common Clause Condition 1.0, found in the LICENSES directory.
 
 import os
+import json
 import time
+import queue
 import sqlite3
+import argparse
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
 from tqdm import tqdm
 
 from nebula2.gclient.net import ConnectionPool, Session
 from nebula2.Config import Config
+from nebula2.Exception import IOErrorException
+from nebula2.common.ttypes import ErrorCode
+
+import itis_delta
+import nebula_bulk
+from itis_source import DEFAULT_KINGDOM_ID
+from metrics import METRICS
+from row_source import iso_timestamps, record_batches
+
+
+DEFAULT_BATCH_SIZE = 256
+
+# Attempts per statement, and the delay before the first retry, doubled for each further one.
+DEFAULT_ATTEMPTS = 5
+DEFAULT_BACKOFF = 0.5
+MAX_BACKOFF = 30.
+
+# Errors of a statement that may pass when it is repeated; others, like syntax errors, fail at once.
+TRANSIENT_ERRORS = {
+    ErrorCode.E_DISCONNECTED,
+    ErrorCode.E_FAIL_TO_CONNECT,
+    ErrorCode.E_RPC_FAILURE,
+    ErrorCode.E_LEADER_CHANGED,
+    ErrorCode.E_PARTIAL_SUCCEEDED,
+    ErrorCode.E_WRITE_STALLED,
+}
+
+# Seconds to wait for the schema to become usable after creating it, and between checks.
+SCHEMA_TIMEOUT = 120.
+SCHEMA_POLL_INTERVAL = 0.5
+
+TAXONOMIC_UNIT_INSERT = 'INSERT VERTEX taxonomic_unit(' \
+                        'tsn, name, accepted, created, updated, ' \
+                        'unit_ind1, unit_name1, unit_ind2, unit_name2, ' \
+                        'unit_ind3, unit_name3, unit_ind4, unit_name4) VALUES'
+HAS_RANK_INSERT = 'INSERT EDGE has_rank() VALUES'
+PARENT_OF_INSERT = 'INSERT EDGE parent_of() VALUES'
+VERTEX_DELETE = 'DELETE VERTEX'
+HAS_RANK_DELETE = 'DELETE EDGE has_rank'
+PARENT_OF_DELETE = 'DELETE EDGE parent_of'
+
+# The statements creating the space and its schema; also run by nebula-importer before a bulk load.
+SPACE_SCHEMA = [
+    'CREATE SPACE IF NOT EXISTS itis (vid_type = FIXED_STRING(20)); USE itis;',
+    'CREATE TAG IF NOT EXISTS rank(itis_rank_id int, name string, updated date);',
+    'CREATE TAG INDEX IF NOT EXISTS rank_id_0 ON rank(itis_rank_id);',
+
+    'CREATE EDGE IF NOT EXISTS direct_parent_of();',
+    'CREATE EDGE IF NOT EXISTS required_parent_of();',
+    'CREATE EDGE IF NOT EXISTS has_rank();',
+    'CREATE EDGE IF NOT EXISTS parent_of();',
+
+    'CREATE TAG IF NOT EXISTS taxonomic_unit('
+    'tsn int, name string, accepted bool,'
+    'created timestamp, updated date,'
+    'unit_ind1 string, unit_name1 string,'
+    'unit_ind2 string, unit_name2 string,'
+    'unit_ind3 string, unit_name3 string,'
+    'unit_ind4 string, unit_name4 string'
+    ');',
+    'CREATE TAG INDEX IF NOT EXISTS taxonomic_unit_tsn_0 ON taxonomic_unit(tsn);',
+]
+
+# The tag indexes of SPACE_SCHEMA, by the tag and property they index.
+SCHEMA_INDEXES = {
+    'rank_id_0': ('rank', 'itis_rank_id'),
+    'taxonomic_unit_tsn_0': ('taxonomic_unit', 'tsn'),
+}
+
+DEFAULT_CHECKPOINT = os.path.join('data', 'import-checkpoint.json')
+
+# The string properties of taxonomic_unit, in the order of TAXONOMIC_UNIT_INSERT.
+UNIT_STRING_COLUMNS = ['complete_name', 'unit_ind1', 'unit_name1', 'unit_ind2', 'unit_name2',
+                       'unit_ind3', 'unit_name3', 'unit_ind4', 'unit_name4']
+
+# A multi-row INSERT: the statement up to and including VALUES, and the rows to insert.
+Batch = Tuple[str, List[str]]
 
 
 def execute_assert(session: Session, statement: str):
@@ -20,15 +102,315 @@ def execute_assert(session: Session, statement: str):
     assert resp.is_succeeded(), resp.error_msg() + f' on statement: {statement}'
 
 
-def create_space(session: Session):
-    execute_assert(session, 'CREATE SPACE IF NOT EXISTS itis (vid_type = FIXED_STRING(20)); USE itis;')
-    execute_assert(session, 'CREATE TAG IF NOT EXISTS rank(itis_rank_id int, name string, updated date);')
-    execute_assert(session, 'CREATE TAG INDEX IF NOT EXISTS rank_id_0 ON rank(itis_rank_id);')
+class Retry:
+    """Executes statements, retrying those failing with a connection or transient error with exponential backoff.
+
+    Only used for INSERT and DELETE statements, which have the same effect when repeated.
+    """
+
+    def __init__(self, attempts: int = DEFAULT_ATTEMPTS, backoff: float = DEFAULT_BACKOFF):
+        assert attempts > 0, attempts
+        self.attempts = attempts
+        self.backoff = backoff
+
+    def execute(self, session: Session, statement: str):
+        for attempt in range(self.attempts):
+            try:
+                resp = session.execute(statement)
+                if resp.is_succeeded():
+                    return
+                error = resp.error_msg()
+                if resp.error_code() not in TRANSIENT_ERRORS:
+                    raise AssertionError(f'{error} on statement: {statement}')
+            except IOErrorException as e:
+                error = str(e)
+            if attempt + 1 < self.attempts:
+                delay = min(self.backoff * 2 ** attempt, MAX_BACKOFF)
+                tqdm.write(f'Retrying in {delay:.1f}s after: {error}')
+                time.sleep(delay)
+        raise AssertionError(f'{error} on statement: {statement} (after {self.attempts} attempts)')
+
+
+# The retries of this process; main() sets the number of attempts.
+RETRY = Retry()
+
+
+def escape_string(value: str) -> str:
+    """Escapes a value for use within a double-quoted nGQL string literal."""
+    return value.replace('\\', '\\\\') \
+        .replace('"', '\\"') \
+        .replace('\n', '\\n') \
+        .replace('\r', '\\r')
+
+
+class StatementRate:
+    """Accumulates statement and row counts per statement type to report the insert throughput."""
+
+    def __init__(self):
+        self.statements: Dict[str, int] = {}
+        self.rows: Dict[str, int] = {}
+        self.elapsed: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def record(self, kind: str, rows: int, elapsed: float):
+        with self.lock:
+            self.statements[kind] = self.statements.get(kind, 0) + 1
+            self.rows[kind] = self.rows.get(kind, 0) + rows
+            self.elapsed[kind] = self.elapsed.get(kind, 0.) + elapsed
+
+    def report(self):
+        for kind in self.statements:
+            statements, rows, elapsed = self.statements[kind], self.rows[kind], self.elapsed[kind]
+            elapsed = max(elapsed, 1e-9)
+            print(f'{kind}: {statements} statements, {rows} rows in {elapsed:.2f}s '
+                  f'({statements / elapsed:.1f} statements/s, {rows / elapsed:.1f} rows/s)')
+
+
+def execute_batches(session: Session, batches: Sequence[Batch], rate: Optional[StatementRate] = None):
+    for (statement, values) in batches:
+        if not values:
+            continue
+        start = time.perf_counter()
+        RETRY.execute(session, f'{statement} {",".join(values)};')
+        elapsed = time.perf_counter() - start
+        kind = statement.split('(')[0]
+        if rate is not None:
+            rate.record(kind, len(values), elapsed)
+        METRICS.observe('statement_seconds', kind, elapsed)
+
+
+class BatchInserter:
+    """Collects the VALUES of one or more INSERT statements and sends them as multi-row statements.
+
+    Each call to add() takes one row per statement, or None to skip a statement. A full batch is handed to the execute callback
+    as a single shard, in statement order, so that e.g. vertices are inserted before their edges.
+    With progress, the callback also gets the function to call once the shard is inserted.
+    Use as a context manager so that the last, partially filled batch is flushed on exit.
+    """
+
+    def __init__(self, execute: Callable[..., None], statements: Sequence[str],
+                 batch_size: int = DEFAULT_BATCH_SIZE, progress: Optional['ShardProgress'] = None):
+        assert batch_size > 0, batch_size
+        self.execute = execute
+        self.progress = progress
+        self.statements = statements
+        self.batch_size = batch_size
+        self.values: List[List[str]] = [[] for _ in statements]
+        self.count = 0
+        self.key = None
+
+    def add(self, *values: str, key=None):
+        """Adds a row; key, e.g. the TSN of the row, is kept as the key of the last row of the batch."""
+        self.key = key
+        for (batch, value) in zip(self.values, values):
+            if value is not None:
+                batch.append(value)
+        self.count += 1
+        if self.count >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.count == 0:
+            return
+        shard = list(zip(self.statements, self.values))
+        if self.progress is None:
+            self.execute(shard)
+        else:
+            self.execute(shard, self.progress.start(self.key))
+        self.values = [[] for _ in self.statements]
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, evalue, traceback):
+        if etype is None:
+            self.flush()
+
+
+class Checkpoint:
+    """The progress of an import, saved into a JSON state file whenever it advances.
+
+    Each phase (ranks, units, has_rank and parent_of) records the last TSN, or rank id, up to which
+    all its rows are inserted.
+
+    The state file is tied to the size and modification time of the source and to the kingdom,
+    so that another import does not resume from it. Without a path, nothing is saved.
+    """
+
+    def __init__(self, path: Optional[str] = None, source: Optional[str] = None,
+                 kingdom_id: int = DEFAULT_KINGDOM_ID):
+        self.path = path
+        self.lock = threading.Lock()
+        self.state = {'kingdom_id': kingdom_id, 'phases': {}}
+        if source is not None:
+            stat = os.stat(source)
+            self.state.update(source=os.path.abspath(source), source_size=stat.st_size,
+                              source_mtime_ns=stat.st_mtime_ns)
+        if path is not None and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            if any(saved.get(name) != value for (name, value) in self.state.items() if name != 'phases'):
+                raise ValueError(f'{path} is the checkpoint of another import; remove it to start over')
+            self.state['phases'] = saved['phases']
+
+    def position(self, phase: str) -> Optional[int]:
+        """The last TSN, or rank id, of a phase that is inserted with all those before it."""
+        return self.state['phases'].get(phase)
+
+    def advance(self, phases: List[str], position: int):
+        with self.lock:
+            for phase in phases:
+                self.state['phases'][phase] = position
+            if self.path is not None:
+                partial = self.path + '.partial'
+                with open(partial, 'w', encoding='utf-8') as f:
+                    json.dump(self.state, f, indent=2)
+                os.replace(partial, self.path)
+
+    def progress(self, phases: List[str]) -> 'ShardProgress':
+        return ShardProgress(self, phases)
+
+    def remove(self):
+        """Removes the state file once the import is complete."""
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class ShardProgress:
+    """Advances the checkpoint of phases to the last key of each shard inserted after all shards before it.
+
+    Workers may finish shards out of order; a shard that failed holds the checkpoint back.
+    """
+
+    def __init__(self, checkpoint: Checkpoint, phases: List[str]):
+        self.checkpoint = checkpoint
+        self.phases = phases
+        self.lock = threading.Lock()
+        self.keys: Dict[int, int] = {}
+        self.finished = set()
+        self.started = 0
+        self.next = 0
+
+    def start(self, key: int) -> Callable[[], None]:
+        """Registers a shard ending with key, and returns the function to call once it is inserted."""
+        with self.lock:
+            shard = self.started
+            self.started += 1
+            self.keys[shard] = key
+
+        def done():
+            with self.lock:
+                self.finished.add(shard)
+                position = None
+                while self.next in self.finished:
+                    self.finished.remove(self.next)
+                    position = self.keys.pop(self.next)
+                    self.next += 1
+                if position is not None:
+                    self.checkpoint.advance(self.phases, position)
+        return done
+
+
+class ImportWorkers:
+    """Executes shards of batches on worker threads, each with its own pooled session.
+
+    The queue between the SQLite reader and the workers is bounded, so submit() blocks
+    while all workers are busy. Batches within one shard are executed in order, and then
+    the done callback of the shard is called on the worker thread.
+    """
+
+    def __init__(self, sessions: List[Session], space: str, rate: Optional[StatementRate] = None,
+                 queue_size: Optional[int] = None):
+        assert len(sessions) > 0
+        self.rate = rate
+        self.queue = queue.Queue(maxsize=queue_size or 2 * len(sessions))
+        self.error: Optional[BaseException] = None
+        self.threads = [threading.Thread(target=self.__run, args=(session, space), daemon=True)
+                        for session in sessions]
+        for thread in self.threads:
+            thread.start()
+
+    def __run(self, session: Session, space: str):
+        try:
+            execute_assert(session, f'USE {space};')
+        except BaseException as e:
+            self.error = e
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                (shard, done) = item
+                if self.error is None:
+                    execute_batches(session, shard, self.rate)
+                    if done is not None:
+                        done()
+            except BaseException as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def submit(self, shard: List[Batch], done: Optional[Callable[[], None]] = None):
+        self.__raise_error()
+        self.queue.put((shard, done))
+
+    def join(self):
+        """Waits until all submitted shards are executed."""
+        self.queue.join()
+        self.__raise_error()
+
+    def __raise_error(self):
+        if self.error is not None:
+            raise RuntimeError('Import worker failed') from self.error
+
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, evalue, traceback):
+        self.close()
+
+
+def missing_schema(session: Session) -> List[str]:
+    """The parts of SPACE_SCHEMA that are not usable yet."""
+    if not session.execute('USE itis;').is_succeeded():
+        return ['space itis']
+    missing = []
+    for (statement, names) in [('SHOW TAGS;', list(nebula_bulk.TAGS)), ('SHOW EDGES;', nebula_bulk.EDGES),
+                               ('SHOW TAG INDEXES;', list(SCHEMA_INDEXES))]:
+        resp = session.execute(statement)
+        shown = {value.as_string() for value in resp.column_values(resp.keys()[0])} if resp.is_succeeded() else set()
+        missing.extend(name for name in names if name not in shown)
+    if missing:
+        return missing
+
+    # graphd lists the schema before the storage hosts load it with their next heartbeat.
+    probes = [f'LOOKUP ON {tag} WHERE {tag}.{prop} == -1;' for (tag, prop) in SCHEMA_INDEXES.values()]
+    probes.extend(f'FETCH PROP ON {edge} "probe"->"probe";' for edge in nebula_bulk.EDGES)
+    return [probe for probe in probes if not session.execute(probe).is_succeeded()]
+
+
+def wait_for_schema(session: Session, timeout: float = SCHEMA_TIMEOUT):
+    """Waits until the space, its tags, edge types and indexes are usable."""
+    deadline = time.monotonic() + timeout
+    while True:
+        missing = missing_schema(session)
+        if not missing:
+            return
+        if time.monotonic() >= deadline:
+            raise RuntimeError(f'Schema not usable after {timeout:.0f}s: {", ".join(missing)}')
+        time.sleep(SCHEMA_POLL_INTERVAL)
 
-    execute_assert(session, 'CREATE EDGE IF NOT EXISTS direct_parent_of();')
-    execute_assert(session, 'CREATE EDGE IF NOT EXISTS required_parent_of();')
-    execute_assert(session, 'CREATE EDGE IF NOT EXISTS has_rank();')
-    execute_assert(session, 'CREATE EDGE IF NOT EXISTS parent_of();')
+
+def create_space(session: Session):
+    for statement in SPACE_SCHEMA:
+        execute_assert(session, statement)
 
     # for rank in ["Kingdom", "Subkingdom", "Infrakingdom",
     #              "Superdivision", "Division", "Subdivision", "Infradivision",
@@ -43,53 +425,78 @@ def create_space(session: Session):
     #              "Form", "Subform"]:
     #     execute_assert(session, f'CREATE TAG IF NOT EXISTS Rank{rank}(itis_rank_id int);')
 
-    execute_assert(session, 'CREATE TAG IF NOT EXISTS taxonomic_unit('
-                            'tsn int, name string, accepted bool,'
-                            'created timestamp, updated date,'
-                            'unit_ind1 string, unit_name1 string,'
-                            'unit_ind2 string, unit_name2 string,'
-                            'unit_ind3 string, unit_name3 string,'
-                            'unit_ind4 string, unit_name4 string'
-                            ');')
-    execute_assert(session, 'CREATE TAG INDEX IF NOT EXISTS taxonomic_unit_tsn_0 ON taxonomic_unit(tsn);')
-
     # We need to wait until Nebula's CREATE operations are carried out.
-    # TODO: Replace with a lookup-wait loop
-    time.sleep(6)
+    wait_for_schema(session)
 
 
-def create_ranks(session: Session, itis: sqlite3.Connection):
-    # Fetch all ranks from the Plantae kingdom (kingdom_id = 3)
+# Rank vertex ids are not qualified by kingdom, so a space holds a single kingdom.
+def create_ranks(session: Session, itis: sqlite3.Connection, kingdom_id: int = DEFAULT_KINGDOM_ID,
+                 checkpoint: Optional[Checkpoint] = None):
+    if checkpoint is not None and checkpoint.position('ranks') is not None:
+        return
     taxon_unit_types = itis.execute('''
                 SELECT rank_id, rank_name, dir_parent_rank_id, req_parent_rank_id, update_date
                 FROM taxon_unit_types 
-                WHERE kingdom_id = 3 ORDER BY rank_id
-                ''')
+                WHERE kingdom_id = ? ORDER BY rank_id
+                ''', (kingdom_id,))
 
     ranks = []
     direct_parents = []
     required_parents = []
+    last_rank_id = 0
     for (rank_id, rank_name, dir_parent_rank_id, req_parent_rank_id, update_date) in taxon_unit_types:
-        ranks.append(f'"rank-{rank_id}":({rank_id}, "{rank_name}", date("{update_date}"))')
+        last_rank_id = rank_id
+        ranks.append(f'"rank-{rank_id}":({rank_id}, "{escape_string(rank_name)}", date("{update_date}"))')
         # Skip the Kingdom link on itself
         if rank_id == dir_parent_rank_id or rank_id == req_parent_rank_id:
             continue
         direct_parents.append(f'"rank-{dir_parent_rank_id}"->"rank-{rank_id}":()')
         required_parents.append(f'"rank-{req_parent_rank_id}"->"rank-{rank_id}":()')
 
-    execute_assert(session, f'INSERT VERTEX rank(itis_rank_id, name, updated) VALUES {",".join(ranks)};')
-    execute_assert(session, f'INSERT EDGE direct_parent_of() VALUES {",".join(direct_parents)};')
-    execute_assert(session, f'INSERT EDGE required_parent_of() VALUES {",".join(required_parents)};')
+    for (statement, values) in [('INSERT VERTEX rank(itis_rank_id, name, updated) VALUES', ranks),
+                                ('INSERT EDGE direct_parent_of() VALUES', direct_parents),
+                                ('INSERT EDGE required_parent_of() VALUES', required_parents)]:
+        if values:
+            RETRY.execute(session, f'{statement} {",".join(values)};')
+    if checkpoint is not None:
+        checkpoint.advance(['ranks'], last_rank_id)
 
 
 def wrap_none(input, stringify: bool = False):
     if input is None:
         return "null"
-    return f'"{input}"' if stringify else input
-
-
-def create_taxonomic_units(session: Session, itis: sqlite3.Connection):
-    count = itis.execute('SELECT COUNT(*) FROM taxonomic_units WHERE kingdom_id = 3').fetchone()[0]
+    return f'"{escape_string(input)}"' if stringify else input
+
+
+def nql_strings(values: Sequence[Optional[str]]) -> List[str]:
+    """The string literals of a column of values, or null; the column is escaped as a single string."""
+    text = '\x00'.join('' if value is None else value for value in values)
+    if text.count('\x00') != len(values) - 1:
+        return [wrap_none(value, True) for value in values]
+    return ['null' if value is None else f'"{literal}"'
+            for (value, literal) in zip(values, escape_string(text).split('\x00'))]
+
+
+def create_taxonomic_units(session: Session, itis: sqlite3.Connection,
+                           batch_size: int = DEFAULT_BATCH_SIZE, rate: Optional[StatementRate] = None,
+                           workers: Optional[ImportWorkers] = None, kingdom_id: int = DEFAULT_KINGDOM_ID,
+                           checkpoint: Optional[Checkpoint] = None):
+    """Inserts the units of a kingdom with their has_rank edges, and then their parent_of edges.
+
+    With a checkpoint, each pass starts after the last TSN it recorded and records its progress.
+    """
+    if workers is not None:
+        execute = workers.submit
+    else:
+        def execute(shard: List[Batch], done: Optional[Callable[[], None]] = None):
+            execute_batches(session, shard, rate)
+            if done is not None:
+                done()
+
+    checkpoint = checkpoint or Checkpoint()
+    start_tsn = min(checkpoint.position('units') or 0, checkpoint.position('has_rank') or 0)
+    count = itis.execute('SELECT COUNT(*) FROM taxonomic_units WHERE kingdom_id = ? AND tsn > ?',
+                         (kingdom_id, start_tsn)).fetchone()[0]
 
     units = itis.execute('''
                     SELECT rank_id, tsn,
@@ -100,77 +507,220 @@ def create_taxonomic_units(session: Session, itis: sqlite3.Connection):
                            unit_ind4, unit_name4,
                            initial_time_stamp, update_date
                     FROM taxonomic_units 
-                    WHERE kingdom_id = 3''')
-    for unit in tqdm(units, desc='Units', total=count):
-        rank_id = wrap_none(unit[0])
-        tsn = wrap_none(unit[1])
-        complete_name = wrap_none(unit[2])
-        name_usage = wrap_none(unit[3])
-        unit_ind1 = wrap_none(unit[4], True)
-        unit_name1 = wrap_none(unit[5], True)
-        unit_ind2 = wrap_none(unit[6], True)
-        unit_name2 = wrap_none(unit[7], True)
-        unit_ind3 = wrap_none(unit[8], True)
-        unit_name3 = wrap_none(unit[9], True)
-        unit_ind4 = wrap_none(unit[10], True)
-        unit_name4 = wrap_none(unit[11], True)
-        initial_time_stamp = wrap_none(unit[12])
-        update_date = wrap_none(unit[13])
-
-        initial_time_stamp = initial_time_stamp.replace(' ', 'T')
-        is_accepted = 'true' if name_usage == 'accepted' else 'false'
-
-        execute_assert(session, f'''INSERT VERTEX taxonomic_unit(
-                tsn, name, accepted, created, updated,
-                unit_ind1, unit_name1, unit_ind2, unit_name2,
-                unit_ind3, unit_name3, unit_ind4, unit_name4)
-            VALUES
-                "tsn-{tsn}":(
-                {tsn}, "{complete_name}", {is_accepted},
-                timestamp("{initial_time_stamp}"), date("{update_date}"),
-                {unit_ind1}, {unit_name1},
-                {unit_ind2}, {unit_name2},
-                {unit_ind3}, {unit_name3},
-                {unit_ind4}, {unit_name4}
-                );
-            ''')
-        execute_assert(session, f'INSERT EDGE has_rank() VALUES "tsn-{tsn}"->"rank-{rank_id}":();')
-
-    units = itis.execute('SELECT tsn, parent_tsn FROM taxonomic_units WHERE kingdom_id = 3')
-    for unit in tqdm(units, desc='Unit Relationships', total=count):
-        tsn = unit[0]
-        parent_tsn = unit[1]
-        if parent_tsn is not None and parent_tsn > 0:
-            execute_assert(session, f'INSERT EDGE parent_of() VALUES "tsn-{parent_tsn}"->"tsn-{tsn}":();')
-
-
-def import_from_itis(session: Session, itis: sqlite3.Connection):
+                    WHERE kingdom_id = ? AND tsn > ?
+                    ORDER BY tsn''', (kingdom_id, start_tsn))
+
+    # With workers, the write time of a stage is the time spent waiting for a worker to take a shard.
+    with METRICS.stage('units') as stage, \
+            BatchInserter(METRICS.batches(execute, stage), [TAXONOMIC_UNIT_INSERT, HAS_RANK_INSERT], batch_size,
+                          checkpoint.progress(['units', 'has_rank'])) as inserter, \
+            tqdm(desc='Units', total=count) as progress:
+        # rank_id, initial_time_stamp and update_date are NOT NULL in ITIS.
+        for batch in record_batches(METRICS.cursor(units, stage), {'initial_time_stamp': iso_timestamps}):
+            strings = [nql_strings(batch[name]) for name in UNIT_STRING_COLUMNS]
+            for (rank_id, tsn, name_usage, initial_time_stamp, update_date,
+                 complete_name, unit_ind1, unit_name1, unit_ind2, unit_name2,
+                 unit_ind3, unit_name3, unit_ind4, unit_name4) in zip(
+                    batch['rank_id'], batch['tsn'], batch['name_usage'], batch['initial_time_stamp'],
+                    batch['update_date'], *strings):
+                is_accepted = 'true' if name_usage == 'accepted' else 'false'
+
+                inserter.add(f'"tsn-{tsn}":('
+                             f'{tsn}, {complete_name}, {is_accepted}, '
+                             f'timestamp("{initial_time_stamp}"), date("{update_date}"), '
+                             f'{unit_ind1}, {unit_name1}, '
+                             f'{unit_ind2}, {unit_name2}, '
+                             f'{unit_ind3}, {unit_name3}, '
+                             f'{unit_ind4}, {unit_name4})',
+                             f'"tsn-{tsn}"->"rank-{rank_id}":()', key=tsn)
+            progress.update(len(batch))
+
+    # All vertex shards need to be inserted before the hierarchy is linked.
+    if workers is not None:
+        workers.join()
+
+    start_tsn = checkpoint.position('parent_of') or 0
+    count = itis.execute('SELECT COUNT(*) FROM taxonomic_units WHERE kingdom_id = ? AND tsn > ?',
+                         (kingdom_id, start_tsn)).fetchone()[0]
+    units = itis.execute('SELECT tsn, parent_tsn FROM taxonomic_units WHERE kingdom_id = ? AND tsn > ? ORDER BY tsn',
+                         (kingdom_id, start_tsn))
+    with METRICS.stage('unit relationships') as stage, \
+            BatchInserter(METRICS.batches(execute, stage), [PARENT_OF_INSERT], batch_size,
+                          checkpoint.progress(['parent_of'])) as parents:
+        for unit in tqdm(METRICS.cursor(units, stage), desc='Unit Relationships', total=count):
+            tsn = unit[0]
+            parent_tsn = unit[1]
+            if parent_tsn is not None and parent_tsn > 0:
+                parents.add(f'"tsn-{parent_tsn}"->"tsn-{tsn}":()', key=tsn)
+
+    if workers is not None:
+        workers.join()
+
+
+def import_from_itis(session: Session, itis: sqlite3.Connection,
+                     batch_size: int = DEFAULT_BATCH_SIZE, rate: Optional[StatementRate] = None,
+                     worker_sessions: Optional[List[Session]] = None, kingdom_id: int = DEFAULT_KINGDOM_ID,
+                     checkpoint: Optional[Checkpoint] = None):
+    create_space(session)
+    create_ranks(session, itis, kingdom_id, checkpoint)
+    if not worker_sessions:
+        create_taxonomic_units(session, itis, batch_size, rate, kingdom_id=kingdom_id, checkpoint=checkpoint)
+        return
+
+    with ImportWorkers(worker_sessions, 'itis', rate) as workers:
+        create_taxonomic_units(session, itis, batch_size, rate, workers, kingdom_id, checkpoint)
+
+
+def delete_changed_units(session: Session, itis: sqlite3.Connection,
+                         batch_size: int = DEFAULT_BATCH_SIZE, rate: Optional[StatementRate] = None,
+                         kingdom_id: int = DEFAULT_KINGDOM_ID):
+    def execute(shard: List[Batch]):
+        execute_batches(session, shard, rate)
+
+    # Deleting a vertex also deletes all of its edges.
+    deleted = itis.execute('''
+        SELECT tsn FROM previous.taxonomic_units
+        WHERE kingdom_id = :kingdom_id
+          AND tsn IN (SELECT tsn FROM temp.delta_units)
+          AND tsn NOT IN (SELECT tsn FROM main.taxonomic_units WHERE kingdom_id = :kingdom_id)
+        ORDER BY tsn''', {'kingdom_id': kingdom_id})
+    with BatchInserter(execute, [VERTEX_DELETE], batch_size) as vertices:
+        for (tsn,) in deleted:
+            vertices.add(f'"tsn-{tsn}"')
+
+    # Units that are kept but moved in the hierarchy or changed their rank lose their old edges.
+    moved = itis.execute('''
+        SELECT p.tsn, p.rank_id, p.parent_tsn, c.rank_id, c.parent_tsn
+        FROM previous.taxonomic_units AS p
+        JOIN main.taxonomic_units AS c ON c.tsn = p.tsn
+        WHERE p.kingdom_id = ?
+          AND p.tsn IN (SELECT tsn FROM temp.delta_units)
+          AND (p.rank_id IS NOT c.rank_id OR p.parent_tsn IS NOT c.parent_tsn)
+        ORDER BY p.tsn''', (kingdom_id,))
+    with BatchInserter(execute, [HAS_RANK_DELETE, PARENT_OF_DELETE], batch_size) as edges:
+        for (tsn, rank_id, parent_tsn, current_rank_id, current_parent_tsn) in moved:
+            has_rank = f'"tsn-{tsn}"->"rank-{rank_id}"' if rank_id != current_rank_id else None
+            parent_of = f'"tsn-{parent_tsn}"->"tsn-{tsn}"' \
+                if parent_tsn != current_parent_tsn and parent_tsn is not None and parent_tsn > 0 else None
+            edges.add(has_rank, parent_of)
+
+
+def import_delta_from_itis(session: Session, itis: sqlite3.Connection, previous_path: str,
+                           batch_size: int = DEFAULT_BATCH_SIZE, rate: Optional[StatementRate] = None,
+                           worker_sessions: Optional[List[Session]] = None, kingdom_id: int = DEFAULT_KINGDOM_ID):
+    """Applies only the changes since the previous ITIS dump to an already imported space.
+
+    Vertices of deleted units are removed along with their edges, stale edges of moved units
+    are deleted, and added or changed units are inserted again, which replaces their properties.
+    """
+    itis_delta.attach_previous(itis, previous_path)
+    itis_delta.find_changed_keys(itis, kingdom_id)
+
     create_space(session)
-    create_ranks(session, itis)
-    create_taxonomic_units(session, itis)
+    create_ranks(session, itis, kingdom_id)
+    delete_changed_units(session, itis, batch_size, rate, kingdom_id)
+
+    itis_delta.restrict_to_changed_keys(itis)
+    if not worker_sessions:
+        create_taxonomic_units(session, itis, batch_size, rate, kingdom_id=kingdom_id)
+        return
+
+    with ImportWorkers(worker_sessions, 'itis', rate) as workers:
+        create_taxonomic_units(session, itis, batch_size, rate, workers, kingdom_id)
+
+
+def parse_address(value: str) -> Tuple[str, int]:
+    host, port = value.rsplit(':', 1)
+    return host, int(port)
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Imports the ITIS database into Nebula Graph.')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='number of rows sent per INSERT statement')
+    parser.add_argument('--report-rate', action='store_true',
+                        help='print statements and rows per second for each statement type')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of sessions inserting in parallel')
+    parser.add_argument('--address', type=parse_address, action='append',
+                        help='graphd address as host:port; repeat for each graphd instance '
+                             '(default: 127.0.0.1:3699)')
+    parser.add_argument('--metrics', metavar='PATH',
+                        help='record time, rows and SQLite time per stage and latency histograms per statement type '
+                             'and write them to PATH, in the Prometheus text format if it ends with .prom, '
+                             'as JSON otherwise')
+    parser.add_argument('--bulk-export', metavar='DIR',
+                        help='instead of importing, write CSV files per tag and edge type and a nebula-importer '
+                             'configuration loading them into DIR')
+    parser.add_argument('--chunk-rows', type=int, default=nebula_bulk.DEFAULT_CHUNK_ROWS,
+                        help='with --bulk-export, the number of rows per CSV file')
+    parser.add_argument('--after-period', default=nebula_bulk.DEFAULT_AFTER_PERIOD,
+                        help='with --bulk-export, how long nebula-importer waits for the created schema to become '
+                             'usable before loading the files, e.g. 12s')
+    parser.add_argument('--delta-from', metavar='PREVIOUS_DB',
+                        help='only import the changes since this previously imported ITIS dump')
+    parser.add_argument('--checkpoint', metavar='PATH', default=DEFAULT_CHECKPOINT,
+                        help='state file recording the progress of the import; an interrupted import resumes '
+                             'from it, and it is removed once the import completes')
+    parser.add_argument('--attempts', type=int, default=DEFAULT_ATTEMPTS,
+                        help='attempts per INSERT or DELETE statement before the import fails')
+    parser.add_argument('--kingdom', type=int, default=DEFAULT_KINGDOM_ID, help='the ITIS kingdom id')
+    args = parser.parse_args()
+    if args.metrics:
+        METRICS.enable()
+    RETRY.attempts = args.attempts
+
+    if args.bulk_export:
+        itis = sqlite3.connect(os.path.join('data', 'ITIS-042721.sqlite'))
+        config_path = nebula_bulk.export_bulk_load(itis, args.bulk_export, SPACE_SCHEMA, args.kingdom,
+                                                   args.chunk_rows, (args.address or [None])[0], args.batch_size,
+                                                   args.workers, args.after_period)
+        itis.close()
+        print(f'Load with: nebula-importer --config {config_path}')
+        return
+
     client = None
+    worker_sessions = []
     try:
         config = Config()
-        config.max_connection_pool_size = 2
+        config.max_connection_pool_size = args.workers + 1
 
+        # The pool balances sessions across all given graphd instances.
         connection_pool = ConnectionPool()
-        assert connection_pool.init([('127.0.0.1', 3699)], config)
+        assert connection_pool.init(args.address or [('127.0.0.1', 3699)], config)
 
         client = connection_pool.get_session('user', 'password')
         assert client is not None
 
-        itis = sqlite3.connect(os.path.join('data', 'ITIS-042721.sqlite'))
-
-        import_from_itis(client, itis)
+        if args.workers > 1:
+            for _ in range(args.workers):
+                worker_sessions.append(connection_pool.get_session('user', 'password'))
+
+        source = os.path.join('data', 'ITIS-042721.sqlite')
+        itis = sqlite3.connect(source)
+
+        rate = StatementRate() if args.report_rate else None
+        if args.delta_from:
+            import_delta_from_itis(client, itis, args.delta_from, args.batch_size, rate, worker_sessions,
+                                   args.kingdom)
+        else:
+            checkpoint = Checkpoint(args.checkpoint, source, args.kingdom)
+            if checkpoint.state['phases']:
+                print(f'Resuming from {args.checkpoint}: {checkpoint.state["phases"]}')
+            import_from_itis(client, itis, args.batch_size, rate, worker_sessions, args.kingdom, checkpoint)
+            checkpoint.remove()
+        if rate is not None:
+            rate.report()
+        if args.metrics:
+            METRICS.save(args.metrics)
 
     except Exception:
         import traceback
         print(traceback.format_exc())
         if client is not None:
             client.release()
+        for session in worker_sessions:
+            session.release()
         exit(1)
 
 
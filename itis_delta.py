@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# --coding:utf-8--
+
+import os
+import json
+import sqlite3
+import argparse
+import datetime
+import jsonstreams
+from collections import Counter
+from typing import Callable, Dict, List, Tuple
+
+import convert_itis_to_jsongraph as converter
+from jsongraph import EdgeCollector, NodeCollector
+
+# Source tables that contribute to a node or to the edges owned by it, together with
+# the key of the owning entity and the temporary table collecting the changed keys.
+# Conditions may refer to the compared kingdom as :kingdom_id.
+DELTA_TABLES = [
+    ('taxonomic_units', 'tsn', 'delta_units', 'WHERE kingdom_id = :kingdom_id'),
+    ('longnames', 'tsn', 'delta_units', ''),
+    ('synonym_links', 'tsn', 'delta_units', ''),
+    ('geographic_div', 'tsn', 'delta_units', ''),
+    ('nodc_ids', 'tsn', 'delta_units', ''),
+    ('vernaculars', 'vern_id', 'delta_vernaculars', ''),
+    ('taxon_authors_lkp', 'taxon_author_id', 'delta_authors', 'WHERE kingdom_id = :kingdom_id'),
+    ('strippedauthor', 'taxon_author_id', 'delta_authors', ''),
+]
+
+DELTA_KEY_TABLES = {
+    'delta_units': 'tsn',
+    'delta_vernaculars': 'vern_id',
+    'delta_authors': 'taxon_author_id',
+}
+
+# Scans of nodes and edges that are few and derived from whole tables; these are always compared in full.
+GLOBAL_SCANS = [
+    converter.scan_kingdoms,
+    converter.scan_ranks,
+    converter.scan_geographic_divs,
+    converter.scan_languages,
+]
+
+# Scans of nodes and edges that are owned by a taxonomic unit, vernacular or author
+# and only need to be compared for the changed keys.
+ENTITY_SCANS = [
+    converter.scan_authors,
+    converter.scan_taxonomic_units,
+    converter.scan_vernaculars,
+]
+
+
+def attach_previous(itis: sqlite3.Connection, previous_path: str):
+    itis.execute('ATTACH DATABASE ? AS previous', (previous_path,))
+
+
+def find_changed_keys(itis: sqlite3.Connection, kingdom_id: int = converter.DEFAULT_KINGDOM_ID):
+    """Collects the keys of all rows of a kingdom that were added, changed or deleted since the previous dump.
+
+    Expects the previous dump to be attached as `previous`. Rows are compared by their full content
+    within SQLite, so only the keys of the changed rows ever reach Python. The keys are stored
+    in the temporary tables named in DELTA_KEY_TABLES.
+    """
+    for (table, key) in DELTA_KEY_TABLES.items():
+        itis.execute(f'CREATE TEMP TABLE IF NOT EXISTS {table} ({key} INTEGER PRIMARY KEY)')
+
+    for (table, key, delta_table, condition) in DELTA_TABLES:
+        itis.execute(f'''
+            INSERT OR IGNORE INTO temp.{delta_table}
+            SELECT {key} FROM (
+                SELECT * FROM main.{table} {condition}
+                EXCEPT
+                SELECT * FROM previous.{table} {condition})
+            UNION
+            SELECT {key} FROM (
+                SELECT * FROM previous.{table} {condition}
+                EXCEPT
+                SELECT * FROM main.{table} {condition})
+            ''', {'kingdom_id': kingdom_id} if condition else ())
+
+
+def read_changed_keys(itis: sqlite3.Connection) -> Dict[str, List[int]]:
+    return {table: [row[0] for row in itis.execute(f'SELECT {key} FROM temp.{table} WHERE {key} IS NOT NULL')]
+            for (table, key) in DELTA_KEY_TABLES.items()}
+
+
+def store_changed_keys(itis: sqlite3.Connection, keys: Dict[str, List[int]]):
+    for (table, key) in DELTA_KEY_TABLES.items():
+        itis.execute(f'CREATE TEMP TABLE IF NOT EXISTS {table} ({key} INTEGER PRIMARY KEY)')
+        itis.executemany(f'INSERT OR IGNORE INTO temp.{table} VALUES (?)', ((k,) for k in keys[table]))
+
+
+def restrict_to_changed_keys(itis: sqlite3.Connection):
+    """Shadows the source tables with temporary views that only contain the changed entities.
+
+    Unqualified table names resolve to the temp schema first, so the queries of the converter
+    and the importer only see the changed rows. The database file itself is not modified.
+    """
+    itis.executescript('''
+        CREATE TEMP VIEW IF NOT EXISTS vernaculars AS
+            SELECT * FROM main.vernaculars
+            WHERE vern_id IN (SELECT vern_id FROM temp.delta_vernaculars)
+               OR tsn IN (SELECT tsn FROM temp.delta_units);
+        CREATE TEMP VIEW IF NOT EXISTS taxonomic_units AS
+            SELECT * FROM main.taxonomic_units
+            WHERE tsn IN (SELECT tsn FROM temp.delta_units)
+               OR tsn IN (SELECT tsn FROM temp.vernaculars);
+        CREATE TEMP VIEW IF NOT EXISTS taxon_authors_lkp AS
+            SELECT * FROM main.taxon_authors_lkp
+            WHERE taxon_author_id IN (SELECT taxon_author_id FROM temp.delta_authors);
+        ''')
+
+
+def __collect(itis: sqlite3.Connection, scans: List[Callable], nodes: NodeCollector, edges: EdgeCollector,
+              kingdom_id: int):
+    for scan in scans:
+        scan(itis, nodes, edges, kingdom_id)
+
+
+def __edge_key(edge: dict) -> str:
+    return json.dumps(edge, sort_keys=True)
+
+
+def diff_graphs(previous_nodes: Dict[str, dict], previous_edges: List[dict],
+                current_nodes: Dict[str, dict], current_edges: List[dict]) \
+        -> Tuple[Dict[str, dict], List[str], List[dict], List[dict]]:
+    """Returns the upserted nodes, deleted node keys, added edges and deleted edges."""
+    upserted_nodes = {key: node for (key, node) in current_nodes.items()
+                      if previous_nodes.get(key) != node}
+    deleted_nodes = [key for key in previous_nodes if key not in current_nodes]
+
+    # Edges have no identity of their own and may occur more than once; compare them as multisets.
+    edges = {__edge_key(edge): edge for edge in previous_edges + current_edges}
+    previous_counts = Counter(__edge_key(edge) for edge in previous_edges)
+    current_counts = Counter(__edge_key(edge) for edge in current_edges)
+    added_edges = [edges[key] for key in (current_counts - previous_counts).elements()]
+    deleted_edges = [edges[key] for key in (previous_counts - current_counts).elements()]
+    return upserted_nodes, deleted_nodes, added_edges, deleted_edges
+
+
+def read_delta_graph(itis: sqlite3.Connection, kingdom_id: int = converter.DEFAULT_KINGDOM_ID) \
+        -> Tuple[Dict[str, dict], List[dict]]:
+    """Reads the global nodes in full and the nodes and edges of the changed entities only."""
+    nodes = NodeCollector()
+    edges = EdgeCollector()
+    __collect(itis, GLOBAL_SCANS, nodes, edges, kingdom_id)
+    restrict_to_changed_keys(itis)
+    __collect(itis, ENTITY_SCANS, nodes, edges, kingdom_id)
+    return nodes, edges
+
+
+def write_json_patch(previous_path: str, current_path: str, output_path: str,
+                     kingdom_id: int = converter.DEFAULT_KINGDOM_ID):
+    """Writes the difference between two ITIS dumps as a patch to the JSON Graph document.
+
+    Nodes listed under `upsert` replace the node with the same key, or are added. Edges under `upsert`
+    are appended. Nodes under `delete` are removed by key, edges under `delete` are removed by
+    comparing source, target, relation and metadata, once per listed occurrence.
+    """
+    current = sqlite3.connect(current_path)
+    attach_previous(current, previous_path)
+    find_changed_keys(current, kingdom_id)
+    keys = read_changed_keys(current)
+
+    previous = sqlite3.connect(previous_path)
+    store_changed_keys(previous, keys)
+
+    previous_nodes, previous_edges = read_delta_graph(previous, kingdom_id)
+    current_nodes, current_edges = read_delta_graph(current, kingdom_id)
+    upserted_nodes, deleted_nodes, added_edges, deleted_edges = \
+        diff_graphs(previous_nodes, previous_edges, current_nodes, current_edges)
+
+    with jsonstreams.Stream(jsonstreams.Type.OBJECT, filename=output_path, indent=2, pretty=True) as s:
+        with s.subobject('patch') as patch:
+            with patch.subobject('metadata') as meta:
+                meta.write('created', datetime.datetime.now().isoformat())
+                meta.write('previous', os.path.basename(previous_path))
+                meta.write('current', os.path.basename(current_path))
+            with patch.subobject('upsert') as upsert:
+                upsert.write('nodes', upserted_nodes)
+                upsert.write('edges', added_edges)
+            with patch.subobject('delete') as delete:
+                delete.write('nodes', deleted_nodes)
+                delete.write('edges', deleted_edges)
+
+    print(f'{len(upserted_nodes)} nodes upserted, {len(deleted_nodes)} nodes deleted, '
+          f'{len(added_edges)} edges added, {len(deleted_edges)} edges deleted')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Writes the changes between two ITIS dumps as a JSON Graph patch.')
+    parser.add_argument('previous', help='the previously converted ITIS SQLite dump')
+    parser.add_argument('current', help='the new ITIS SQLite dump')
+    parser.add_argument('output', help='the patch file to write')
+    parser.add_argument('--kingdom', type=int, default=converter.DEFAULT_KINGDOM_ID, help='the ITIS kingdom id')
+    args = parser.parse_args()
+    write_json_patch(args.previous, args.current, args.output, args.kingdom)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# --coding:utf-8--
+
+import os
+import sqlite3
+import pathlib
+from typing import Dict, List, Optional, Tuple
+
+# Plantae, the kingdom converted and imported unless others are requested.
+DEFAULT_KINGDOM_ID = 3
+
+SOURCE_MODES = ['disk', 'memory', 'mmap']
+
+# disk reads through a large page cache, mmap maps the whole file and keeps only a small cache,
+# memory copies the database into RAM first. The source file is opened read-only in all modes.
+SOURCE_PRAGMAS = {
+    'disk': {'cache_size': -256 * 1024, 'mmap_size': 0, 'temp_store': 'FILE'},
+    'memory': {'cache_size': -16 * 1024, 'temp_store': 'MEMORY'},
+    'mmap': {'cache_size': -16 * 1024, 'temp_store': 'MEMORY'},
+}
+
+# Lookups of the joins in the converter, as (table, key column, other columns read by the join).
+# An index on the key and the other columns covers the join, so the table itself is never read.
+JOIN_INDEXES = [
+    ('longnames', 'tsn', ['completename']),
+    ('synonym_links', 'tsn', ['tsn_accepted', 'update_date']),
+    ('geographic_div', 'tsn', ['geographic_value', 'update_date']),
+    ('vernaculars', 'tsn', ['vern_id', 'language', 'update_date', 'vernacular_name']),
+    ('nodc_ids', 'tsn', ['nodc_id', 'update_date']),
+    ('strippedauthor', 'taxon_author_id', ['shortauthor']),
+]
+
+
+def connect_read_only(input_path: str, check_same_thread: bool = True) -> sqlite3.Connection:
+    return sqlite3.connect(pathlib.Path(input_path).absolute().as_uri() + '?mode=ro', uri=True,
+                           check_same_thread=check_same_thread)
+
+
+def open_source(input_path: str, mode: str = 'disk', check_same_thread: bool = True) -> sqlite3.Connection:
+    """Opens an ITIS dump read-only and tunes the connection for one sequential conversion.
+
+    Without check_same_thread, the connection may be used by other threads than the one opening it,
+    one at a time.
+    """
+    assert mode in SOURCE_MODES, mode
+    itis = connect_read_only(input_path, check_same_thread)
+    if mode == 'memory':
+        source = itis
+        itis = sqlite3.connect(':memory:', check_same_thread=check_same_thread)
+        source.backup(itis)
+        source.close()
+
+    pragmas = dict(SOURCE_PRAGMAS[mode])
+    if mode == 'mmap':
+        pragmas['mmap_size'] = os.path.getsize(input_path)
+    for (name, value) in pragmas.items():
+        itis.execute(f'PRAGMA {name} = {value}')
+    return itis
+
+
+def __indexed(itis: sqlite3.Connection, table: str, key: str) -> bool:
+    """Tells whether rows of a table in the main schema can be looked up by a column without a scan."""
+    columns = itis.execute(f'PRAGMA main.table_info({table})').fetchall()
+    primary_keys = [(name, column_type) for (_, name, column_type, _, _, pk) in columns if pk]
+    if primary_keys == [(key, 'INTEGER')]:
+        return True
+    for index in itis.execute(f'PRAGMA main.index_list({table})').fetchall():
+        leading = itis.execute(f'PRAGMA main.index_info({index[1]})').fetchone()
+        if leading is not None and leading[2] == key:
+            return True
+    return False
+
+
+def __in_memory(itis: sqlite3.Connection) -> bool:
+    return not any(name == 'main' and file for (_, name, file) in itis.execute('PRAGMA database_list'))
+
+
+def prepare_indexes(itis: sqlite3.Connection) -> List[str]:
+    """Creates the indexes missing for the joins of the converter, without modifying the dump.
+
+    An in-memory copy is indexed in place. Otherwise each table lacking an index is copied into
+    the TEMP schema and indexed there; unqualified table names resolve to the temp schema first,
+    so the queries of the converter read the copy. Returns the names of the created indexes.
+    """
+    created = []
+    in_place = __in_memory(itis)
+    for (table, key, columns) in JOIN_INDEXES:
+        if __indexed(itis, table, key):
+            continue
+        name = f'{table}_{key}'
+        if in_place:
+            itis.execute(f'CREATE INDEX main.{name} ON {table} ({", ".join([key] + columns)})')
+        else:
+            itis.execute(f'CREATE TEMP TABLE {table} AS SELECT * FROM main.{table}')
+            itis.execute(f'CREATE INDEX temp.{name} ON {table} ({", ".join([key] + columns)})')
+        created.append(name)
+    itis.commit()
+    return created
+
+
+def prepare_index_database(input_path: str, path: str) -> List[str]:
+    """Writes indexed copies of the tables lacking an index for the joins into a database file of their own.
+
+    Connections to the dump attach it with attach_index_database, instead of each copying the tables
+    with prepare_indexes. Returns the names of the created indexes.
+    """
+    itis = connect_read_only(input_path)
+    itis.execute('ATTACH DATABASE ? AS prepared', (path,))
+    created = []
+    for (table, key, columns) in JOIN_INDEXES:
+        if __indexed(itis, table, key):
+            continue
+        name = f'{table}_{key}'
+        itis.execute(f'CREATE TABLE prepared.{table} AS SELECT * FROM main.{table}')
+        itis.execute(f'CREATE INDEX prepared.{name} ON {table} ({", ".join([key] + columns)})')
+        created.append(name)
+    itis.commit()
+    itis.close()
+    return created
+
+
+def attach_index_database(itis: sqlite3.Connection, path: str) -> List[str]:
+    """Reads the tables of a database written by prepare_index_database instead of those of the dump.
+
+    A TEMP view over each copy shadows the table of the same name; queries through the views use
+    the indexes of the copies. The views pass on the rowids, which the converter orders some rows by.
+    Returns the names of the shadowed tables.
+    """
+    itis.execute('ATTACH DATABASE ? AS prepared', (pathlib.Path(path).absolute().as_uri() + '?mode=ro',))
+    tables = [name for (name,) in itis.execute("SELECT name FROM prepared.sqlite_master WHERE type = 'table'")]
+    for table in tables:
+        itis.execute(f'CREATE TEMP VIEW {table} AS SELECT rowid, * FROM prepared.{table}')
+    return tables
+
+
+def query_plan(itis: sqlite3.Connection, query: str, parameters: Optional[dict] = None) -> List[Tuple[int, int, str]]:
+    return [(node, parent, detail)
+            for (node, parent, _, detail) in itis.execute(f'EXPLAIN QUERY PLAN {query}', parameters or {})]
+
+
+def full_scan_joins(plan: List[Tuple[int, int, str]]) -> List[str]:
+    """Returns the loops of a query plan that scan a whole table for each row of an outer loop."""
+    outer = set()
+    scans = []
+    for (_, parent, detail) in plan:
+        if not detail.startswith(('SCAN ', 'SEARCH ')):
+            continue
+        if parent in outer and detail.startswith('SCAN '):
+            scans.append(detail)
+        outer.add(parent)
+    return scans
+
+
+def __pragma(itis: sqlite3.Connection, name: str):
+    # In-memory databases have no value for file related settings such as mmap_size.
+    row = itis.execute(f'PRAGMA {name}').fetchone()
+    return None if row is None else row[0]
+
+
+def print_query_plans(itis: sqlite3.Connection, mode: str, queries: Dict[str, str], created: List[str],
+                      parameters: Optional[dict] = None) -> bool:
+    """Prints the plans of the given queries and reports joins that still scan a whole table.
+
+    Returns True if none of the queries contains such a join.
+    """
+    settings = ', '.join(f'{name}={__pragma(itis, name)}' for name in ('cache_size', 'mmap_size', 'temp_store'))
+    print(f'Source mode {mode}: {settings}')
+    print(f'Created indexes: {", ".join(created) if created else "none"}')
+
+    clean = True
+    for (name, query) in queries.items():
+        plan = query_plan(itis, query, parameters)
+        depth = {0: 0}
+        print(f'Query plan of {name}:')
+        for (node, parent, detail) in plan:
+            depth[node] = depth.get(parent, 0) + 1
+            print(f'{"  " * depth[node]}{detail}')
+        for detail in full_scan_joins(plan):
+            print(f'  WARNING: full scan within a join: {detail}')
+            clean = False
+    return clean
@@ -0,0 +1,515 @@
+#!/usr/bin/env python
+# --coding:utf-8--
+
+import io
+import os
+import json
+import pickle
+import tempfile
+import contextlib
+import jsonstreams
+from json.encoder import encode_basestring_ascii
+from typing import Iterator, Optional, TextIO, Tuple
+
+# Writers in this module share the write/subobject/subarray interface of jsonstreams.Object
+# and jsonstreams.Array: the graph is an object with attributes, a "nodes" object keyed by node
+# label and an "edges" array. Nodes and edges are passed as plain dicts.
+
+
+def write_fields(obj: jsonstreams.Object, value: dict):
+    """Writes a dict into a jsonstreams object field by field, opening subobjects for nested dicts."""
+    for (key, field) in value.items():
+        if isinstance(field, dict):
+            with obj.subobject(key) as sub:
+                write_fields(sub, field)
+        else:
+            obj.write(key, field)
+
+
+class JsonObjectWriter:
+    """Writes into a jsonstreams object, streaming nested dicts field by field."""
+
+    def __init__(self, obj: jsonstreams.Object):
+        self.obj = obj
+
+    def write(self, key: str, value):
+        if isinstance(value, dict):
+            with self.obj.subobject(key) as sub:
+                write_fields(sub, value)
+        else:
+            self.obj.write(key, value)
+
+    @contextlib.contextmanager
+    def subobject(self, key: str):
+        with self.obj.subobject(key) as sub:
+            yield JsonObjectWriter(sub)
+
+    @contextlib.contextmanager
+    def subarray(self, key: str):
+        with self.obj.subarray(key) as sub:
+            yield JsonArrayWriter(sub)
+
+
+class JsonArrayWriter:
+    """Writes into a jsonstreams array, streaming dict elements field by field."""
+
+    def __init__(self, array: jsonstreams.Array):
+        self.array = array
+
+    def write(self, value):
+        if isinstance(value, dict):
+            with self.array.subobject() as sub:
+                write_fields(sub, value)
+        else:
+            self.array.write(value)
+
+    @contextlib.contextmanager
+    def subobject(self):
+        with self.array.subobject() as sub:
+            yield JsonObjectWriter(sub)
+
+
+class FastObjectWriter:
+    """Writes a JSON object in the format of jsonstreams.Object, encoding each value in one shot.
+
+    Nested dicts are serialised by the C encoder of the json module instead of field by field,
+    and every member is sent to the file in a single write. Only the compact (indent=None) and
+    the pretty printed layouts of jsonstreams are supported.
+    """
+
+    def __init__(self, fd: TextIO, indent: Optional[int] = None, depth: int = 0, indent_opening: bool = False):
+        self.fd = fd
+        self.indent = indent
+        self.depth = depth
+        self.encode = json.JSONEncoder(indent=indent).encode
+        self.pad = ' ' * ((indent or 0) * (depth + 1))
+        self.separator = ',\n' if indent else ', '
+        self.first = True
+        opening = ' ' * ((indent or 0) * depth) if indent_opening else ''
+        fd.write(opening + self.OPENING + ('\n' if indent else ''))
+
+    OPENING = '{'
+    CLOSING = '}'
+
+    def _value(self, value) -> str:
+        text = self.encode(value)
+        if self.indent:
+            text = text.replace('\n', '\n' + self.pad)
+        return text
+
+    def _prefix(self) -> str:
+        if self.first:
+            self.first = False
+            return self.pad
+        return self.separator + self.pad
+
+    def write(self, key: str, value):
+        self.fd.write(f'{self._prefix()}{encode_basestring_ascii(key)}: {self._value(value)}')
+
+    def subobject(self, key: str) -> 'FastObjectWriter':
+        self.fd.write(f'{self._prefix()}{encode_basestring_ascii(key)}: ')
+        return FastObjectWriter(self.fd, self.indent, self.depth + 1)
+
+    def subarray(self, key: str) -> 'FastArrayWriter':
+        self.fd.write(f'{self._prefix()}{encode_basestring_ascii(key)}: ')
+        return FastArrayWriter(self.fd, self.indent, self.depth + 1)
+
+    def close(self):
+        closing = ('\n' + ' ' * (self.indent * self.depth)) if self.indent else ''
+        self.fd.write(closing + self.CLOSING)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, evalue, traceback):
+        self.close()
+
+
+class FastArrayWriter(FastObjectWriter):
+    """Writes a JSON array in the format of jsonstreams.Array, encoding each element in one shot."""
+
+    OPENING = '['
+    CLOSING = ']'
+
+    def write(self, value):
+        self.fd.write(self._prefix() + self._value(value))
+
+    def subobject(self) -> FastObjectWriter:
+        self.fd.write(self.separator if not self.first else '')
+        self.first = False
+        return FastObjectWriter(self.fd, self.indent, self.depth + 1, indent_opening=True)
+
+    def subarray(self) -> 'FastArrayWriter':
+        self.fd.write(self.separator if not self.first else '')
+        self.first = False
+        return FastArrayWriter(self.fd, self.indent, self.depth + 1, indent_opening=True)
+
+
+class NodeCollector(dict):
+    """Collects the nodes written into it by key."""
+
+    def write(self, key: str, node: dict):
+        self[key] = node
+
+
+class EdgeCollector(list):
+    """Collects the edges written into it."""
+
+    def write(self, edge: dict):
+        self.append(edge)
+
+
+class Discard:
+    """Ignores everything written into it, for the nodes or edges of a scan that are not needed."""
+
+    def write(self, *args):
+        pass
+
+
+class EdgeSpool:
+    """Buffers edges in a temporary file, so that they can be written after the nodes they were read with."""
+
+    BATCH_SIZE = 4096
+
+    def __init__(self, dir: Optional[str] = None):
+        self.file = tempfile.TemporaryFile(dir=dir)
+        self.batch = []
+
+    def write(self, edge: dict):
+        self.batch.append(edge)
+        if len(self.batch) >= self.BATCH_SIZE:
+            self.__dump()
+
+    def __dump(self):
+        if self.batch:
+            pickle.dump(self.batch, self.file, protocol=pickle.HIGHEST_PROTOCOL)
+            self.batch = []
+
+    def replay(self, edges):
+        """Writes all spooled edges into an edges writer, in the order they were spooled."""
+        self.__dump()
+        self.file.seek(0)
+        while True:
+            try:
+                batch = pickle.load(self.file)
+            except EOFError:
+                break
+            for edge in batch:
+                edges.write(edge)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, evalue, traceback):
+        self.close()
+
+
+def dot_string(value: str) -> str:
+    value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{value}"'
+
+
+class DotNodeWriter:
+    """Writes a line per node; of several nodes with the same key, like the languages of ITIS, only the first."""
+
+    def __init__(self, fd: TextIO):
+        self.fd = fd
+        self.keys = set()
+
+    def write(self, key: str, node: dict):
+        if key in self.keys:
+            return
+        self.keys.add(key)
+        self.fd.write(f'{dot_string(key)} [label={dot_string(node["label"])}];\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, evalue, traceback):
+        pass
+
+
+class DotEdgeWriter:
+    def __init__(self, fd: TextIO):
+        self.fd = fd
+
+    def write(self, edge: dict):
+        self.fd.write(f'{dot_string(edge["source"])} -> {dot_string(edge["target"])} '
+                      f'[label={dot_string(edge["relation"])}];\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, evalue, traceback):
+        pass
+
+
+class DotGraphWriter:
+    """Writes the nodes and edges of a graph as a Graphviz digraph, one line per node or edge."""
+
+    def __init__(self, fd: TextIO):
+        self.fd = fd
+        self.id = ''
+        self.opened = False
+
+    def write(self, key: str, value):
+        if key == 'id':
+            self.id = value
+
+    def __open(self):
+        if not self.opened:
+            self.fd.write(f'digraph {dot_string(self.id)} {{\n')
+            self.opened = True
+
+    def subobject(self, key: str) -> DotNodeWriter:
+        assert key == 'nodes', key
+        self.__open()
+        return DotNodeWriter(self.fd)
+
+    def subarray(self, key: str) -> DotEdgeWriter:
+        assert key == 'edges', key
+        self.__open()
+        return DotEdgeWriter(self.fd)
+
+    def close(self):
+        self.__open()
+        self.fd.write('}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, evalue, traceback):
+        if etype is None:
+            self.close()
+
+
+class FanOut:
+    """Sends every attribute, node and edge to several writers."""
+
+    def __init__(self, *targets):
+        self.targets = targets
+
+    def write(self, *args):
+        for target in self.targets:
+            target.write(*args)
+
+    def subobject(self, *args):
+        return self.__sub('subobject', args)
+
+    def subarray(self, *args):
+        return self.__sub('subarray', args)
+
+    @contextlib.contextmanager
+    def __sub(self, method: str, args):
+        with contextlib.ExitStack() as stack:
+            yield FanOut(*[stack.enter_context(getattr(target, method)(*args)) for target in self.targets])
+
+
+# The nodes object and the edges array are nested two levels deep, in {"graph": {"nodes": ...}}.
+SECTION_DEPTH = 2
+
+
+def open_fragment(fd: TextIO, section: str, indent: Optional[int], pretty: bool, depth: int = SECTION_DEPTH):
+    """Opens a jsonstreams element for a part of the nodes or edges section of a document.
+
+    The element is indented as it would be within the document written by jsonstreams.Stream
+    with the same options, so that its body can be spliced into the document with splice_fragment.
+    The "nodes" section is an object, all other sections are arrays.
+    """
+    element = jsonstreams.Object if section == 'nodes' else jsonstreams.Array
+    encoder = jsonstreams.json.JSONEncoder(indent=indent)
+    return element(fd, indent, depth, encoder, pretty=pretty)
+
+
+@contextlib.contextmanager
+def fragment_writer(fd: TextIO, section: str, indent: Optional[int], pretty: bool, engine: str = 'jsonstreams',
+                    depth: int = SECTION_DEPTH):
+    """Opens a fragment with open_fragment, or its equivalent of the fast engine, and yields a writer for it."""
+    if engine == 'fast':
+        assert pretty == bool(indent), 'the fast engine only writes the compact and pretty layouts'
+        element = FastObjectWriter if section == 'nodes' else FastArrayWriter
+        with element(fd, indent, depth) as fragment:
+            yield fragment
+    else:
+        with open_fragment(fd, section, indent, pretty, depth) as fragment:
+            yield JsonObjectWriter(fragment) if section == 'nodes' else JsonArrayWriter(fragment)
+
+
+@contextlib.contextmanager
+def graph_writer(fd: TextIO, indent: Optional[int], engine: str = 'jsonstreams'):
+    """Writes a {"graph": {...}} document into an open file and yields a writer for the graph object.
+
+    The jsonstreams engine pretty prints whenever an indent is given; the fast engine writes the
+    same bytes.
+    """
+    if engine == 'fast':
+        with FastObjectWriter(fd, indent) as root, root.subobject('graph') as graph:
+            yield graph
+    else:
+        with jsonstreams.Stream(jsonstreams.Type.OBJECT, fd=fd, indent=indent, pretty=indent is not None,
+                                close_fd=False) as s, s.subobject('graph') as graph:
+            yield JsonObjectWriter(graph)
+
+
+ENGINES = ['jsonstreams', 'fast']
+
+
+class FragmentSplicer:
+    """Copies the bodies of fragment files into an open nodes object or edges array of a document.
+
+    The bodies are separated the same way jsonstreams separates elements, so the result is
+    identical to writing all elements into the section directly.
+    """
+
+    def __init__(self, fd: TextIO, section: str, indent: Optional[int], pretty: bool, depth: int = SECTION_DEPTH):
+        self.fd = fd
+        self.separator = ',\n' if indent else jsonstreams.json.JSONEncoder().item_separator
+        empty = io.StringIO()
+        open_fragment(empty, section, indent, pretty, depth).close()
+        empty = empty.getvalue()
+        self.opening = empty[:2] if indent else empty[:1]
+        self.closing = empty[len(self.opening):]
+        self.empty = True
+
+    def splice(self, fragment_path: str):
+        # jsonstreams escapes all non-ASCII characters, so characters and bytes are interchangeable.
+        with open(fragment_path, 'r', encoding='ascii') as f:
+            size = os.fstat(f.fileno()).st_size
+            body = size - len(self.opening) - len(self.closing)
+            assert f.read(len(self.opening)) == self.opening, fragment_path
+            if body <= 0:
+                return
+            if not self.empty:
+                self.fd.write(self.separator)
+            self.empty = False
+            while body > 0:
+                chunk = f.read(min(body, 1 << 20))
+                self.fd.write(chunk)
+                body -= len(chunk)
+            assert f.read() == self.closing, fragment_path
+
+
+class GraphReader:
+    """Reads a JSON Graph document incrementally, yielding one attribute, node or edge at a time.
+
+    Only the structure down to the individual nodes and edges is tokenized here; each node,
+    edge or attribute value is decoded on its own, so memory use is bounded by the largest
+    single value instead of the whole document.
+    """
+
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, fd: TextIO):
+        self.fd = fd
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def __fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.fd.read(self.CHUNK_SIZE)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def __peek(self) -> str:
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.__fill():
+                raise ValueError('Unexpected end of JSON document')
+
+    def __expect(self, token: str):
+        found = self.__peek()
+        if found != token:
+            raise ValueError(f'Expected {token!r} but found {found!r} at offset {self.pos}')
+        self.pos += 1
+
+    def __value(self):
+        self.__peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number at the end of the buffer may continue in the next chunk.
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.__fill()
+
+    def __members(self) -> Iterator[str]:
+        """Iterates the keys of an object; the caller has to consume each member's value."""
+        self.__expect('{')
+        if self.__peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.__value()
+            self.__expect(':')
+            yield key
+            if self.__peek() == ',':
+                self.pos += 1
+                continue
+            self.__expect('}')
+            return
+
+    def __elements(self) -> Iterator[None]:
+        """Iterates the elements of an array; the caller has to consume each element."""
+        self.__expect('[')
+        if self.__peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield None
+            if self.__peek() == ',':
+                self.pos += 1
+                continue
+            self.__expect(']')
+            return
+
+    def __iter__(self) -> Iterator[Tuple]:
+        """Yields ('attribute', key, value), ('node', key, node) and ('edge', edge) tuples."""
+        for root_key in self.__members():
+            if root_key != 'graph':
+                self.__value()
+                continue
+            for key in self.__members():
+                if key == 'nodes':
+                    for node_key in self.__members():
+                        yield 'node', node_key, self.__value()
+                elif key == 'edges':
+                    for _ in self.__elements():
+                        yield 'edge', self.__value()
+                else:
+                    yield 'attribute', key, self.__value()
+
+
+def copy_graph(fd: TextIO, graph):
+    """Reads a JSON Graph document incrementally and writes it into a graph writer."""
+    nodes = None
+    edges = None
+    with contextlib.ExitStack() as nodes_scope, contextlib.ExitStack() as edges_scope:
+        for item in GraphReader(fd):
+            if item[0] == 'node':
+                if nodes is None:
+                    nodes = nodes_scope.enter_context(graph.subobject('nodes'))
+                nodes.write(item[1], item[2])
+            elif item[0] == 'edge':
+                if edges is None:
+                    nodes_scope.close()
+                    edges = edges_scope.enter_context(graph.subarray('edges'))
+                edges.write(item[1])
+            else:
+                graph.write(item[1], item[2])
@@ -0,0 +1,431 @@
+#!/usr/bin/env python
+# --coding:utf-8--
+
+import os
+import json
+import math
+import queue
+import asyncio
+import sqlite3
+import argparse
+import tempfile
+import contextlib
+import collections
+import numpy as np
+import tornado.web
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from itis_source import SOURCE_MODES, attach_index_database, open_source, prepare_index_database, prepare_indexes
+from metrics import METRICS, prometheus_text
+
+DEFAULT_PORT = 5700
+
+LOOKUPS = ['unit', 'ancestors', 'children', 'accepted', 'vernaculars']
+
+# Units read per query; below the default limit of SQLite on bound parameters.
+LOOKUP_BATCH = 500
+
+# Lookups accepted by one batch request.
+MAX_BATCH = 1000
+
+# Parent links followed at most, so that a cycle of parents ends.
+MAX_DEPTH = 64
+
+# Latencies kept per endpoint for the percentiles.
+LATENCY_WINDOW = 10000
+
+UNIT_QUERY = '''
+    SELECT tu.tsn, tu.complete_name, tu.name_usage,
+           tu.kingdom_id, k.kingdom_name, tu.rank_id, r.rank_name,
+           tu.parent_tsn, a.shortauthor, tu.update_date
+    FROM main.taxonomic_units AS tu
+    LEFT JOIN kingdoms AS k ON k.kingdom_id = tu.kingdom_id
+    LEFT JOIN taxon_unit_types AS r ON r.kingdom_id = tu.kingdom_id AND r.rank_id = tu.rank_id
+    LEFT JOIN strippedauthor AS a ON a.taxon_author_id = tu.taxon_author_id
+    WHERE tu.tsn IN ({})
+    '''
+
+# The ancestors of a unit, from the root of its tree down to its parent.
+ANCESTOR_QUERY = '''
+    WITH RECURSIVE chain(tsn, depth) AS (
+        SELECT parent_tsn, 1 FROM main.taxonomic_units WHERE tsn = :tsn
+        UNION ALL
+        SELECT tu.parent_tsn, chain.depth + 1
+        FROM chain JOIN main.taxonomic_units AS tu ON tu.tsn = chain.tsn
+        WHERE chain.depth < :max_depth
+    )
+    SELECT tu.tsn, tu.complete_name, tu.rank_id, r.rank_name
+    FROM chain
+    JOIN main.taxonomic_units AS tu ON tu.tsn = chain.tsn
+    LEFT JOIN taxon_unit_types AS r ON r.kingdom_id = tu.kingdom_id AND r.rank_id = tu.rank_id
+    ORDER BY chain.depth DESC
+    '''
+
+# The lowest accepted TSN a synonym links to, as in synonyms.read_synonym_links.
+SYNONYM_LINK_QUERY = '''
+    SELECT MIN(tsn_accepted) FROM synonym_links
+    WHERE tsn = ? AND tsn_accepted IS NOT NULL AND tsn_accepted != 0
+    '''
+
+VERNACULAR_QUERY = '''
+    SELECT vern_id, vernacular_name, language, update_date
+    FROM vernaculars
+    WHERE tsn = :tsn AND (:language IS NULL OR language = :language)
+    ORDER BY vern_id
+    '''
+
+
+class ConnectionPool:
+    """Read-only connections to an ITIS dump, each used by one thread at a time.
+
+    In the disk and mmap modes, the tables lacking an index for the joins are copied and indexed once,
+    into a temporary database all connections attach. In the memory mode, the single connection indexes
+    its copy of the dump in place.
+    """
+
+    def __init__(self, input_path: str, size: int, mode: str = 'disk'):
+        assert size > 0, size
+        assert mode != 'memory' or size == 1, 'the memory mode copies the dump into every connection'
+        self.size = size
+        self.connections = queue.Queue()
+        self.indexes = None
+        index_path = None
+        if mode != 'memory':
+            self.indexes = tempfile.TemporaryDirectory()
+            index_path = os.path.join(self.indexes.name, 'indexes.sqlite')
+            prepare_index_database(input_path, index_path)
+        for _ in range(size):
+            itis = open_source(input_path, mode, check_same_thread=False)
+            if index_path is None:
+                prepare_indexes(itis)
+            else:
+                attach_index_database(itis, index_path)
+            self.connections.put(itis)
+
+    @contextlib.contextmanager
+    def connection(self):
+        itis = self.connections.get()
+        try:
+            yield itis
+        finally:
+            self.connections.put(itis)
+
+    def close(self):
+        for _ in range(self.size):
+            self.connections.get().close()
+        if self.indexes is not None:
+            self.indexes.cleanup()
+
+
+class ChildIndex:
+    """The TSNs of the children of every unit, sorted by parent and TSN.
+
+    ITIS dumps have no index on parent_tsn, so the pairs are read once and shared by all threads.
+    """
+
+    def __init__(self, itis: sqlite3.Connection):
+        rows = itis.execute('SELECT parent_tsn, tsn FROM main.taxonomic_units WHERE parent_tsn > 0 '
+                            'ORDER BY parent_tsn, tsn').fetchall()
+        self.parents = np.array([parent_tsn for (parent_tsn, _) in rows], dtype=np.int64)
+        self.tsns = np.array([tsn for (_, tsn) in rows], dtype=np.int64)
+
+    def children(self, tsn: int) -> List[int]:
+        first = int(np.searchsorted(self.parents, tsn, side='left'))
+        last = int(np.searchsorted(self.parents, tsn, side='right'))
+        return self.tsns[first:last].tolist()
+
+
+class LruCache:
+    """A mapping of at most capacity entries, evicting the least recently used one.
+
+    It is only used from the thread of the event loop, so it needs no lock.
+    """
+
+    MISSING = object()
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """The value of a key, or MISSING."""
+        value = self.entries.get(key, self.MISSING)
+        if value is self.MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if self.capacity <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def as_dict(self) -> dict:
+        return {'size': len(self.entries), 'capacity': self.capacity, 'hits': self.hits, 'misses': self.misses}
+
+
+class LatencyWindow:
+    """The latencies of the last requests to an endpoint, for its percentiles."""
+
+    def __init__(self, size: int = LATENCY_WINDOW):
+        self.seconds = collections.deque(maxlen=size)
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.seconds.append(seconds)
+        self.count += 1
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """The nearest-rank percentile of the window, in seconds."""
+        if not self.seconds:
+            return None
+        ordered = sorted(self.seconds)
+        return ordered[max(0, math.ceil(len(ordered) * percent / 100) - 1)]
+
+    def as_dict(self) -> dict:
+        (p50, p99) = (self.percentile(50), self.percentile(99))
+        return {
+            'count': self.count,
+            'p50_ms': None if p50 is None else round(p50 * 1000, 3),
+            'p99_ms': None if p99 is None else round(p99 * 1000, 3),
+        }
+
+
+class TaxonLookup:
+    """The lookups of the service, run on a pool of connections in worker threads.
+
+    Results are cached by lookup, TSN and language; lookups of units that do not exist yield None,
+    which is cached as well.
+    """
+
+    def __init__(self, pool: ConnectionPool, child_index: ChildIndex, cache: LruCache):
+        self.pool = pool
+        self.child_index = child_index
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(pool.size)
+        self.latencies: Dict[str, LatencyWindow] = {}
+
+    @staticmethod
+    def __units(itis: sqlite3.Connection, tsns: List[int]) -> Dict[int, dict]:
+        units = {}
+        for first in range(0, len(tsns), LOOKUP_BATCH):
+            batch = tsns[first:first + LOOKUP_BATCH]
+            for (tsn, name, name_usage, kingdom_id, kingdom_name, rank_id, rank_name, parent_tsn, author,
+                 update_date) in itis.execute(UNIT_QUERY.format(','.join('?' * len(batch))), batch):
+                units[tsn] = {
+                    'tsn': tsn,
+                    'name': name,
+                    'name_usage': name_usage,
+                    'kingdom': {'id': kingdom_id, 'name': kingdom_name},
+                    'rank': {'id': rank_id, 'name': rank_name},
+                    'parent_tsn': parent_tsn if parent_tsn else None,
+                    'author': author,
+                    'update_date': update_date,
+                }
+        return units
+
+    @staticmethod
+    def __ancestors(itis: sqlite3.Connection, tsn: int) -> List[dict]:
+        return [{'tsn': ancestor, 'name': name, 'rank': {'id': rank_id, 'name': rank_name}}
+                for (ancestor, name, rank_id, rank_name)
+                in itis.execute(ANCESTOR_QUERY, {'tsn': tsn, 'max_depth': MAX_DEPTH})]
+
+    @staticmethod
+    def __accepted(itis: sqlite3.Connection, tsn: int) -> Tuple[Optional[int], int]:
+        """The accepted TSN of a unit, or None if its links form a cycle, and the number of hops to it."""
+        seen = {tsn}
+        hops = 0
+        while True:
+            (accepted,) = itis.execute(SYNONYM_LINK_QUERY, (tsn,)).fetchone()
+            if accepted is None:
+                return tsn, hops
+            if accepted in seen:
+                return None, -1
+            seen.add(accepted)
+            tsn = accepted
+            hops += 1
+
+    def __query(self, lookup: str, keys: List[Tuple[int, Optional[str]]]) -> list:
+        """Runs lookups of one kind in a worker thread, returning their results in the order of the keys."""
+        tsns = sorted({tsn for (tsn, _) in keys})
+        with self.pool.connection() as itis:
+            if lookup == 'children':
+                children = {tsn: self.child_index.children(tsn) for tsn in tsns}
+                units = self.__units(itis, tsns + sorted({child for below in children.values() for child in below}))
+            else:
+                units = self.__units(itis, tsns)
+            results = []
+            for (tsn, language) in keys:
+                if tsn not in units:
+                    results.append(None)
+                elif lookup == 'unit':
+                    results.append(units[tsn])
+                elif lookup == 'ancestors':
+                    results.append(self.__ancestors(itis, tsn))
+                elif lookup == 'children':
+                    results.append([units[child] for child in children[tsn] if child in units])
+                elif lookup == 'accepted':
+                    (accepted, hops) = self.__accepted(itis, tsn)
+                    accepted_unit = self.__units(itis, [accepted]).get(accepted) if accepted is not None else None
+                    results.append({'tsn': tsn, 'accepted_tsn': accepted, 'hops': hops,
+                                    'accepted_name': accepted_unit['name'] if accepted_unit else None})
+                else:
+                    results.append([{'vern_id': vern_id, 'name': name, 'language': vernacular_language,
+                                     'update_date': update_date}
+                                    for (vern_id, name, vernacular_language, update_date)
+                                    in itis.execute(VERNACULAR_QUERY, {'tsn': tsn, 'language': language})])
+        return results
+
+    async def batch(self, lookups: List[Tuple[str, int, Optional[str]]]) -> list:
+        """Answers (lookup, tsn, language) lookups from the cache, and the others with one task per kind of lookup."""
+        results = [None] * len(lookups)
+        missing: Dict[str, List[Tuple[int, Tuple[int, Optional[str]]]]] = {}
+        for (i, (lookup, tsn, language)) in enumerate(lookups):
+            assert lookup in LOOKUPS, lookup
+            value = self.cache.get((lookup, tsn, language))
+            if value is LruCache.MISSING:
+                missing.setdefault(lookup, []).append((i, (tsn, language)))
+            else:
+                results[i] = value
+        loop = asyncio.get_running_loop()
+        kinds = list(missing)
+        answers = await asyncio.gather(*[
+            loop.run_in_executor(self.executor, self.__query, lookup, [key for (_, key) in missing[lookup]])
+            for lookup in kinds])
+        for (lookup, values) in zip(kinds, answers):
+            for ((i, (tsn, language)), value) in zip(missing[lookup], values):
+                self.cache.put((lookup, tsn, language), value)
+                results[i] = value
+        return results
+
+    async def lookup(self, lookup: str, tsn: int, language: Optional[str] = None):
+        return (await self.batch([(lookup, tsn, language)]))[0]
+
+    def observe(self, endpoint: str, seconds: float):
+        self.latencies.setdefault(endpoint, LatencyWindow()).observe(seconds)
+        METRICS.observe('lookup_seconds', endpoint, seconds)
+
+    def stats(self) -> dict:
+        return {
+            'latency': {endpoint: window.as_dict() for (endpoint, window) in self.latencies.items()},
+            'cache': self.cache.as_dict(),
+        }
+
+
+class BaseHandler(tornado.web.RequestHandler):
+    def initialize(self, service: TaxonLookup, endpoint: str):
+        self.service = service
+        self.endpoint = endpoint
+
+    def on_finish(self):
+        self.service.observe(self.endpoint, self.request.request_time())
+
+    def write_error(self, status_code: int, **kwargs):
+        self.finish({'error': self._reason})
+
+
+class LookupHandler(BaseHandler):
+    async def get(self, tsn: str, language: Optional[str] = None):
+        # The router passes the path arguments percent-decoded already (with url_unescape), so a language
+        # such as Native%20American arrives as 'Native American' and must not be decoded again.
+        result = await self.service.lookup(self.endpoint, int(tsn), language)
+        if result is None:
+            raise tornado.web.HTTPError(404, reason=f'No taxonomic unit {tsn}')
+        self.write({'result': result})
+
+
+class BatchHandler(BaseHandler):
+    """Answers a list of lookups, given as {"lookups": [{"lookup": "unit", "tsn": 18063}, ...]}.
+
+    Results are in the order of the lookups, and null for units that do not exist.
+    """
+
+    @staticmethod
+    def __lookup(entry: dict) -> Tuple[str, int, Optional[str]]:
+        (lookup, language) = (entry['lookup'], entry.get('language'))
+        if not isinstance(lookup, str) or not isinstance(language, (str, type(None))):
+            raise TypeError(entry)
+        return lookup, int(entry['tsn']), language
+
+    async def post(self):
+        try:
+            lookups = [self.__lookup(entry) for entry in json.loads(self.request.body)['lookups']]
+        except (ValueError, KeyError, TypeError):
+            raise tornado.web.HTTPError(400, reason='Expected {"lookups": [{"lookup": ..., "tsn": ...}, ...]}')
+        unknown = sorted({lookup for (lookup, _, _) in lookups if lookup not in LOOKUPS})
+        if unknown:
+            raise tornado.web.HTTPError(400, reason=f'Unknown lookups: {", ".join(map(str, unknown))}')
+        if len(lookups) > MAX_BATCH:
+            raise tornado.web.HTTPError(400, reason=f'At most {MAX_BATCH} lookups per batch')
+        self.write({'results': await self.service.batch(lookups)})
+
+
+class StatsHandler(BaseHandler):
+    def get(self):
+        self.write(self.service.stats())
+
+
+class MetricsHandler(BaseHandler):
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.write(prometheus_text(METRICS.report()))
+
+
+def make_app(service: TaxonLookup) -> tornado.web.Application:
+    """The routes of the service; languages are a path segment, as the nginx route only passes paths."""
+    def route(pattern: str, handler, endpoint: str):
+        return pattern, handler, {'service': service, 'endpoint': endpoint}
+
+    return tornado.web.Application([
+        route(r'/units/(\d+)', LookupHandler, 'unit'),
+        route(r'/units/(\d+)/ancestors', LookupHandler, 'ancestors'),
+        route(r'/units/(\d+)/children', LookupHandler, 'children'),
+        route(r'/units/(\d+)/accepted', LookupHandler, 'accepted'),
+        route(r'/units/(\d+)/vernaculars(?:/([^/]+))?', LookupHandler, 'vernaculars'),
+        route(r'/batch', BatchHandler, 'batch'),
+        route(r'/stats', StatsHandler, 'stats'),
+        route(r'/metrics', MetricsHandler, 'metrics'),
+    ])
+
+
+async def serve(service: TaxonLookup, port: int, address: str):
+    make_app(service).listen(port, address)
+    print(f'Listening on {address or "*"}:{port}')
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serves lookups of ITIS taxonomic units over HTTP.')
+    parser.add_argument('input', help='the ITIS SQLite dump')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='the port to listen on')
+    parser.add_argument('--address', default='', help='the address to listen on; all addresses by default')
+    parser.add_argument('--pool-size', type=int, default=4, help='number of SQLite connections and worker threads')
+    parser.add_argument('--cache-size', type=int, default=100000, help='number of lookup results kept in memory')
+    parser.add_argument('--source-mode', choices=SOURCE_MODES, default='mmap',
+                        help='how the connections read the dump; memory copies it into a single connection')
+    args = parser.parse_args()
+    if args.source_mode == 'memory' and args.pool_size > 1:
+        parser.error('--source-mode memory would copy the database into every connection; use disk or mmap '
+                     'with --pool-size')
+
+    METRICS.enable()
+    pool = ConnectionPool(args.input, args.pool_size, args.source_mode)
+    with pool.connection() as itis:
+        child_index = ChildIndex(itis)
+    service = TaxonLookup(pool, child_index, LruCache(args.cache_size))
+    try:
+        asyncio.run(serve(service, args.port, args.address))
+    finally:
+        pool.close()
+
+
+if __name__ == '__main__':
+    main()
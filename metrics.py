@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+# --coding:utf-8--
+
+import json
+import time
+import bisect
+import resource
+import threading
+import contextlib
+from typing import Callable, Dict, List, Optional, TextIO
+
+# Upper bounds in seconds of the buckets of the latency histograms.
+LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.]
+
+STAGE_FIELDS = ['seconds', 'rows_read', 'read_seconds', 'rows', 'write_seconds', 'bytes', 'peak_rss_bytes']
+
+
+class Stage:
+    """Measurements of one stage of a run.
+
+    Time spent iterating the cursors of a connection from connection() counts as read time, time
+    spent in the writers from writer() as write time. The rest of the wall time is spent in between,
+    e.g. building the nodes and edges. Bytes are counted on the outputs from output().
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.seconds = 0.
+        self.rows_read = 0
+        self.read_seconds = 0.
+        self.rows = 0
+        self.write_seconds = 0.
+        self.bytes = 0
+        self.peak_rss_bytes = 0
+
+    def as_dict(self) -> dict:
+        return {field: getattr(self, field) for field in STAGE_FIELDS}
+
+    def add(self, values: dict):
+        for field in STAGE_FIELDS:
+            if field == 'peak_rss_bytes':
+                self.peak_rss_bytes = max(self.peak_rss_bytes, values[field])
+            else:
+                setattr(self, field, getattr(self, field) + values[field])
+
+
+class TimedCursor:
+    def __init__(self, cursor, stage: Stage):
+        self.cursor = cursor
+        self.stage = stage
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = next(self.cursor)
+        finally:
+            self.stage.read_seconds += time.perf_counter() - start
+        self.stage.rows_read += 1
+        return row
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self.cursor.fetchone()
+        self.stage.read_seconds += time.perf_counter() - start
+        self.stage.rows_read += row is not None
+        return row
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = self.cursor.fetchall()
+        self.stage.read_seconds += time.perf_counter() - start
+        self.stage.rows_read += len(rows)
+        return rows
+
+    def fetchmany(self, size: int):
+        start = time.perf_counter()
+        rows = self.cursor.fetchmany(size)
+        self.stage.read_seconds += time.perf_counter() - start
+        self.stage.rows_read += len(rows)
+        return rows
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+
+class TimedConnection:
+    """Passes queries on to a connection and times the iteration of their cursors."""
+
+    def __init__(self, connection, stage: Stage):
+        self.connection = connection
+        self.stage = stage
+
+    def execute(self, *args) -> TimedCursor:
+        start = time.perf_counter()
+        cursor = self.connection.execute(*args)
+        self.stage.read_seconds += time.perf_counter() - start
+        return TimedCursor(cursor, self.stage)
+
+    def __getattr__(self, name: str):
+        return getattr(self.connection, name)
+
+
+class TimedWriter:
+    """Passes nodes, edges or attributes on to a writer, counting them and timing the writer."""
+
+    def __init__(self, writer, stage: Stage):
+        self.writer = writer
+        self.stage = stage
+
+    def write(self, *args):
+        start = time.perf_counter()
+        self.writer.write(*args)
+        self.stage.write_seconds += time.perf_counter() - start
+        self.stage.rows += 1
+
+
+class CountedOutput:
+    """Passes text on to an output file and adds its length to the stage that is currently measured."""
+
+    def __init__(self, fd: TextIO, metrics: 'Metrics'):
+        self.fd = fd
+        self.metrics = metrics
+
+    def write(self, text: str) -> int:
+        if self.metrics.current is not None:
+            self.metrics.current.bytes += len(text)
+        return self.fd.write(text)
+
+    def __getattr__(self, name: str):
+        return getattr(self.fd, name)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def as_dict(self) -> dict:
+        return {
+            'buckets': {str(bound): count for (bound, count) in zip(LATENCY_BUCKETS + ['+Inf'], self.counts)},
+            'count': self.count,
+            'sum': self.sum,
+        }
+
+
+def __label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(report: dict, prefix: str = 'itis') -> str:
+    """Formats a report of Metrics in the Prometheus text exposition format."""
+    lines = []
+    for field in STAGE_FIELDS:
+        lines.append(f'# TYPE {prefix}_stage_{field} gauge')
+        for (stage, values) in report['stages'].items():
+            lines.append(f'{prefix}_stage_{field}{{stage="{__label(stage)}"}} {values[field]}')
+    for (name, histograms) in report['histograms'].items():
+        lines.append(f'# TYPE {prefix}_{name} histogram')
+        for (kind, histogram) in histograms.items():
+            cumulative = 0
+            for (bound, count) in histogram['buckets'].items():
+                cumulative += count
+                lines.append(f'{prefix}_{name}_bucket{{statement="{__label(kind)}",le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_{name}_sum{{statement="{__label(kind)}"}} {histogram["sum"]}')
+            lines.append(f'{prefix}_{name}_count{{statement="{__label(kind)}"}} {histogram["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+class Metrics:
+    """Collects the measurements of the stages of a run, and latency histograms.
+
+    Disabled, stage() yields a stage whose wrappers return what they are given, and observe() returns
+    at once, so that instrumented code runs as without instrumentation.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.stages: Dict[str, Stage] = {}
+        self.histograms: Dict[str, Dict[str, Histogram]] = {}
+        self.current: Optional[Stage] = None
+        self.lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """Measures a stage; stages of the same name add up."""
+        if not self.enabled:
+            yield DISABLED_STAGE
+            return
+        stage = Stage(name)
+        (previous, self.current) = (self.current, stage)
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.seconds = time.perf_counter() - start
+            # ru_maxrss is in KiB on Linux.
+            stage.peak_rss_bytes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+            self.current = previous
+            self.merge({name: stage.as_dict()})
+
+    def merge(self, stages: Dict[str, dict]):
+        """Adds the stages of a report, e.g. from a worker process."""
+        for (name, values) in stages.items():
+            self.stages.setdefault(name, Stage(name)).add(values)
+
+    def observe(self, histogram: str, kind: str, seconds: float):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.histograms.setdefault(histogram, {}).setdefault(kind, Histogram()).observe(seconds)
+
+    def connection(self, connection, stage: Stage):
+        return TimedConnection(connection, stage) if self.enabled else connection
+
+    def cursor(self, cursor, stage: Stage):
+        return TimedCursor(cursor, stage) if self.enabled else cursor
+
+    def writer(self, writer, stage: Stage):
+        return TimedWriter(writer, stage) if self.enabled else writer
+
+    def output(self, fd: TextIO):
+        return CountedOutput(fd, self) if self.enabled else fd
+
+    def batches(self, execute: Callable[[list], None], stage: Stage) -> Callable[[list], None]:
+        """Wraps an importer callback taking shards of (statement, values) batches.
+
+        The values are counted as rows, and their length as bytes.
+        """
+        if not self.enabled:
+            return execute
+
+        # The callback may run on several importer threads at once.
+        def timed(shard: List[tuple], *args):
+            start = time.perf_counter()
+            execute(shard, *args)
+            seconds = time.perf_counter() - start
+            rows = sum(len(values) for (_, values) in shard)
+            size = sum(len(value) for (_, values) in shard for value in values)
+            with self.lock:
+                stage.write_seconds += seconds
+                stage.rows += rows
+                stage.bytes += size
+        return timed
+
+    def report(self) -> dict:
+        return {
+            'stages': {name: stage.as_dict() for (name, stage) in self.stages.items()},
+            'histograms': {name: {kind: histogram.as_dict() for (kind, histogram) in histograms.items()}
+                           for (name, histograms) in self.histograms.items()},
+        }
+
+    def save(self, path: str):
+        """Writes the report in the Prometheus text format if the path ends with .prom, as JSON otherwise."""
+        report = self.report()
+        with open(path, 'w', encoding='utf-8') as f:
+            if path.endswith('.prom'):
+                f.write(prometheus_text(report))
+            else:
+                json.dump(report, f, indent=2)
+
+
+DISABLED_STAGE = Stage('disabled')
+
+# The metrics of this process; disabled unless a run is asked to report them.
+METRICS = Metrics()
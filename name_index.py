@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# --coding:utf-8--
+
+import os
+import json
+import sqlite3
+import argparse
+import numpy as np
+from collections import defaultdict
+from typing import Iterator, List, Optional, Tuple
+
+from convert_itis_to_jsongraph import DEFAULT_KINGDOM_ID, TAXONOMIC_UNIT_QUERY, VERNACULAR_QUERY
+from csr_graph import StringTable, write_string_table
+from itis_source import open_source, prepare_indexes
+
+MANIFEST = 'names.json'
+
+# Language of the postings of scientific names.
+SCIENTIFIC = -1
+
+# Leading UTF-8 bytes of each name kept in a fixed-width array, which NumPy binary searches; only names
+# sharing these bytes with the one looked up are compared in full.
+PREFIX_BYTES = 16
+
+
+def normalize(name: str) -> str:
+    return ' '.join(name.split()).casefold()
+
+
+def trigrams(key: str) -> List[str]:
+    # Padded like pg_trgm, so that the start and end of a name count as well.
+    padded = f'  {key} '
+    return sorted(set(padded[i:i + 3] for i in range(len(padded) - 2)))
+
+
+def read_names(itis: sqlite3.Connection, kingdom_id: int = DEFAULT_KINGDOM_ID) -> Iterator[Tuple[str, int, Optional[str]]]:
+    """Yields the scientific and vernacular names of a kingdom as (name, tsn, language).
+
+    Reads the same queries as the taxonomic unit and vernacular nodes of the converter; scientific
+    names have no language.
+    """
+    previous_tsn = None
+    for unit in itis.execute(TAXONOMIC_UNIT_QUERY, {'kingdom_id': kingdom_id}):
+        # The joins of the query yield several rows per unit.
+        if unit[0] != previous_tsn:
+            previous_tsn = unit[0]
+            yield unit[1], unit[0], None
+    for (tsn, _, language, _, name) in itis.execute(VERNACULAR_QUERY, {'kingdom_id': kingdom_id}):
+        yield name, tsn, language
+
+
+def __write_prefixes(directory: str, name: str, keys: List[str]):
+    prefixes = np.array([key.encode('utf-8')[:PREFIX_BYTES] for key in keys], dtype=f'S{PREFIX_BYTES}')
+    np.save(os.path.join(directory, f'{name}.prefixes.npy'), prefixes)
+
+
+def build_name_index(names: Iterator[Tuple[str, int, Optional[str]]], directory: str):
+    """Writes a name index into a directory of arrays that NameIndex memory-maps.
+
+    The normalized names are stored sorted, so exact and prefix lookups are binary searches. Each
+    name has postings of the TSN, language and original spelling of every unit it names, and each
+    trigram of the names lists the names containing it.
+    """
+    languages = {}
+    labels = {}
+    postings = defaultdict(set)
+    for (name, tsn, language) in names:
+        if not name:
+            continue
+        language_id = SCIENTIFIC if language is None else languages.setdefault(language, len(languages))
+        postings[normalize(name)].add((tsn, language_id, labels.setdefault(name, len(labels))))
+
+    os.makedirs(directory, exist_ok=True)
+    # Sorting by the UTF-8 bytes keeps the order of the bytes compared by the binary search.
+    keys = sorted(postings, key=lambda key: key.encode('utf-8'))
+    write_string_table(directory, 'keys', keys)
+    __write_prefixes(directory, 'keys', keys)
+    write_string_table(directory, 'labels', list(labels))
+
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    entries = []
+    key_trigrams = defaultdict(list)
+    trigram_counts = np.zeros(len(keys), dtype=np.int32)
+    for (i, key) in enumerate(keys):
+        entries.extend(sorted(postings[key]))
+        offsets[i + 1] = len(entries)
+        grams = trigrams(key)
+        trigram_counts[i] = len(grams)
+        for gram in grams:
+            key_trigrams[gram].append(i)
+    entries = np.array(entries, dtype=np.int64).reshape(-1, 3)
+    np.save(os.path.join(directory, 'postings.offsets.npy'), offsets)
+    np.save(os.path.join(directory, 'postings.tsn.npy'), entries[:, 0])
+    np.save(os.path.join(directory, 'postings.language.npy'), entries[:, 1].astype(np.int16))
+    np.save(os.path.join(directory, 'postings.label.npy'), entries[:, 2].astype(np.int32))
+
+    grams = sorted(key_trigrams, key=lambda gram: gram.encode('utf-8'))
+    write_string_table(directory, 'trigrams', grams)
+    __write_prefixes(directory, 'trigrams', grams)
+    gram_offsets = np.zeros(len(grams) + 1, dtype=np.int64)
+    np.cumsum([len(key_trigrams[gram]) for gram in grams], out=gram_offsets[1:])
+    np.save(os.path.join(directory, 'trigrams.postings.offsets.npy'), gram_offsets)
+    np.save(os.path.join(directory, 'trigrams.postings.npy'),
+            np.array([i for gram in grams for i in key_trigrams[gram]], dtype=np.int32))
+    np.save(os.path.join(directory, 'trigrams.counts.npy'), trigram_counts)
+
+    with open(os.path.join(directory, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump({'names': len(keys), 'postings': len(entries), 'languages': list(languages)}, f, indent=2)
+
+
+class NameIndex:
+    """Looks up names in an index written by build_name_index.
+
+    All arrays are memory-mapped, so opening the index reads only its manifest. A lookup binary searches
+    the fixed-width prefixes of the names with NumPy, and only compares the names sharing the prefix of
+    the one looked up in full.
+    """
+
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, MANIFEST), 'r', encoding='utf-8') as f:
+            self.languages = json.load(f)['languages']
+        self.keys = StringTable(directory, 'keys')
+        self.labels = StringTable(directory, 'labels')
+        self.trigrams = StringTable(directory, 'trigrams')
+        (self.key_prefixes, self.trigram_prefixes, self.offsets, self.tsns, self.language_ids, self.label_ids,
+         self.trigram_offsets, self.trigram_postings, self.trigram_counts) = [
+            np.load(os.path.join(directory, name), mmap_mode='r') for name in (
+                'keys.prefixes.npy', 'trigrams.prefixes.npy', 'postings.offsets.npy', 'postings.tsn.npy',
+                'postings.language.npy', 'postings.label.npy', 'trigrams.postings.offsets.npy',
+                'trigrams.postings.npy', 'trigrams.counts.npy')]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @staticmethod
+    def __lower_bound(table: StringTable, prefixes: np.ndarray, key: bytes) -> int:
+        # A key no longer than the prefixes compares with each name as with its prefix; NUL bytes,
+        # which pad the prefixes, occur in no name.
+        prefix = key[:PREFIX_BYTES]
+        low = int(np.searchsorted(prefixes, prefix, side='left'))
+        if len(key) <= PREFIX_BYTES:
+            return low
+        high = int(np.searchsorted(prefixes, prefix, side='right'))
+        while low < high:
+            middle = (low + high) // 2
+            if table.bytes(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def __find(self, table: StringTable, prefixes: np.ndarray, key: str) -> Optional[int]:
+        encoded = key.encode('utf-8')
+        position = self.__lower_bound(table, prefixes, encoded)
+        if position < len(table) and table.bytes(position) == encoded:
+            return position
+        return None
+
+    def postings(self, position: int) -> List[Tuple[str, int, Optional[str]]]:
+        """The (name, tsn, language) of each unit named by the name at a position of the index."""
+        return [(self.labels[int(self.label_ids[i])], int(self.tsns[i]),
+                 None if self.language_ids[i] == SCIENTIFIC else self.languages[self.language_ids[i]])
+                for i in range(int(self.offsets[position]), int(self.offsets[position + 1]))]
+
+    def lookup(self, name: str) -> List[Tuple[str, int, Optional[str]]]:
+        """The units with a name equal to the given one, ignoring case and repeated whitespace."""
+        position = self.__find(self.keys, self.key_prefixes, normalize(name))
+        return [] if position is None else self.postings(position)
+
+    def complete(self, prefix: str, limit: int = 10) -> List[str]:
+        """Up to limit names starting with a prefix, in the order of their normalized form."""
+        encoded = normalize(prefix).encode('utf-8')
+        first = self.__lower_bound(self.keys, self.key_prefixes, encoded)
+        # No UTF-8 sequence contains 0xff, so this is above every name starting with the prefix.
+        last = min(first + limit, self.__lower_bound(self.keys, self.key_prefixes, encoded + b'\xff'))
+        return [self.labels[int(self.label_ids[self.offsets[i]])] for i in range(first, last)]
+
+    def fuzzy(self, name: str, limit: int = 10, threshold: float = 0.3) -> List[Tuple[str, float]]:
+        """Names similar to the given one by the share of their trigrams, best first."""
+        grams = trigrams(normalize(name))
+        candidates = []
+        for gram in grams:
+            position = self.__find(self.trigrams, self.trigram_prefixes, gram)
+            if position is not None:
+                candidates.append(self.trigram_postings[self.trigram_offsets[position]:self.trigram_offsets[position + 1]])
+        if not candidates:
+            return []
+        (keys, shared) = np.unique(np.concatenate(candidates), return_counts=True)
+        scores = shared / (len(grams) + self.trigram_counts[keys] - shared)
+        best = np.argsort(-scores, kind='stable')[:limit]
+        return [(self.labels[int(self.label_ids[self.offsets[keys[i]]])], float(scores[i]))
+                for i in best if scores[i] >= threshold]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Builds the index of the scientific and vernacular names of ITIS.')
+    parser.add_argument('input', help='the ITIS SQLite dump')
+    parser.add_argument('output', help='the directory to write the index into')
+    parser.add_argument('--kingdom', type=int, default=DEFAULT_KINGDOM_ID, help='the ITIS kingdom id')
+    args = parser.parse_args()
+
+    itis = open_source(args.input)
+    prepare_indexes(itis)
+    build_name_index(read_names(itis, args.kingdom), args.output)
+    itis.close()
+    index = NameIndex(args.output)
+    print(f'{len(index)} names in {len(index.languages)} languages')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# --coding:utf-8--
+
+import os
+import json
+import array
+import numpy as np
+from typing import BinaryIO, List, Optional
+
+from compression import open_input
+from csr_graph import StringTable, write_string_table
+from jsongraph import copy_graph
+
+MANIFEST = 'ndjson.json'
+
+DEFAULT_SHARD_BYTES = 64 << 20
+
+SECTIONS = ['nodes', 'edges']
+
+
+class NdjsonSectionWriter:
+    """Writes the nodes or the edges of a graph as lines of JSON into shards of about shard_bytes each."""
+
+    def __init__(self, graph: 'NdjsonGraphWriter', section: str):
+        self.graph = graph
+        self.section = section
+
+    def write(self, *args):
+        if self.section == 'nodes':
+            (key, node) = args
+            self.graph.add(self.section, {'key': key, **node}, key)
+        else:
+            self.graph.add(self.section, args[0])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, evalue, traceback):
+        pass
+
+
+class NdjsonGraphWriter:
+    """Writes a graph into shards of newline-delimited JSON, with an index of the node keys.
+
+    Every node is a line with its key and its members, and every edge a line of its own, in the order
+    they are written. The keys are stored sorted by their UTF-8 bytes along with the shard and the
+    byte offset of their line, so a node is found with a binary search, a seek and one line to parse.
+    """
+
+    def __init__(self, directory: str, shard_bytes: int = DEFAULT_SHARD_BYTES):
+        assert shard_bytes > 0, shard_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.shard_bytes = shard_bytes
+        self.encode = json.JSONEncoder(separators=(',', ':')).encode
+        self.attributes = {}
+        self.shards = {section: [] for section in SECTIONS}
+        self.files = {}
+        self.keys = []
+        self.key_shards = array.array('i')
+        self.key_offsets = array.array('q')
+
+    def write(self, key: str, value):
+        self.attributes[key] = value
+
+    def __file(self, section: str) -> BinaryIO:
+        shards = self.shards[section]
+        f = self.files.get(section)
+        if f is None or shards[-1]['bytes'] >= self.shard_bytes:
+            if f is not None:
+                f.close()
+            path = f'{section}.{len(shards):05d}.ndjson'
+            shards.append({'path': path, 'count': 0, 'bytes': 0})
+            f = self.files[section] = open(os.path.join(self.directory, path), 'wb')
+        return f
+
+    def add(self, section: str, value: dict, key: Optional[str] = None):
+        f = self.__file(section)
+        shard = self.shards[section][-1]
+        if key is not None:
+            self.keys.append(key)
+            self.key_shards.append(len(self.shards[section]) - 1)
+            self.key_offsets.append(shard['bytes'])
+        line = (self.encode(value) + '\n').encode('utf-8')
+        f.write(line)
+        shard['count'] += 1
+        shard['bytes'] += len(line)
+
+    def subobject(self, key: str) -> NdjsonSectionWriter:
+        assert key == 'nodes', key
+        return NdjsonSectionWriter(self, key)
+
+    def subarray(self, key: str) -> NdjsonSectionWriter:
+        assert key == 'edges', key
+        return NdjsonSectionWriter(self, key)
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        # The first of several nodes with the same key is the one found by lookups.
+        order = sorted(range(len(self.keys)), key=lambda i: self.keys[i].encode('utf-8'))
+        write_string_table(self.directory, 'keys', [self.keys[i] for i in order])
+        order = np.array(order, dtype=np.int64)
+        np.save(os.path.join(self.directory, 'keys.shard.npy'),
+                np.frombuffer(self.key_shards, dtype=np.int32)[order])
+        np.save(os.path.join(self.directory, 'keys.byte_offset.npy'),
+                np.frombuffer(self.key_offsets, dtype=np.int64)[order])
+        with open(os.path.join(self.directory, MANIFEST), 'w', encoding='utf-8') as f:
+            json.dump({'attributes': self.attributes, **self.shards}, f, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, evalue, traceback):
+        if etype is None:
+            self.close()
+
+
+def export_ndjson(json_path: str, directory: str, shard_bytes: int = DEFAULT_SHARD_BYTES):
+    """Exports a JSON Graph document, which may be compressed, into NDJSON shards."""
+    with open_input(json_path) as f, NdjsonGraphWriter(directory, shard_bytes) as ndjson:
+        copy_graph(f, ndjson)
+
+
+class NdjsonGraph:
+    """Reads the shards and the key index written by NdjsonGraphWriter."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        self.attributes = manifest['attributes']
+        self.shards = {section: manifest[section] for section in SECTIONS}
+        self.keys = StringTable(directory, 'keys')
+        self.key_shards = np.load(os.path.join(directory, 'keys.shard.npy'), mmap_mode='r')
+        self.key_offsets = np.load(os.path.join(directory, 'keys.byte_offset.npy'), mmap_mode='r')
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def shard_paths(self, section: str) -> List[str]:
+        """The shard files of the nodes or the edges, to be read in parallel."""
+        return [os.path.join(self.directory, shard['path']) for shard in self.shards[section]]
+
+    def node(self, key: str) -> Optional[dict]:
+        """The node with a key, including the key, or None if there is no such node."""
+        encoded = key.encode('utf-8')
+        (low, high) = (0, len(self.keys))
+        while low < high:
+            middle = (low + high) // 2
+            if self.keys.bytes(middle) < encoded:
+                low = middle + 1
+            else:
+                high = middle
+        if low == len(self.keys) or self.keys.bytes(low) != encoded:
+            return None
+        with open(self.shard_paths('nodes')[int(self.key_shards[low])], 'rb') as f:
+            f.seek(int(self.key_offsets[low]))
+            return json.loads(f.readline())
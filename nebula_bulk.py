@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# --coding:utf-8--
+
+import os
+import csv
+import json
+import sqlite3
+from typing import Dict, List, Optional, Sequence, Tuple
+from tqdm import tqdm
+
+from row_source import iso_timestamps, record_batches
+
+DEFAULT_CHUNK_ROWS = 1000000
+
+# The configuration is written as JSON, which nebula-importer reads as YAML.
+CONFIG = 'importer.yaml'
+
+# How long nebula-importer waits after creating the space and its schema before loading the files. The schema
+# only becomes usable after the next heartbeat of the storage hosts, every 10 seconds by default.
+DEFAULT_AFTER_PERIOD = '12s'
+
+# Properties of the tags of the space, in the order of their columns after the vertex id.
+TAGS = {
+    'rank': [('itis_rank_id', 'int'), ('name', 'string'), ('updated', 'date')],
+    'taxonomic_unit': [
+        ('tsn', 'int'), ('name', 'string'), ('accepted', 'bool'), ('created', 'timestamp'), ('updated', 'date'),
+        ('unit_ind1', 'string'), ('unit_name1', 'string'), ('unit_ind2', 'string'), ('unit_name2', 'string'),
+        ('unit_ind3', 'string'), ('unit_name3', 'string'), ('unit_ind4', 'string'), ('unit_name4', 'string'),
+    ],
+}
+
+# Edge types of the space; none has properties, so their files hold the source and destination ids.
+EDGES = ['direct_parent_of', 'required_parent_of', 'has_rank', 'parent_of']
+
+
+class ChunkedCsvWriter:
+    """Writes the rows of one tag or edge type into CSV files of at most chunk_rows rows each."""
+
+    def __init__(self, directory: str, name: str, chunk_rows: int = DEFAULT_CHUNK_ROWS):
+        assert chunk_rows > 0, chunk_rows
+        self.directory = directory
+        self.name = name
+        self.chunk_rows = chunk_rows
+        self.paths: List[str] = []
+        self.file = None
+        self.writer = None
+        self.rows = 0
+
+    def write(self, row: Sequence):
+        if self.rows % self.chunk_rows == 0:
+            self.__next_chunk()
+        self.writer.writerow(row)
+        self.rows += 1
+
+    def __next_chunk(self):
+        self.close()
+        path = f'{self.name}.{len(self.paths):05d}.csv'
+        self.paths.append(path)
+        self.file = open(os.path.join(self.directory, path), 'w', encoding='utf-8', newline='')
+        self.writer = csv.writer(self.file)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, evalue, traceback):
+        self.close()
+
+
+def __null(value) -> str:
+    # Empty fields are read as null by importers that support nullValue, and as empty strings by older ones.
+    return '' if value is None else value
+
+
+def write_rank_files(itis: sqlite3.Connection, writers: Dict[str, ChunkedCsvWriter], kingdom_id: int):
+    taxon_unit_types = itis.execute('''
+                SELECT rank_id, rank_name, dir_parent_rank_id, req_parent_rank_id, update_date
+                FROM taxon_unit_types
+                WHERE kingdom_id = ? ORDER BY rank_id
+                ''', (kingdom_id,))
+    for (rank_id, rank_name, dir_parent_rank_id, req_parent_rank_id, update_date) in taxon_unit_types:
+        writers['rank'].write([f'rank-{rank_id}', rank_id, rank_name, update_date])
+        # Skip the Kingdom link on itself
+        if rank_id == dir_parent_rank_id or rank_id == req_parent_rank_id:
+            continue
+        writers['direct_parent_of'].write([f'rank-{dir_parent_rank_id}', f'rank-{rank_id}'])
+        writers['required_parent_of'].write([f'rank-{req_parent_rank_id}', f'rank-{rank_id}'])
+
+
+def write_taxonomic_unit_files(itis: sqlite3.Connection, writers: Dict[str, ChunkedCsvWriter], kingdom_id: int):
+    count = itis.execute('SELECT COUNT(*) FROM taxonomic_units WHERE kingdom_id = ?', (kingdom_id,)).fetchone()[0]
+    units = itis.execute('''
+                    SELECT tsn, rank_id, parent_tsn,
+                           complete_name, name_usage,
+                           unit_ind1, unit_name1,
+                           unit_ind2, unit_name2,
+                           unit_ind3, unit_name3,
+                           unit_ind4, unit_name4,
+                           initial_time_stamp, update_date
+                    FROM taxonomic_units
+                    WHERE kingdom_id = ?
+                    ORDER BY tsn''', (kingdom_id,))
+    with tqdm(desc='Units', total=count) as progress:
+        for batch in record_batches(units, {'initial_time_stamp': iso_timestamps}):
+            for unit in batch.rows():
+                (tsn, rank_id, parent_tsn, complete_name, name_usage) = unit[:5]
+                (initial_time_stamp, update_date) = unit[13:]
+                writers['taxonomic_unit'].write([
+                    f'tsn-{tsn}', tsn, __null(complete_name), 'true' if name_usage == 'accepted' else 'false',
+                    initial_time_stamp, update_date, *[__null(value) for value in unit[5:13]]])
+                writers['has_rank'].write([f'tsn-{tsn}', f'rank-{rank_id}'])
+                if parent_tsn is not None and parent_tsn > 0:
+                    writers['parent_of'].write([f'tsn-{parent_tsn}', f'tsn-{tsn}'])
+            progress.update(len(batch))
+
+
+def __file_entry(path: str, batch_size: int, schema: dict) -> dict:
+    return {
+        'path': f'./{path}',
+        'failDataPath': f'./err/{path}',
+        'batchSize': batch_size,
+        'inOrder': False,
+        'type': 'csv',
+        'csv': {'withHeader': False, 'withLabel': False, 'delimiter': ','},
+        'schema': schema,
+    }
+
+
+def importer_config(files: Dict[str, List[str]], schema_statements: List[str], space: str = 'itis',
+                    address: Tuple[str, int] = ('127.0.0.1', 3699), user: str = 'user', password: str = 'password',
+                    batch_size: int = 256, concurrency: int = 1, after_period: str = DEFAULT_AFTER_PERIOD) -> dict:
+    """The configuration of nebula-importer that creates the space and loads the CSV files into it.
+
+    Vertex files are listed before edge files; paths are relative to the configuration file. The files are
+    loaded after_period, a duration such as '12s', after creating the schema.
+    """
+    entries = []
+    for (tag, props) in TAGS.items():
+        schema = {'type': 'vertex', 'vertex': {
+            'vid': {'index': 0, 'type': 'string'},
+            'tags': [{'name': tag, 'props': [
+                {'name': name, 'type': prop_type, 'index': i + 1,
+                 **({'nullable': True, 'nullValue': ''} if prop_type == 'string' else {})}
+                for (i, (name, prop_type)) in enumerate(props)]}],
+        }}
+        entries.extend(__file_entry(path, batch_size, schema) for path in files[tag])
+    for edge in EDGES:
+        schema = {'type': 'edge', 'edge': {
+            'name': edge,
+            'withRanking': False,
+            'srcVID': {'index': 0, 'type': 'string'},
+            'dstVID': {'index': 1, 'type': 'string'},
+            'props': [],
+        }}
+        entries.extend(__file_entry(path, batch_size, schema) for path in files[edge])
+
+    return {
+        'version': 'v2',
+        'description': 'ITIS bulk load',
+        'removeTempFiles': False,
+        'clientSettings': {
+            'retry': 3,
+            'concurrency': concurrency,
+            'channelBufferSize': 128,
+            'space': space,
+            'connection': {'user': user, 'password': password, 'address': f'{address[0]}:{address[1]}'},
+            'postStart': {
+                'commands': '\n'.join(schema_statements),
+                'afterPeriod': after_period,
+            },
+        },
+        'logPath': './err/importer.log',
+        'files': entries,
+    }
+
+
+def export_bulk_load(itis: sqlite3.Connection, directory: str, schema_statements: List[str], kingdom_id: int,
+                     chunk_rows: int = DEFAULT_CHUNK_ROWS, address: Optional[Tuple[str, int]] = None,
+                     batch_size: int = 256, concurrency: int = 1, after_period: str = DEFAULT_AFTER_PERIOD) -> str:
+    """Writes the vertices and edges of a kingdom into chunked CSV files and the nebula-importer configuration.
+
+    The rows are streamed from SQLite into the files, so memory use does not grow with the dump.
+    Returns the path of the configuration.
+    """
+    os.makedirs(os.path.join(directory, 'err'), exist_ok=True)
+    writers = {name: ChunkedCsvWriter(directory, name, chunk_rows) for name in [*TAGS, *EDGES]}
+    try:
+        write_rank_files(itis, writers, kingdom_id)
+        write_taxonomic_unit_files(itis, writers, kingdom_id)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    config = importer_config({name: writer.paths for (name, writer) in writers.items()}, schema_statements,
+                             address=address or ('127.0.0.1', 3699), batch_size=batch_size, concurrency=concurrency,
+                             after_period=after_period)
+    config_path = os.path.join(directory, CONFIG)
+    with open(config_path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2)
+    return config_path
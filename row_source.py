@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# --coding:utf-8--
+
+import re
+import numpy as np
+from typing import Callable, Dict, Iterator, List, Optional, Sequence
+from dateutil.parser import parse as parse_time
+
+FETCH_ROWS = 4096
+
+# Timestamps in the format of ITIS, each followed by a newline; year 0 is not a valid datetime.
+TIMESTAMP_BLOCK = re.compile(r'(?:(?!0000)\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\n)*')
+
+
+def iso_timestamps(values: Sequence[Optional[str]]) -> List[Optional[str]]:
+    """The ISO 8601 form of each timestamp, as written by parse_time(value).isoformat().
+
+    A block of timestamps in the 'YYYY-MM-DD HH:MM:SS' format of ITIS is matched and converted as one
+    string, and checked for impossible dates by NumPy. Other blocks are parsed value by value.
+    """
+    if None not in values:
+        text = '\n'.join(values) + '\n'
+        if TIMESTAMP_BLOCK.fullmatch(text):
+            iso = text.replace(' ', 'T').split('\n')[:-1]
+            try:
+                np.array(iso, dtype='datetime64[s]')
+                return iso
+            except ValueError:
+                pass
+    return [None if value is None else parse_time(value).isoformat() for value in values]
+
+
+class RecordBatch:
+    """A block of rows of a query, held as columns named as in the query."""
+
+    def __init__(self, names: List[str], columns: List[Sequence]):
+        self.names = names
+        self.columns = columns
+        self.positions = {name: i for (i, name) in enumerate(names)}
+
+    def __len__(self) -> int:
+        return len(self.columns[0]) if self.columns else 0
+
+    def __getitem__(self, name: str) -> Sequence:
+        return self.columns[self.positions[name]]
+
+    def rows(self) -> Iterator[tuple]:
+        return zip(*self.columns)
+
+
+def record_batches(cursor, converters: Optional[Dict[str, Callable[[Sequence], Sequence]]] = None,
+                   rows: int = FETCH_ROWS) -> Iterator[RecordBatch]:
+    """Reads a cursor in blocks of rows, and converts the columns named in converters a block at a time.
+
+    The columns of the query need distinct names, e.g. given with AS.
+    """
+    names = [column[0] for column in cursor.description]
+    assert len(set(names)) == len(names), names
+    positions = [(names.index(name), convert) for (name, convert) in (converters or {}).items()]
+    while True:
+        block = cursor.fetchmany(rows)
+        if not block:
+            return
+        columns = list(zip(*block))
+        for (i, convert) in positions:
+            columns[i] = convert(columns[i])
+        yield RecordBatch(names, columns)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# --coding:utf-8--
+
+import os
+import ast
+import json
+import hashlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+# The converter; it and the modules of this directory it imports, directly or not, shape the converted
+# document, so a change to any of them invalidates the cache.
+CONVERTER_MODULE = 'convert_itis_to_jsongraph'
+
+SOURCES = 'sources.json'
+
+# Taxonomic units per TSN range of the cached scans. The ranges only depend on the dump, so runs with
+# any number of worker processes share the fragments.
+RANGE_UNITS = 8192
+
+# Hex digits of the converter version in the file names of the fragments.
+VERSION_DIGITS = 16
+
+SECTIONS = ('nodes', 'edges')
+
+
+def converter_modules(directory: str, module: str = CONVERTER_MODULE) -> List[str]:
+    """The names of a module and of the modules of its directory it imports, directly or not, sorted."""
+    modules = set()
+    pending = [module]
+    while pending:
+        name = pending.pop()
+        path = os.path.join(directory, f'{name}.py')
+        if name in modules or not os.path.exists(path):
+            continue
+        modules.add(name)
+        with open(path, 'rb') as f:
+            tree = ast.parse(f.read(), path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                pending.extend(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                pending.append(node.module)
+    return sorted(modules)
+
+
+def converter_version() -> str:
+    """A digest of the sources of the converter modules."""
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for module in converter_modules(directory):
+        with open(os.path.join(directory, f'{module}.py'), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class SectionCache:
+    """A directory of rendered JSON and DOT fragments, addressed by what they were rendered from.
+
+    The key of a fragment covers the MD5 of the source dump, the version of the converter, the
+    options of the rendering, the scan and its TSN range, so a fragment found under its key can be
+    spliced instead of rendering it again. Keys start with the MD5 and the version, so prune can
+    tell the fragments no run will find again.
+    """
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.version = converter_version()
+
+    def key(self, itis_md5: str, scan: str, tsn_range: Optional[Tuple[int, int]], options: dict) -> str:
+        digest = hashlib.sha256(json.dumps({
+            'md5': itis_md5,
+            'version': self.version,
+            'scan': scan,
+            'tsn_range': tsn_range,
+            'options': options,
+        }, sort_keys=True).encode('utf-8')).hexdigest()
+        return f'{itis_md5}-{self.version[:VERSION_DIGITS]}-{digest}'
+
+    def paths(self, key: str) -> Dict[str, Tuple[str, str]]:
+        """The JSON and DOT fragment files of a key by section, laid out like those of render_fragment."""
+        return {section: (os.path.join(self.directory, f'{key}.{section}.json'),
+                          os.path.join(self.directory, f'{key}.{section}.dot'))
+                for section in SECTIONS}
+
+    def contains(self, key: str) -> bool:
+        return all(os.path.exists(path) for paths in self.paths(key).values() for path in paths)
+
+    def source_md5(self, path: str, compute: Callable[[str], str]) -> str:
+        """Returns the MD5 of a file, computing it only if its size or modification time changed since last time."""
+        stat = os.stat(path)
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        sources = self.__sources()
+        name = os.path.abspath(path)
+        if name in sources and sources[name]['stamp'] == stamp:
+            return sources[name]['md5']
+
+        md5 = compute(path)
+        sources[name] = {'stamp': stamp, 'md5': md5}
+        sources_path = os.path.join(self.directory, SOURCES)
+        with open(sources_path + '.partial', 'w', encoding='utf-8') as f:
+            json.dump(sources, f, indent=2)
+        os.replace(sources_path + '.partial', sources_path)
+        return md5
+
+    def prune(self) -> int:
+        """Removes the fragments of another converter version, or of a dump that is no longer the last one
+        hashed at its path. Returns the number of files removed."""
+        current = {source['md5'] for source in self.__sources().values()}
+        removed = 0
+        for name in os.listdir(self.directory):
+            if name == SOURCES:
+                continue
+            parts = name.split('-')
+            if len(parts) == 3 and parts[0] in current and parts[1] == self.version[:VERSION_DIGITS]:
+                continue
+            os.remove(os.path.join(self.directory, name))
+            removed += 1
+        return removed
+
+    def __sources(self) -> Dict[str, dict]:
+        sources_path = os.path.join(self.directory, SOURCES)
+        if not os.path.exists(sources_path):
+            return {}
+        with open(sources_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# --coding:utf-8--
+
+import sqlite3
+import argparse
+import numpy as np
+from typing import Optional, Tuple
+
+from itis_source import DEFAULT_KINGDOM_ID, connect_read_only
+
+# Accepted TSN of the units whose synonym links form a cycle.
+UNRESOLVED = -1
+
+
+def read_synonym_links(itis: sqlite3.Connection, kingdom_id: int = DEFAULT_KINGDOM_ID) -> Tuple[np.ndarray, dict]:
+    """Returns the sorted TSNs of a kingdom and the TSN each synonym among them links to.
+
+    A synonym linked to several accepted units is resolved through the lowest of their TSNs.
+    """
+    # main. is explicit as the converter shadows taxonomic_units with a view of a TSN range in workers.
+    tsns = np.array([tsn for (tsn,) in itis.execute(
+        'SELECT tsn FROM main.taxonomic_units WHERE kingdom_id = ? ORDER BY tsn', (kingdom_id,))], dtype=np.int64)
+    links = dict(itis.execute('''
+        SELECT sl.tsn, MIN(sl.tsn_accepted)
+        FROM synonym_links AS sl
+        JOIN main.taxonomic_units AS tu ON tu.tsn = sl.tsn
+        WHERE tu.kingdom_id = ? AND sl.tsn_accepted IS NOT NULL AND sl.tsn_accepted != 0
+        GROUP BY sl.tsn
+        ''', (kingdom_id,)))
+    return tsns, links
+
+
+class SynonymTable:
+    """The accepted TSN of every taxonomic unit of a kingdom and the number of synonym links leading to it.
+
+    Accepted units resolve to themselves in 0 hops. Links are followed until a unit that is not a synonym;
+    units on or leading into a cycle of links resolve to UNRESOLVED with -1 hops.
+    """
+
+    def __init__(self, tsns: np.ndarray, accepted: np.ndarray, hops: np.ndarray):
+        self.tsns = tsns
+        self.accepted = accepted
+        self.hops = hops
+
+    @classmethod
+    def build(cls, tsns: np.ndarray, links: dict) -> 'SynonymTable':
+        # Chains are walked once: every unit on a chain is resolved when its end is reached,
+        # so later walks stop at the first unit resolved before.
+        resolved = {}
+        for start in links:
+            if start in resolved:
+                continue
+            chain = []
+            on_chain = set()
+            tsn = start
+            while tsn in links and tsn not in resolved and tsn not in on_chain:
+                chain.append(tsn)
+                on_chain.add(tsn)
+                tsn = links[tsn]
+            if tsn in on_chain:
+                (accepted, hops) = (UNRESOLVED, -1)
+            elif tsn in resolved:
+                (accepted, hops) = resolved[tsn]
+            else:
+                (accepted, hops) = (tsn, 0)
+            for unit in reversed(chain):
+                if hops >= 0:
+                    hops += 1
+                resolved[unit] = (accepted, hops)
+
+        accepted = tsns.copy()
+        hops = np.zeros(len(tsns), dtype=np.int32)
+        for (i, tsn) in enumerate(tsns.tolist()):
+            if tsn in resolved:
+                (accepted[i], hops[i]) = resolved[tsn]
+        return cls(tsns, accepted, hops)
+
+    def save(self, path: str):
+        np.savez(path, tsns=self.tsns, accepted=self.accepted, hops=self.hops)
+
+    @classmethod
+    def load(cls, path: str) -> 'SynonymTable':
+        with np.load(path) as arrays:
+            return cls(arrays['tsns'], arrays['accepted'], arrays['hops'])
+
+    def __len__(self) -> int:
+        return len(self.tsns)
+
+    def resolve(self, tsn: int) -> Tuple[Optional[int], int]:
+        """Returns the accepted TSN of a unit, or None if its links form a cycle, and the number of hops to it."""
+        position = int(np.searchsorted(self.tsns, tsn))
+        if position == len(self.tsns) or self.tsns[position] != tsn:
+            raise KeyError(tsn)
+        accepted = int(self.accepted[position])
+        return (None if accepted == UNRESOLVED else accepted), int(self.hops[position])
+
+    def as_dict(self) -> dict:
+        """The accepted TSN of each synonym, for lookups without a binary search."""
+        synonyms = self.hops != 0
+        return dict(zip(self.tsns[synonyms].tolist(), self.accepted[synonyms].tolist()))
+
+
+def build_synonym_table(itis: sqlite3.Connection, kingdom_id: int = DEFAULT_KINGDOM_ID) -> SynonymTable:
+    return SynonymTable.build(*read_synonym_links(itis, kingdom_id))
+
+
+class AcceptedNodeWriter:
+    """Adds the accepted TSN to the metadata of the taxonomic unit nodes written into it."""
+
+    def __init__(self, nodes, synonyms: SynonymTable):
+        self.nodes = nodes
+        self.synonyms = synonyms
+
+    def write(self, key: str, node: dict):
+        metadata = node.get('metadata', {})
+        if metadata.get('type') == 'taxonomic-unit':
+            metadata['accepted_tsn'] = self.synonyms.resolve(metadata['tsn'])[0]
+        self.nodes.write(key, node)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Resolves every ITIS taxonomic unit to its accepted unit.')
+    parser.add_argument('input', help='the ITIS SQLite dump')
+    parser.add_argument('output', help='the .npz file to write')
+    parser.add_argument('--kingdom', type=int, default=DEFAULT_KINGDOM_ID, help='the ITIS kingdom id')
+    args = parser.parse_args()
+
+    itis = connect_read_only(args.input)
+    synonyms = build_synonym_table(itis, args.kingdom)
+    itis.close()
+    synonyms.save(args.output)
+    print(f'{len(synonyms)} taxonomic units, {int((synonyms.hops > 0).sum())} synonyms, '
+          f'{int((synonyms.hops < 0).sum())} in cycles, at most {int(synonyms.hops.max(initial=0))} hops')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+# --coding:utf-8--
+
+import os
+import sys
+import pytest
+
+# The scripts of the repository are top-level modules.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generate_itis import generate_itis
+
+
+@pytest.fixture(scope='session')
+def itis_path(tmp_path_factory) -> str:
+    """A synthetic dump with about 2000 taxonomic units in each of Plantae and Animalia."""
+    path = str(tmp_path_factory.mktemp('itis') / 'ITIS.sqlite')
+    generate_itis(path, scale=0.2, kingdom_ids=(3, 5), seed=7)
+    return path
@@ -0,0 +1,55 @@
+# --coding:utf-8--
+
+import datetime
+import pytest
+
+pytest.importorskip('pyarrow')
+import pyarrow.parquet as pq
+from columnar_export import export_columnar, parse_date, parse_timestamp, rank_group
+from convert_itis_to_jsongraph import scan_taxonomic_units
+from itis_source import open_source, prepare_indexes
+from jsongraph import Discard, EdgeCollector
+
+
+def test_rank_groups_of_the_notebook():
+    assert rank_group(10) == ('Kingdom', 10) and rank_group(26) == ('Kingdom', 10)
+    assert rank_group(220) == ('Species', 220) and rank_group(230) == ('Species', 220)
+    assert rank_group(5) == rank_group(271) == rank_group(None) == (None, None)
+
+
+def test_partial_dates_are_completed_with_the_first_month_or_day():
+    assert parse_timestamp('1996-06-13 14:51:08') == datetime.datetime(1996, 6, 13, 14, 51, 8)
+    assert parse_date('1996') == datetime.date(1996, 1, 1)
+    assert parse_date(None) is None
+
+
+def test_tables_hold_the_rows_of_the_kingdoms(itis_path, tmp_path):
+    itis = open_source(itis_path)
+    prepare_indexes(itis)
+    counts = export_columnar(itis, str(tmp_path), [3, 5], row_group_rows=500)
+    units = {kingdom_id: count for (kingdom_id, count) in
+             itis.execute('SELECT kingdom_id, COUNT(*) FROM taxonomic_units GROUP BY kingdom_id')}
+    for (name, count) in counts.items():
+        assert pq.read_metadata(str(tmp_path / f'{name}.parquet')).num_rows == count
+
+    table = pq.read_table(str(tmp_path / 'taxonomic_units.parquet'))
+    assert counts['taxonomic_units'] == units[3] + units[5]
+    # Row groups hold a kingdom each, in the order of their ranks.
+    metadata = pq.ParquetFile(str(tmp_path / 'taxonomic_units.parquet')).metadata
+    assert metadata.num_row_groups > 2
+    assert table.column('kingdom_id').to_pylist() == [3] * units[3] + [5] * units[5]
+    ranks = table.column('rank_id').to_pylist()
+    assert ranks[:units[3]] == sorted(ranks[:units[3]])
+    filtered = pq.read_table(str(tmp_path / 'taxonomic_units.parquet'), filters=[('kingdom_id', '=', 5)])
+    assert filtered.num_rows == units[5]
+
+    # The edges are those of the JSON Graph of the kingdom.
+    edges = pq.read_table(str(tmp_path / 'taxonomic_unit_edges.parquet'),
+                          filters=[('kingdom_id', '=', 3)]).to_pylist()
+    converted = EdgeCollector()
+    scan_taxonomic_units(itis, Discard(), converted, 3)
+    itis.close()
+    assert [(edge['source'], edge['target'], edge['relation'], edge['author_type']) for edge in edges] == \
+        [(edge['source'], edge['target'], edge['relation'], edge.get('metadata', {}).get('author_type'))
+         for edge in converted]
+    assert {edge['relation'] for edge in edges} >= {'parent_of', 'has_rank'}
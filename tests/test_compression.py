@@ -0,0 +1,50 @@
+# --coding:utf-8--
+
+import os
+import gzip
+import pytest
+
+from compression import BackgroundWriter, compressed_path, compression_of, open_input, open_output
+
+TEXT = ''.join(f'{{"tu-{i}": {{"label": "Äbies {i}"}}}},\n' for i in range(50000))
+
+
+@pytest.mark.parametrize('compression', ['none', 'gzip', 'zstd'])
+@pytest.mark.parametrize('background', [True, False])
+def test_outputs_are_read_back_whatever_their_extension(tmp_path, compression, background):
+    if compression == 'zstd':
+        pytest.importorskip('zstandard')
+    path = compressed_path(str(tmp_path / 'graph.json'), compression)
+    assert compression_of(path) == compression
+    with open_output(path, background=background) as f:
+        f.write(TEXT)
+    if compression != 'none':
+        assert os.path.getsize(path) < len(TEXT.encode('utf-8'))
+    # The input is recognized by its first bytes, not by its extension.
+    moved = str(tmp_path / 'moved.json')
+    os.rename(path, moved)
+    with open_input(moved) as f:
+        assert f.read() == TEXT
+
+
+def test_compression_given_overrides_the_extension(tmp_path):
+    path = str(tmp_path / 'graph.json')
+    with open_output(path, 'gzip') as f:
+        f.write(TEXT)
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        assert f.read() == TEXT
+
+
+class FailingFile:
+    def write(self, data):
+        raise OSError('disk full')
+
+    def close(self):
+        pass
+
+
+def test_errors_of_the_background_thread_are_raised():
+    writer = BackgroundWriter(FailingFile(), 'graph.json.gz')
+    writer.write(b'x')
+    with pytest.raises(RuntimeError):
+        writer.close()
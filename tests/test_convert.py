@@ -0,0 +1,99 @@
+# --coding:utf-8--
+
+import os
+import re
+import contextlib
+from typing import Optional, Tuple
+import pytest
+
+from convert_itis_to_jsongraph import convert_itis, convert_itis_parallel, convert_to_dot
+from itis_source import open_source, prepare_indexes
+from jsongraph import DotGraphWriter, FanOut, graph_writer
+from section_cache import SectionCache
+
+CREATED = re.compile(r'"created": ?"[^"]*"')
+
+# The layouts of the JSON: the default pretty printed one and that of --compact.
+LAYOUTS = {'pretty': (2, True), 'compact': (None, False)}
+
+
+def __read(path) -> str:
+    with open(path, 'r', encoding='utf-8') as f:
+        # Only the time of the conversion differs between runs.
+        return CREATED.sub('"created": null', f.read())
+
+
+def convert(itis_path: str, directory, engine: str = 'jsonstreams', indent: Optional[int] = 2) -> Tuple[str, str]:
+    """Converts a dump as the converter does without --jobs, and returns the JSON and the DOT."""
+    (json_path, dot_path) = (directory / 'graph.json', directory / 'graph.dot')
+    itis = open_source(itis_path)
+    prepare_indexes(itis)
+    with open(json_path, 'w', encoding='ascii') as json_file, open(dot_path, 'w', encoding='utf-8') as dot_file, \
+            contextlib.ExitStack() as stack:
+        graph = stack.enter_context(graph_writer(json_file, indent, engine))
+        dot = stack.enter_context(DotGraphWriter(dot_file))
+        convert_itis(itis, 'MD5', FanOut(graph, dot), spool_dir=str(directory))
+    itis.close()
+    return __read(json_path), __read(dot_path)
+
+
+def convert_parallel(itis_path: str, directory, engine: str = 'jsonstreams', indent: Optional[int] = 2,
+                     pretty: bool = True, cache: Optional[SectionCache] = None, jobs: int = 2) -> Tuple[str, str]:
+    """Converts a dump as the converter does with --jobs or --cache, and returns the JSON and the DOT."""
+    (json_path, dot_path) = (directory / 'graph.json', directory / 'graph.dot')
+    with open(json_path, 'w', encoding='ascii') as json_file, open(dot_path, 'w', encoding='utf-8') as dot_file:
+        convert_itis_parallel(itis_path, 'MD5', json_file, dot_file, jobs, indent, pretty, engine, cache=cache)
+    return __read(json_path), __read(dot_path)
+
+
+@pytest.mark.parametrize('layout', LAYOUTS)
+def test_fast_engine_writes_the_same_bytes(itis_path, tmp_path, layout):
+    (indent, _) = LAYOUTS[layout]
+    (tmp_path / 'jsonstreams').mkdir()
+    (tmp_path / 'fast').mkdir()
+    assert convert(itis_path, tmp_path / 'fast', 'fast', indent) == \
+        convert(itis_path, tmp_path / 'jsonstreams', 'jsonstreams', indent)
+
+
+@pytest.mark.parametrize('engine', ['jsonstreams', 'fast'])
+@pytest.mark.parametrize('layout', LAYOUTS)
+def test_spliced_fragments_match_the_sequential_conversion(itis_path, tmp_path, engine, layout):
+    (indent, pretty) = LAYOUTS[layout]
+    (tmp_path / 'sequential').mkdir()
+    (tmp_path / 'parallel').mkdir()
+    assert convert_parallel(itis_path, tmp_path / 'parallel', engine, indent, pretty) == \
+        convert(itis_path, tmp_path / 'sequential', 'jsonstreams', indent)
+
+
+def test_cached_fragments_match_the_sequential_conversion(itis_path, tmp_path):
+    cache = SectionCache(str(tmp_path / 'cache'))
+    for run in ('first', 'cached', 'sequential'):
+        (tmp_path / run).mkdir()
+    expected = convert(itis_path, tmp_path / 'sequential')
+    assert convert_parallel(itis_path, tmp_path / 'first', cache=cache) == expected
+    fragments = {path.name: path.stat().st_mtime_ns for path in (tmp_path / 'cache').iterdir()}
+    assert convert_parallel(itis_path, tmp_path / 'cached', cache=cache, jobs=3) == expected
+    # The second run splices the fragments of the first without rendering any again, with other jobs too.
+    assert {path.name: path.stat().st_mtime_ns for path in (tmp_path / 'cache').iterdir()} == fragments
+
+
+def test_fragments_of_replaced_dumps_and_other_versions_are_pruned(itis_path, tmp_path):
+    cache = SectionCache(str(tmp_path / 'cache'))
+    md5 = cache.source_md5(itis_path, lambda path: 'MD5')
+    current = cache.paths(cache.key(md5, 'scan_ranks', None, {}))
+    replaced = cache.paths(cache.key('OLD', 'scan_ranks', None, {}))
+    cache.version = '0' * 64
+    other_version = cache.paths(cache.key(md5, 'scan_ranks', None, {}))
+    for paths in (current, replaced, other_version):
+        for (json_path, dot_path) in paths.values():
+            open(json_path, 'w').close()
+            open(dot_path, 'w').close()
+    assert SectionCache(str(tmp_path / 'cache')).prune() == 8
+    assert sorted(path.name for path in (tmp_path / 'cache').iterdir()) == \
+        sorted(['sources.json'] + [os.path.basename(path) for paths in current.values() for path in paths])
+
+
+def test_streamed_dot_matches_the_dot_of_the_json(itis_path, tmp_path):
+    (_, dot) = convert(itis_path, tmp_path)
+    convert_to_dot(str(tmp_path / 'graph.json'), str(tmp_path / 'converted.dot'))
+    assert __read(tmp_path / 'converted.dot') == dot
@@ -0,0 +1,85 @@
+# --coding:utf-8--
+
+import io
+import re
+import sqlite3
+from typing import Callable, Dict, List, Tuple
+
+from convert_itis_to_jsongraph import convert_itis
+from dot_views import write_rank_overview, write_relations, write_subtree
+from hierarchy_index import build_hierarchy_index
+from itis_source import open_source, prepare_indexes
+from jsongraph import DotGraphWriter
+
+NODE = re.compile(r'^"([^"]*)" \[label="(.*)"\];$')
+EDGE = re.compile(r'^"([^"]*)" -> "([^"]*)" \[label="(.*)"\];$')
+
+# Levels of the subtree below the root of Plantae; the synthetic dump branches below its first levels.
+DEPTH = 5
+
+
+def __dot(write: Callable[[DotGraphWriter], None]) -> Tuple[Dict[str, str], List[Tuple[str, str, str]]]:
+    """Writes a view and returns its nodes by key and its edges."""
+    out = io.StringIO()
+    with DotGraphWriter(out) as dot:
+        write(dot)
+    nodes = {}
+    edges = []
+    for line in out.getvalue().splitlines()[1:-1]:
+        edge = EDGE.match(line)
+        if edge:
+            edges.append(edge.groups())
+        else:
+            (key, label) = NODE.match(line).groups()
+            nodes[key] = label
+    return nodes, edges
+
+
+def test_rank_overview_counts_the_units_of_each_rank(itis_path):
+    itis = sqlite3.connect(itis_path)
+    (nodes, edges) = __dot(lambda dot: write_rank_overview(itis, dot, 3))
+    ranks = itis.execute('SELECT COUNT(*) FROM taxon_unit_types WHERE kingdom_id = 3').fetchone()[0]
+    (units, children) = itis.execute('SELECT COUNT(*), COUNT(NULLIF(parent_tsn, 0)) FROM taxonomic_units '
+                                     'WHERE kingdom_id = 3').fetchone()
+    itis.close()
+    assert len(nodes) == ranks and all(key.startswith('rank-3.') for key in nodes)
+    assert sum(int(label.rpartition('(')[2][:-1]) for label in nodes.values()) == units
+    assert sum(int(relation.rpartition('(')[2][:-1]) for (_, _, relation) in edges) == children
+    assert {end for edge in edges for end in edge[:2]} <= set(nodes)
+
+
+def test_subtree_is_cut_at_the_depth(itis_path):
+    itis = sqlite3.connect(itis_path)
+    index = build_hierarchy_index(itis, 3)
+    (root,) = itis.execute('SELECT tsn FROM taxonomic_units WHERE kingdom_id = 3 AND parent_tsn = 0 '
+                           'ORDER BY rank_id LIMIT 1').fetchone()
+    size = int(index.size[index.position(root)])
+    links = itis.execute('''
+        WITH RECURSIVE below(parent_tsn, tsn, depth) AS (
+            SELECT parent_tsn, tsn, 1 FROM taxonomic_units WHERE parent_tsn = :root
+            UNION ALL
+            SELECT tu.parent_tsn, tu.tsn, below.depth + 1 FROM taxonomic_units AS tu
+            JOIN below ON tu.parent_tsn = below.tsn WHERE below.depth < :depth)
+        SELECT parent_tsn, tsn FROM below''', {'root': root, 'depth': DEPTH}).fetchall()
+    (nodes, edges) = __dot(lambda dot: write_subtree(itis, dot, index, root))
+    assert len(nodes) == size and len(edges) == size - 1
+
+    (nodes, edges) = __dot(lambda dot: write_subtree(itis, dot, index, root, DEPTH))
+    itis.close()
+    assert set(nodes) == {f'tu-{tsn}' for tsn in [root] + [tsn for (_, tsn) in links]}
+    assert sorted(edges) == sorted((f'tu-{parent}', f'tu-{tsn}', 'parent_of') for (parent, tsn) in links)
+    # The units at the cutoff are labelled with the number of units below them.
+    below = sum(int(label.rpartition('(+')[2][:-1]) for label in nodes.values() if '(+' in label)
+    assert below == size - 1 - len(links) and len(links) > DEPTH
+
+
+def test_relations_are_those_of_the_whole_graph(itis_path):
+    itis = open_source(itis_path)
+    prepare_indexes(itis)
+    (all_nodes, all_edges) = __dot(lambda dot: convert_itis(itis, 'MD5', dot))
+    for relations in (['parent_of'], ['vernacular_of', 'has_language'], ['uses', 'has_rank']):
+        (nodes, edges) = __dot(lambda dot: write_relations(itis, dot, relations))
+        assert edges == [edge for edge in all_edges if edge[2] in relations]
+        ends = {end for edge in edges for end in edge[:2]}
+        assert nodes == {key: label for (key, label) in all_nodes.items() if key in ends}
+    itis.close()
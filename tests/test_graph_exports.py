@@ -0,0 +1,53 @@
+# --coding:utf-8--
+
+from csr_graph import CsrGraph, CsrGraphWriter
+from ndjson_graph import NdjsonGraph, NdjsonGraphWriter
+
+NODES = [
+    ('tu-2', {'label': 'Plantae', 'metadata': {'type': 'taxonomic-unit', 'tsn': 2}}),
+    ('english', {'label': 'English', 'metadata': {'type': 'language'}}),
+    ('tu-10', {'label': 'Äbies', 'metadata': {'type': 'taxonomic-unit', 'tsn': 10}}),
+    ('english', {'label': 'English (again)', 'metadata': {'type': 'language'}}),
+    ('vern-ß', {'label': 'Tännchen', 'metadata': {'type': 'vernacular'}}),
+]
+
+EDGES = [
+    {'source': 'tu-2', 'target': 'tu-10', 'relation': 'parent_of'},
+    {'source': 'vern-ß', 'target': 'english', 'relation': 'uses'},
+    {'source': 'tu-1', 'target': 'tu-2', 'relation': 'parent_of'},
+]
+
+
+def write_graph(writer):
+    with writer:
+        writer.write('id', 'test')
+        with writer.subobject('nodes') as nodes:
+            for (key, node) in NODES:
+                nodes.write(key, node)
+        with writer.subarray('edges') as edges:
+            for edge in EDGES:
+                edges.write(edge)
+
+
+def test_ndjson_nodes_are_found_by_their_offset(tmp_path):
+    # Shards of a few bytes hold a line each.
+    write_graph(NdjsonGraphWriter(str(tmp_path), shard_bytes=10))
+    graph = NdjsonGraph(str(tmp_path))
+    assert len(graph.shard_paths('nodes')) == len(NODES)
+    assert graph.attributes == {'id': 'test'}
+    for (key, node) in NODES[:3] + NODES[4:]:
+        assert graph.node(key) == {'key': key, **node}
+    # The first of several nodes with the same key is found.
+    assert graph.node('english')['label'] == 'English'
+    assert graph.node('tu-1') is None and graph.node('') is None and graph.node('zz') is None
+
+
+def test_csr_keeps_the_first_of_several_nodes_with_the_same_key(tmp_path):
+    write_graph(CsrGraphWriter(str(tmp_path)))
+    graph = CsrGraph(str(tmp_path))
+    # The source of the last edge is no node of the graph and gets one with an empty label.
+    assert [graph.key(node) for node in range(len(graph))] == ['tu-2', 'english', 'tu-10', 'vern-ß', 'tu-1']
+    assert graph.label(graph.node('english')) == 'English'
+    assert graph.node_by_tsn(10) == graph.node('tu-10')
+    assert graph.neighbours(graph.node('vern-ß'), 'uses').tolist() == [graph.node('english')]
+    assert graph.neighbours(graph.node('tu-2'), 'parent_of', 'in').tolist() == [graph.node('tu-1')]
@@ -0,0 +1,66 @@
+# --coding:utf-8--
+
+import random
+import numpy as np
+import pytest
+
+from hierarchy_index import HierarchyIndex, build_hierarchy_index
+from itis_source import connect_read_only
+
+
+def __ancestors(parents: dict, tsn: int) -> list:
+    result = []
+    while parents.get(tsn) in parents:
+        tsn = parents[tsn]
+        result.append(tsn)
+    return result
+
+
+def random_forest(seed: int):
+    """TSNs and parent TSNs of a random forest, including roots with parents outside of it."""
+    rng = random.Random(seed)
+    tsns = sorted(rng.sample(range(1, 10000), rng.randint(1, 300)))
+    parents = {}
+    for (i, tsn) in enumerate(tsns):
+        if i == 0 or rng.random() < 0.05:
+            parents[tsn] = 0
+        elif rng.random() < 0.05:
+            parents[tsn] = 99999
+        else:
+            parents[tsn] = rng.choice(tsns[:i])
+    return tsns, parents
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_queries_match_walking_the_parents(seed):
+    (tsns, parents) = random_forest(seed)
+    index = HierarchyIndex.build(np.array(tsns, dtype=np.int64), np.array([parents[tsn] for tsn in tsns], dtype=np.int64))
+    ancestors = {tsn: __ancestors(parents, tsn) for tsn in tsns}
+    for tsn in tsns:
+        assert index.ancestors(tsn) == ancestors[tsn]
+        below = sorted(other for other in tsns if other == tsn or tsn in ancestors[other])
+        assert sorted(index.descendants(tsn).tolist()) == below
+
+    rng = random.Random(seed)
+    for _ in range(200):
+        (a, b) = (rng.choice(tsns), rng.choice(tsns))
+        assert index.is_ancestor(a, b) == (a == b or a in ancestors[b])
+        common = set([b] + ancestors[b])
+        assert index.lca(a, b) == next((tsn for tsn in [a] + ancestors[a] if tsn in common), None)
+
+
+def test_cycles_are_rejected():
+    with pytest.raises(ValueError):
+        HierarchyIndex.build(np.array([1, 2, 3], dtype=np.int64), np.array([0, 3, 2], dtype=np.int64))
+
+
+def test_saved_index_answers_the_same(itis_path, tmp_path):
+    itis = connect_read_only(itis_path)
+    index = build_hierarchy_index(itis)
+    itis.close()
+    index.save(str(tmp_path / 'hierarchy.npz'))
+    loaded = HierarchyIndex.load(str(tmp_path / 'hierarchy.npz'))
+    tsns = index.tsns.tolist()
+    for tsn in tsns[::50]:
+        assert loaded.metadata(tsn) == index.metadata(tsn)
+        assert loaded.lca(tsn, tsns[-1]) == index.lca(tsn, tsns[-1])
@@ -0,0 +1,182 @@
+# --coding:utf-8--
+
+import re
+import sqlite3
+import importlib
+from typing import List, Set, Tuple
+import pytest
+
+pytest.importorskip('nebula2')
+from nebula2.common.ttypes import ErrorCode
+
+importer = importlib.import_module('import')
+
+UNIT = re.compile(r'"tsn-(\d+)":\(')
+PARENT_OF = re.compile(r'"tsn-(\d+)"->"tsn-(\d+)":\(\)')
+
+
+class Response:
+    def __init__(self, error_code: int = ErrorCode.SUCCEEDED):
+        self.code = error_code
+
+    def is_succeeded(self) -> bool:
+        return self.code == ErrorCode.SUCCEEDED
+
+    def error_code(self) -> int:
+        return self.code
+
+    def error_msg(self) -> str:
+        return f'error {self.code}'
+
+
+class Session:
+    """Records the statements it executes, and fails all after the first statements given."""
+
+    def __init__(self, failing_after: int = -1, error_code: int = ErrorCode.E_EXECUTION_ERROR):
+        self.statements = []
+        self.failing_after = failing_after
+        self.error_code = error_code
+
+    def execute(self, statement: str) -> Response:
+        if 0 <= self.failing_after <= len(self.statements):
+            return Response(self.error_code)
+        self.statements.append(statement)
+        return Response()
+
+
+def __import(session: Session, itis: sqlite3.Connection, checkpoint):
+    importer.create_ranks(session, itis, checkpoint=checkpoint)
+    importer.create_taxonomic_units(session, itis, batch_size=50, checkpoint=checkpoint)
+
+
+def __inserted(statements: List[str]) -> Tuple[Set[int], Set[Tuple[int, int]]]:
+    units = {int(tsn) for statement in statements if statement.startswith(importer.TAXONOMIC_UNIT_INSERT)
+             for tsn in UNIT.findall(statement)}
+    parents = {(int(parent), int(child)) for statement in statements if statement.startswith(importer.PARENT_OF_INSERT)
+               for (parent, child) in PARENT_OF.findall(statement)}
+    return units, parents
+
+
+def test_interrupted_import_resumes_from_the_checkpoint(itis_path, tmp_path):
+    itis = sqlite3.connect(itis_path)
+    path = str(tmp_path / 'checkpoint.json')
+    complete = Session()
+    __import(complete, itis, importer.Checkpoint())
+
+    interrupted = Session(failing_after=20)
+    with pytest.raises(AssertionError):
+        __import(interrupted, itis, importer.Checkpoint(path, itis_path))
+    resumed = Session()
+    checkpoint = importer.Checkpoint(path, itis_path)
+    assert checkpoint.position('ranks') is not None
+    __import(resumed, itis, checkpoint)
+    checkpoint.remove()
+    itis.close()
+
+    (units, parents) = __inserted(complete.statements)
+    (interrupted_units, interrupted_parents) = __inserted(interrupted.statements)
+    (resumed_units, resumed_parents) = __inserted(resumed.statements)
+    assert interrupted_units | resumed_units == units
+    assert interrupted_parents | resumed_parents == parents
+    assert len(resumed.statements) < len(complete.statements)
+
+
+def test_checkpoint_of_another_import_is_rejected(itis_path, tmp_path):
+    path = str(tmp_path / 'checkpoint.json')
+    importer.Checkpoint(path, itis_path).advance(['units'], 10)
+    assert importer.Checkpoint(path, itis_path).position('units') == 10
+    with pytest.raises(ValueError):
+        importer.Checkpoint(path, itis_path, kingdom_id=5)
+
+
+class ScriptedSession:
+    """Answers statements with the given responses in turn."""
+
+    def __init__(self, responses: List[Response]):
+        self.responses = responses
+        self.calls = 0
+
+    def execute(self, statement: str) -> Response:
+        self.calls += 1
+        return self.responses.pop(0)
+
+
+def test_only_transient_errors_are_retried():
+    retry = importer.Retry(attempts=3, backoff=0.)
+    session = ScriptedSession([Response(ErrorCode.E_SYNTAX_ERROR), Response()])
+    with pytest.raises(AssertionError):
+        retry.execute(session, 'INSERT')
+    assert session.calls == 1
+
+    session = ScriptedSession([Response(ErrorCode.E_LEADER_CHANGED), Response(ErrorCode.E_RPC_FAILURE), Response()])
+    retry.execute(session, 'INSERT')
+    assert session.calls == 3
+
+
+def test_strings_are_escaped_for_double_quoted_literals():
+    assert importer.escape_string('say "hi"\\n\n\r') == 'say \\"hi\\"\\\\n\\n\\r'
+    assert importer.nql_strings(['a"b', None, 'c\\d', '']) == ['"a\\"b"', 'null', '"c\\\\d"', '""']
+    # A value holding the separator of the column is escaped on its own.
+    assert importer.nql_strings(['a\x00b', '"']) == ['"a\x00b"', '"\\""']
+
+
+def test_rows_are_sent_in_multi_row_statements_of_batch_size():
+    shards = []
+    with importer.BatchInserter(shards.append, ['INSERT A VALUES', 'INSERT B VALUES'], batch_size=2) as inserter:
+        for i in range(5):
+            inserter.add(f'a{i}', None if i % 2 else f'b{i}')
+    assert shards == [[('INSERT A VALUES', ['a0', 'a1']), ('INSERT B VALUES', ['b0'])],
+                      [('INSERT A VALUES', ['a2', 'a3']), ('INSERT B VALUES', ['b2'])],
+                      [('INSERT A VALUES', ['a4']), ('INSERT B VALUES', ['b4'])]]
+
+    session = Session()
+    importer.execute_batches(session, shards[0] + [('INSERT C VALUES', [])])
+    assert session.statements == ['INSERT A VALUES a0,a1;', 'INSERT B VALUES b0;']
+
+
+def test_units_are_inserted_in_batches(itis_path):
+    itis = sqlite3.connect(itis_path)
+    (units, parents) = (itis.execute('SELECT COUNT(*) FROM taxonomic_units WHERE kingdom_id = 3').fetchone()[0],
+                        itis.execute('SELECT COUNT(*) FROM taxonomic_units WHERE kingdom_id = 3 AND parent_tsn > 0')
+                        .fetchone()[0])
+    session = Session()
+    importer.create_taxonomic_units(session, itis, batch_size=50)
+    itis.close()
+    rows = [len(UNIT.findall(statement)) for statement in session.statements
+            if statement.startswith(importer.TAXONOMIC_UNIT_INSERT)]
+    assert rows[:-1] == [50] * (len(rows) - 1) and 0 < rows[-1] <= 50 and sum(rows) == units
+    assert len(__inserted(session.statements)[1]) == parents
+    assert sum(statement.count('->') for statement in session.statements
+               if statement.startswith(importer.HAS_RANK_INSERT)) == units
+
+
+def test_workers_insert_the_same_rows_as_a_single_session(itis_path):
+    itis = sqlite3.connect(itis_path)
+    single = Session()
+    importer.create_taxonomic_units(single, itis, batch_size=50)
+    sessions = [Session() for _ in range(3)]
+    with importer.ImportWorkers(sessions, 'itis') as workers:
+        importer.create_taxonomic_units(Session(), itis, batch_size=50, workers=workers)
+    itis.close()
+
+    assert all(session.statements[0] == 'USE itis;' for session in sessions)
+    statements = [statement for session in sessions for statement in session.statements[1:]]
+    assert sorted(statements) == sorted(single.statements)
+    # The units and their ranks of a shard are inserted by one session, in order.
+    for session in sessions:
+        kinds = [statement.split(' VALUES')[0] for statement in session.statements[1:]]
+        for (i, kind) in enumerate(kinds):
+            if kind == importer.HAS_RANK_INSERT.split(' VALUES')[0]:
+                assert kinds[i - 1] == importer.TAXONOMIC_UNIT_INSERT.split(' VALUES')[0]
+
+
+def test_failing_worker_stops_the_import():
+    done = []
+    with importer.ImportWorkers([Session(failing_after=2)], 'itis', queue_size=1) as workers:
+        workers.submit([('INSERT A VALUES', ['a'])], lambda: done.append('a'))
+        workers.submit([('INSERT B VALUES', ['b'])], lambda: done.append('b'))
+        with pytest.raises(RuntimeError):
+            workers.join()
+        with pytest.raises(RuntimeError):
+            workers.submit([('INSERT C VALUES', ['c'])])
+    assert done == ['a']
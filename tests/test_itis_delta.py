@@ -0,0 +1,87 @@
+# --coding:utf-8--
+
+import json
+import shutil
+import sqlite3
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import convert_itis_to_jsongraph as converter
+from itis_delta import diff_graphs, write_json_patch
+from jsongraph import EdgeCollector, NodeCollector
+
+
+def __graph(path: str, kingdom_id: int = 3) -> Tuple[Dict[str, dict], List[dict]]:
+    itis = sqlite3.connect(path)
+    (nodes, edges) = (NodeCollector(), EdgeCollector())
+    for scan in converter.SCANS:
+        scan(itis, nodes, edges, kingdom_id)
+    itis.close()
+    return nodes, edges
+
+
+def __edges(edges: List[dict]) -> Counter:
+    return Counter(json.dumps(edge, sort_keys=True) for edge in edges)
+
+
+def __change(path: str):
+    """Renames, deletes and adds rows of both kingdoms in a copy of the dump."""
+    itis = sqlite3.connect(path)
+    (renamed, leaf) = [tsn for (tsn,) in itis.execute(
+        'SELECT tsn FROM taxonomic_units WHERE kingdom_id = 3 AND tsn NOT IN '
+        '(SELECT parent_tsn FROM taxonomic_units WHERE parent_tsn IS NOT NULL) ORDER BY tsn DESC LIMIT 2')]
+    itis.execute("UPDATE taxonomic_units SET complete_name = 'Renamed', update_date = '2021-05-01' WHERE tsn = ?",
+                 (renamed,))
+    itis.execute("UPDATE longnames SET completename = 'Renamed' WHERE tsn = ?", (renamed,))
+    for table in ('taxonomic_units', 'longnames', 'vernaculars', 'synonym_links', 'geographic_div', 'nodc_ids'):
+        itis.execute(f'DELETE FROM {table} WHERE tsn = ?', (leaf,))
+    itis.execute("INSERT INTO vernaculars VALUES (?, 'new name', 'French', 'N', '2021-05-01', 999999)", (renamed,))
+    itis.execute("UPDATE taxon_authors_lkp SET taxon_author = 'Changed' WHERE taxon_author_id = "
+                 "(SELECT MIN(taxon_author_id) FROM taxon_authors_lkp WHERE kingdom_id = 3) AND kingdom_id = 3")
+    itis.execute("UPDATE taxonomic_units SET complete_name = 'Elsewhere' WHERE tsn = "
+                 "(SELECT MIN(tsn) FROM taxonomic_units WHERE kingdom_id = 5)")
+    itis.commit()
+    itis.close()
+
+
+def test_patch_turns_the_previous_graph_into_the_current_one(itis_path, tmp_path):
+    (previous_path, current_path) = (str(tmp_path / 'previous.sqlite'), str(tmp_path / 'current.sqlite'))
+    shutil.copy(itis_path, previous_path)
+    shutil.copy(itis_path, current_path)
+    __change(current_path)
+    write_json_patch(previous_path, current_path, str(tmp_path / 'patch.json'))
+    with open(tmp_path / 'patch.json', 'r', encoding='utf-8') as f:
+        patch = json.load(f)['patch']
+
+    (nodes, edges) = __graph(previous_path)
+    nodes.update(patch['upsert']['nodes'])
+    for key in patch['delete']['nodes']:
+        del nodes[key]
+    edges = __edges(edges) - __edges(patch['delete']['edges']) + __edges(patch['upsert']['edges'])
+
+    (current_nodes, current_edges) = __graph(current_path)
+    assert nodes == current_nodes
+    assert edges == __edges(current_edges)
+    # Only the changed units of the kingdom, their vernaculars and the changed author are in the patch.
+    assert len(patch['delete']['nodes']) == 1 + sum(key.startswith('vern-') for key in patch['delete']['nodes'])
+    assert not any(node['label'] == 'Elsewhere' for node in patch['upsert']['nodes'].values())
+    assert len([key for key in patch['upsert']['nodes'] if key.startswith('tu-')]) == 1
+
+
+def test_unchanged_dumps_give_an_empty_patch(itis_path, tmp_path):
+    write_json_patch(itis_path, itis_path, str(tmp_path / 'patch.json'), kingdom_id=5)
+    with open(tmp_path / 'patch.json', 'r', encoding='utf-8') as f:
+        patch = json.load(f)['patch']
+    assert patch['delete'] == {'nodes': [], 'edges': []}
+    # The global nodes are always compared in full, and none of them changed.
+    assert patch['upsert'] == {'nodes': {}, 'edges': []}
+
+
+def test_repeated_edges_are_compared_as_multisets():
+    edge = {'source': 'a', 'target': 'b', 'relation': 'r'}
+    other = {'source': 'a', 'target': 'c', 'relation': 'r'}
+    (upserted, deleted, added, removed) = diff_graphs({'a': {'label': 'A'}, 'b': {'label': 'B'}}, [edge, edge, other],
+                                                      {'a': {'label': 'A2'}, 'c': {'label': 'C'}}, [edge, edge, edge])
+    assert upserted == {'a': {'label': 'A2'}, 'c': {'label': 'C'}}
+    assert deleted == ['b']
+    assert (added, removed) == ([edge], [other])
@@ -0,0 +1,69 @@
+# --coding:utf-8--
+
+import io
+import json
+
+from jsongraph import DotGraphWriter, GraphReader, copy_graph
+
+DOCUMENT = {
+    'graph': {
+        'id': 'itis-042721',
+        'metadata': {'created': '2021-04-27T00:00:00', 'metadata': {'md5': 'abc'}},
+        'nodes': {
+            'tu-202422': {'label': 'Plantae', 'metadata': {'tsn': 202422, 'rank': 1.5e3, 'accepted': True}},
+            'vern-1': {'label': 'Ch\u00eane "blanc"', 'metadata': {'parents': [], 'none': None}},
+        },
+        'edges': [
+            {'source': 'vern-1', 'target': 'tu-202422', 'relation': 'vernacular_of'},
+            {'source': 'tu-202422', 'target': 'tu-202422', 'relation': 'parent_of', 'metadata': {'depth': 12345}},
+        ],
+    },
+    'other': [1, {'graph': 'ignored'}],
+}
+
+
+class SmallChunks(GraphReader):
+    # Chunks of a few characters split keys, strings and numbers.
+    CHUNK_SIZE = 3
+
+
+def test_reader_yields_attributes_nodes_and_edges_in_order():
+    for indent in (None, 2):
+        text = json.dumps(DOCUMENT, indent=indent)
+        for reader in (GraphReader(io.StringIO(text)), SmallChunks(io.StringIO(text))):
+            assert list(reader) == [
+                ('attribute', 'id', 'itis-042721'),
+                ('attribute', 'metadata', DOCUMENT['graph']['metadata']),
+                *[('node', key, node) for (key, node) in DOCUMENT['graph']['nodes'].items()],
+                *[('edge', edge) for edge in DOCUMENT['graph']['edges']],
+            ]
+
+
+def test_reader_handles_empty_sections_and_rejects_truncated_documents():
+    assert list(GraphReader(io.StringIO('{"graph": {"nodes": {}, "edges": []}}'))) == []
+    for text in ('{"graph": {"nodes": {"a": {"label": "A"}', '{"graph": {"nodes": {"a": {"label": "A"}}, "edges": ['):
+        try:
+            list(SmallChunks(io.StringIO(text)))
+        except ValueError:
+            continue
+        raise AssertionError(f'{text} was read')
+
+
+def test_dot_of_a_document_has_a_line_per_node_and_edge():
+    dot = io.StringIO()
+    with DotGraphWriter(dot) as writer:
+        copy_graph(io.StringIO(json.dumps(DOCUMENT)), writer)
+    assert dot.getvalue() == 'digraph "itis-042721" {\n' \
+                             '"tu-202422" [label="Plantae"];\n' \
+                             '"vern-1" [label="Chêne \\"blanc\\""];\n' \
+                             '"vern-1" -> "tu-202422" [label="vernacular_of"];\n' \
+                             '"tu-202422" -> "tu-202422" [label="parent_of"];\n' \
+                             '}'
+
+def test_dot_keeps_the_first_of_several_nodes_with_the_same_key():
+    document = '{"graph": {"id": "g", "nodes": {"english": {"label": "English"}, "tu-2": {"label": "Plantae"}, ' \
+               '"english": {"label": "eng"}}, "edges": []}}'
+    dot = io.StringIO()
+    with DotGraphWriter(dot) as writer:
+        copy_graph(io.StringIO(document), writer)
+    assert dot.getvalue() == 'digraph "g" {\n"english" [label="English"];\n"tu-2" [label="Plantae"];\n}'
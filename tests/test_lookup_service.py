@@ -0,0 +1,91 @@
+# --coding:utf-8--
+
+import json
+import asyncio
+import sqlite3
+from typing import List
+import pytest
+
+pytest.importorskip('tornado')
+import tornado.httpclient
+import tornado.httpserver
+import tornado.testing
+from lookup_service import ChildIndex, ConnectionPool, LatencyWindow, LruCache, TaxonLookup, make_app
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = LruCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is LruCache.MISSING
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert cache.as_dict() == {'size': 2, 'capacity': 2, 'hits': 3, 'misses': 1}
+
+
+def test_cached_none_is_a_hit():
+    cache = LruCache(1)
+    cache.put(('unit', 1, None), None)
+    assert cache.get(('unit', 1, None)) is None
+    assert cache.hits == 1
+
+
+def test_zero_capacity_caches_nothing():
+    cache = LruCache(0)
+    cache.put('a', 1)
+    assert cache.get('a') is LruCache.MISSING
+
+
+def test_percentiles_are_nearest_rank():
+    window = LatencyWindow(size=100)
+    assert window.percentile(50) is None
+    for milliseconds in range(1, 101):
+        window.observe(milliseconds / 1000)
+    assert (window.percentile(50), window.percentile(99), window.percentile(100)) == (0.05, 0.099, 0.1)
+    # Only the last latencies of the window count.
+    window.observe(1.)
+    assert window.percentile(100) == 1. and window.percentile(1) == 0.002
+    assert window.count == 101
+
+
+def __fetch(itis_path: str, paths: List[str], pool_size: int = 2, mode: str = 'disk') -> List[dict]:
+    """Serves the dump on a free port and fetches the paths from it."""
+    async def fetch() -> List[dict]:
+        (sock, port) = tornado.testing.bind_unused_port()
+        server = tornado.httpserver.HTTPServer(make_app(service))
+        server.add_sockets([sock])
+        client = tornado.httpclient.AsyncHTTPClient()
+        try:
+            return [json.loads((await client.fetch(f'http://127.0.0.1:{port}{path}', raise_error=False)).body)
+                    for path in paths]
+        finally:
+            server.stop()
+
+    pool = ConnectionPool(itis_path, pool_size, mode)
+    with pool.connection() as itis:
+        service = TaxonLookup(pool, ChildIndex(itis), LruCache(0))
+    try:
+        return asyncio.run(fetch())
+    finally:
+        pool.close()
+
+
+def test_languages_in_the_path_are_percent_decoded(itis_path):
+    itis = sqlite3.connect(itis_path)
+    (tsn, count) = itis.execute("SELECT tsn, COUNT(*) FROM vernaculars WHERE language = 'Native American' "
+                                "GROUP BY tsn LIMIT 1").fetchone()
+    itis.close()
+    (names,) = __fetch(itis_path, [f'/units/{tsn}/vernaculars/Native%20American'])
+    assert len(names['result']) == count
+    assert {name['language'] for name in names['result']} == {'Native American'}
+
+
+def test_connections_share_the_prepared_indexes(itis_path):
+    itis = sqlite3.connect(itis_path)
+    tsns = [tsn for (tsn,) in itis.execute('SELECT tsn FROM vernaculars ORDER BY tsn LIMIT 20')]
+    itis.close()
+    paths = [f'/units/{tsn}{route}' for tsn in tsns for route in ('', '/ancestors', '/accepted', '/vernaculars')]
+    assert __fetch(itis_path, paths, pool_size=3) == __fetch(itis_path, paths, pool_size=1, mode='memory')
+    with pytest.raises(AssertionError):
+        ConnectionPool(itis_path, 2, 'memory')
@@ -0,0 +1,58 @@
+# --coding:utf-8--
+
+import sqlite3
+
+from jsongraph import EdgeCollector
+from metrics import LATENCY_BUCKETS, Histogram, Metrics, prometheus_text
+
+
+def test_latencies_fall_into_the_bucket_of_their_upper_bound():
+    histogram = Histogram()
+    for seconds in (0.0001, 0.0005, 0.0006, 10., 11.):
+        histogram.observe(seconds)
+    buckets = histogram.as_dict()['buckets']
+    assert list(buckets) == [str(bound) for bound in LATENCY_BUCKETS] + ['+Inf']
+    assert (buckets['0.0005'], buckets['0.001'], buckets['10.0'], buckets['+Inf']) == (2, 1, 1, 1)
+    assert histogram.count == 5 and abs(histogram.sum - 21.0012) < 1e-9
+
+
+def test_report_is_formatted_in_the_prometheus_text_format():
+    report = {
+        'stages': {'nodes "a"': {'seconds': 1.5, 'rows_read': 2, 'read_seconds': 0.5, 'rows': 3, 'write_seconds': 0.25,
+                                 'bytes': 10, 'peak_rss_bytes': 1024}},
+        'histograms': {'statement_seconds': {'INSERT': {'buckets': {'0.1': 1, '1.0': 0, '+Inf': 2},
+                                                        'count': 3, 'sum': 4.5}}},
+    }
+    lines = prometheus_text(report).splitlines()
+    assert lines[:2] == ['# TYPE itis_stage_seconds gauge', 'itis_stage_seconds{stage="nodes \\"a\\""} 1.5']
+    assert lines[-6:] == [
+        '# TYPE itis_statement_seconds histogram',
+        'itis_statement_seconds_bucket{statement="INSERT",le="0.1"} 1',
+        'itis_statement_seconds_bucket{statement="INSERT",le="1.0"} 1',
+        'itis_statement_seconds_bucket{statement="INSERT",le="+Inf"} 3',
+        'itis_statement_seconds_sum{statement="INSERT"} 4.5',
+        'itis_statement_seconds_count{statement="INSERT"} 3',
+    ]
+
+
+def test_stages_count_rows_and_add_up():
+    metrics = Metrics()
+    itis = sqlite3.connect(':memory:')
+    with metrics.stage('disabled') as stage:
+        assert metrics.connection(itis, stage) is itis
+    metrics.observe('statement_seconds', 'INSERT', 1.)
+    assert metrics.report() == {'stages': {}, 'histograms': {}}
+
+    metrics.enable()
+    for _ in range(2):
+        with metrics.stage('nodes') as stage:
+            rows = list(metrics.connection(itis, stage).execute('SELECT 1 UNION ALL SELECT 2'))
+            written = EdgeCollector()
+            writer = metrics.writer(written, stage)
+            for (value,) in rows:
+                writer.write(value)
+            assert written == [1, 2]
+    metrics.observe('statement_seconds', 'INSERT', 1.)
+    report = metrics.report()
+    assert (report['stages']['nodes']['rows_read'], report['stages']['nodes']['rows']) == (4, 4)
+    assert report['histograms']['statement_seconds']['INSERT']['count'] == 1
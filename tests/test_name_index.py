@@ -0,0 +1,78 @@
+# --coding:utf-8--
+
+import random
+
+from name_index import PREFIX_BYTES, NameIndex, build_name_index, normalize, read_names, trigrams
+from itis_source import open_source, prepare_indexes
+
+# Names sharing more leading bytes than the prefixes hold, differing in case, spacing and accents.
+NAMES = [
+    ('Quercus alba', 1, None),
+    ('Quercus  ALBA', 2, None),
+    ('Quercus alba subsp. alba', 3, None),
+    ('Quercus alba subsp. albida', 4, None),
+    ('Quercus alba subsp. al', 5, None),
+    ('white oak', 1, 'English'),
+    ('chêne blanc', 1, 'French'),
+    ('Äbies', 6, None),
+    ('Abies', 7, None),
+    ('Zea mays', 8, None),
+    ('maïs', 8, 'French'),
+]
+
+
+def __names(seed: int) -> list:
+    rng = random.Random(seed)
+    stems = ['quercus alba subsp. ', 'quercus ', 'q', 'äbies ', 'zea']
+    return [(rng.choice(stems) + ''.join(rng.choice('abcé ') for _ in range(rng.randrange(8))), tsn, None)
+            for tsn in range(200)]
+
+
+def __sorted_keys(names: list) -> list:
+    return sorted({normalize(name) for (name, _, _) in names if name}, key=lambda key: key.encode('utf-8'))
+
+
+def test_lookups_match_a_scan_of_the_names(tmp_path):
+    build_name_index(iter(NAMES), str(tmp_path))
+    index = NameIndex(str(tmp_path))
+    assert len(index) == len(__sorted_keys(NAMES))
+    assert sorted(index.lookup('quercus alba')) == [('Quercus  ALBA', 2, None), ('Quercus alba', 1, None)]
+    assert index.lookup('QUERCUS ALBA SUBSP. ALBIDA') == [('Quercus alba subsp. albida', 4, None)]
+    assert index.lookup('chêne  blanc') == [('chêne blanc', 1, 'French')]
+    assert index.lookup('Quercus alba subsp.') == [] and index.lookup('') == [] and index.lookup('zzz') == []
+    assert index.complete('quercus alba subsp. al') == \
+        ['Quercus alba subsp. al', 'Quercus alba subsp. alba', 'Quercus alba subsp. albida']
+    assert index.complete('ä') == ['Äbies'] and index.complete('ma') == ['maïs']
+    assert index.complete('quercus', limit=2) == ['Quercus alba', 'Quercus alba subsp. al']
+    assert index.fuzzy('Quercus albaa')[0] == ('Quercus alba', 0.8)
+
+
+def test_random_names_are_found_across_shared_prefixes(tmp_path):
+    for seed in range(5):
+        names = __names(seed)
+        build_name_index(iter(names), str(tmp_path / str(seed)))
+        index = NameIndex(str(tmp_path / str(seed)))
+        keys = __sorted_keys(names)
+        assert any(len(key.encode('utf-8')) > PREFIX_BYTES for key in keys)
+        for key in keys:
+            assert {tsn for (_, tsn, _) in index.lookup(key)} == \
+                {tsn for (name, tsn, _) in names if normalize(name) == key}
+            for length in range(len(key) + 1):
+                # Completions are of the normalized prefix, without trailing whitespace.
+                prefix = normalize(key[:length])
+                expected = [other for other in keys if other.startswith(prefix)][:10]
+                assert [normalize(name) for name in index.complete(key[:length])] == expected
+
+
+def test_fuzzy_scores_are_shared_trigrams(itis_path, tmp_path):
+    itis = open_source(itis_path)
+    prepare_indexes(itis)
+    build_name_index(read_names(itis), str(tmp_path))
+    itis.close()
+    index = NameIndex(str(tmp_path))
+    name = index.keys[len(index) // 2]
+    assert index.fuzzy(name)[0] == (index.labels[int(index.label_ids[index.offsets[len(index) // 2]])], 1.0)
+    misspelt = name[:-1] + ('a' if name[-1] != 'a' else 'e')
+    for (candidate, score) in index.fuzzy(misspelt, limit=5):
+        (expected, found) = (set(trigrams(misspelt)), set(trigrams(normalize(candidate))))
+        assert score == len(expected & found) / len(expected | found)
@@ -0,0 +1,60 @@
+# --coding:utf-8--
+
+import os
+import csv
+import json
+import sqlite3
+import pytest
+
+from nebula_bulk import CONFIG, EDGES, TAGS, export_bulk_load
+
+
+def __rows(directory, paths) -> list:
+    rows = []
+    for path in paths:
+        with open(os.path.join(directory, path), 'r', encoding='utf-8', newline='') as f:
+            rows.extend(csv.reader(f))
+    return rows
+
+
+def test_bulk_load_files_hold_the_kingdom_in_chunks(itis_path, tmp_path):
+    itis = sqlite3.connect(itis_path)
+    config_path = export_bulk_load(itis, str(tmp_path), ['CREATE SPACE itis;'], 3, chunk_rows=500,
+                                   address=('graphd', 9669), after_period='30s')
+    units = itis.execute('SELECT tsn, parent_tsn, unit_name2 FROM taxonomic_units WHERE kingdom_id = 3 ORDER BY tsn')
+    units = units.fetchall()
+    ranks = itis.execute('SELECT COUNT(*) FROM taxon_unit_types WHERE kingdom_id = 3').fetchone()[0]
+    itis.close()
+    assert config_path == str(tmp_path / CONFIG)
+
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    assert config['clientSettings']['connection']['address'] == 'graphd:9669'
+    assert config['clientSettings']['postStart'] == {'commands': 'CREATE SPACE itis;', 'afterPeriod': '30s'}
+    files = {}
+    for entry in config['files']:
+        schema = entry['schema']
+        name = schema['vertex']['tags'][0]['name'] if schema['type'] == 'vertex' else schema['edge']['name']
+        files.setdefault(name, []).append(entry['path'][len('./'):])
+    # The vertices are loaded before the edges.
+    assert list(files) == [*TAGS, *EDGES]
+
+    unit_rows = __rows(tmp_path, files['taxonomic_unit'])
+    assert len(files['taxonomic_unit']) == (len(units) + 499) // 500
+    assert [row[0] for row in unit_rows] == [f'tsn-{tsn}' for (tsn, _, _) in units]
+    # Missing strings are empty fields.
+    assert [row[9] for row in unit_rows] == ['' if name is None else name for (_, _, name) in units]
+    assert len(__rows(tmp_path, files['has_rank'])) == len(units)
+    assert __rows(tmp_path, files['parent_of']) == \
+        [[f'tsn-{parent}', f'tsn-{tsn}'] for (tsn, parent, _) in units if parent]
+    assert len(__rows(tmp_path, files['rank'])) == ranks
+
+
+def test_bulk_load_configuration_is_yaml(itis_path, tmp_path):
+    yaml = pytest.importorskip('yaml')
+    itis = sqlite3.connect(itis_path)
+    config_path = export_bulk_load(itis, str(tmp_path), ['CREATE SPACE itis;', 'USE itis;'], 3)
+    itis.close()
+    with open(config_path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    assert yaml.safe_load(text) == json.loads(text)
@@ -0,0 +1,43 @@
+# --coding:utf-8--
+
+import sqlite3
+import pytest
+from dateutil.parser import parse as parse_time
+
+from row_source import iso_timestamps, record_batches
+
+
+def __parsed(values: list) -> list:
+    return [None if value is None else parse_time(value).isoformat() for value in values]
+
+
+def test_timestamps_of_itis_are_converted_as_a_block():
+    values = ['1996-06-13 14:51:08', '2021-04-27 00:00:00', '2000-02-29 23:59:59']
+    assert iso_timestamps(values) == __parsed(values) == \
+        ['1996-06-13T14:51:08', '2021-04-27T00:00:00', '2000-02-29T23:59:59']
+
+
+def test_other_blocks_are_parsed_value_by_value():
+    for values in (['1996-06-13 14:51:08', None],
+                   ['1996-06-13 14:51:08', '2021-04-27'],
+                   ['1996-06-13 14:51:08', '2021-04-27T10:00:00.250'],
+                   ['2001-02-28 10:00:00', 'June 13, 1996 2:51 PM']):
+        assert iso_timestamps(values) == __parsed(values)
+
+
+def test_impossible_dates_are_not_converted_as_a_block():
+    # 2001 is no leap year; the block fails the way parsing the value alone does.
+    with pytest.raises(ValueError):
+        iso_timestamps(['2000-01-01 00:00:00', '2001-02-29 10:00:00'])
+
+
+def test_record_batches_convert_named_columns():
+    itis = sqlite3.connect(':memory:')
+    rows = [(i, f'2021-04-{1 + i % 28:02d} 00:00:00') for i in range(10)]
+    cursor = itis.execute('SELECT column1 AS tsn, column2 AS updated FROM (VALUES {})'.format(
+        ','.join(f"({tsn}, '{updated}')" for (tsn, updated) in rows)))
+    batches = list(record_batches(cursor, {'updated': iso_timestamps}, rows=4))
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+    assert [row for batch in batches for row in batch.rows()] == \
+        [(tsn, updated.replace(' ', 'T')) for (tsn, updated) in rows]
+    assert list(batches[0]['tsn']) == [0, 1, 2, 3]
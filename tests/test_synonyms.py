@@ -0,0 +1,32 @@
+# --coding:utf-8--
+
+import numpy as np
+
+from synonyms import UNRESOLVED, SynonymTable
+
+
+def test_chains_resolve_to_their_accepted_unit():
+    # 4 -> 3 -> 2 -> 1 and 5 -> 2.
+    table = SynonymTable.build(np.arange(1, 7, dtype=np.int64), {4: 3, 3: 2, 2: 1, 5: 2})
+    assert table.resolve(1) == (1, 0)
+    assert table.resolve(2) == (1, 1)
+    assert table.resolve(4) == (1, 3)
+    assert table.resolve(5) == (1, 2)
+    assert table.resolve(6) == (6, 0)
+    assert table.as_dict() == {2: 1, 3: 1, 4: 1, 5: 1}
+
+
+def test_cycles_and_units_leading_into_them_are_unresolved():
+    # 1 -> 2 -> 3 -> 1 is a cycle, 4 leads into it and 5 links to itself.
+    table = SynonymTable.build(np.arange(1, 7, dtype=np.int64), {1: 2, 2: 3, 3: 1, 4: 1, 5: 5})
+    for tsn in (1, 2, 3, 4, 5):
+        assert table.resolve(tsn) == (None, -1)
+    assert table.resolve(6) == (6, 0)
+    assert table.as_dict() == {tsn: UNRESOLVED for tsn in (1, 2, 3, 4, 5)}
+
+
+def test_saved_table_resolves_the_same(tmp_path):
+    table = SynonymTable.build(np.arange(1, 5, dtype=np.int64), {2: 1, 3: 4, 4: 3})
+    table.save(str(tmp_path / 'synonyms.npz'))
+    loaded = SynonymTable.load(str(tmp_path / 'synonyms.npz'))
+    assert [loaded.resolve(tsn) for tsn in range(1, 5)] == [table.resolve(tsn) for tsn in range(1, 5)]
@@ -0,0 +1,66 @@
+# --coding:utf-8--
+
+import json
+
+from compression import open_output
+from validate_graph import MAX_BITMAP_NUMBER, KeySet, validate_graph
+
+NODES = {'tu-1': {'label': 'Plantae'}, 'tu-2': {'label': 'Abies', 'metadata': {'tsn': 2}}, 'english': {}}
+EDGES = [{'source': 'tu-1', 'target': 'tu-2', 'relation': 'parent_of'}, {'source': 'english', 'target': 'tu-1'}]
+
+
+def __write(path, graph: dict) -> str:
+    with open_output(str(path)) as f:
+        json.dump({'graph': graph}, f)
+    return str(path)
+
+
+def test_keys_are_kept_in_bitmaps_or_the_set_of_others():
+    keys = KeySet()
+    for key in ('tu-18063', 'tu-0', 'vern-18063', 'tu-018063', 'english', f'tu-{MAX_BITMAP_NUMBER + 1}', 'tu-'):
+        assert keys.add(key)
+        assert not keys.add(key)
+    assert len(keys) == 7 and set(keys.bitmaps) == {'tu', 'vern'}
+    assert keys.others == {'tu-018063', 'english', f'tu-{MAX_BITMAP_NUMBER + 1}', 'tu-'}
+    assert 'tu-18062' not in keys and 'tu-1000000' not in keys and 'vern-0' not in keys and 'french' not in keys
+
+
+def test_valid_graphs_are_valid_compressed_or_not(tmp_path):
+    for name in ('graph.json', 'graph.json.gz'):
+        report = validate_graph(__write(tmp_path / name, {'id': 'itis', 'nodes': NODES, 'edges': EDGES}))
+        assert report.valid and (report.nodes, report.edges) == (3, 2)
+
+
+def test_problems_are_counted_with_examples(tmp_path):
+    path = tmp_path / 'graph.json'
+    with open(path, 'w') as f:
+        f.write('{"graph": {"id": 1, "version": "2", "nodes": {"tu-1": {"label": 1}, "tu-1": {}, "tu-3": [],'
+                ' "tu-4": {"labels": "x"}}, "edges": [{"source": "tu-1", "target": "tu-2"}, {"target": "tu-9"},'
+                ' {"source": "tu-8", "target": "tu-9", "weight": 1}]}}')
+    report = validate_graph(str(path), max_examples=1)
+    assert not report.valid and (report.nodes, report.edges) == (4, 3)
+    assert report.problems == {
+        'graph attribute of the wrong type': 1,
+        'unknown graph attribute': 1,
+        'node member of the wrong type': 1,
+        'duplicate node key': 1,
+        'node is not an object': 1,
+        'unknown node member': 1,
+        'edge target is not a node': 3,
+        'edge without source': 1,
+        'unknown edge member': 1,
+        'edge source is not a node': 1,
+    }
+    assert report.examples['edge target is not a node'] == ['tu-1 -[None]-> tu-2']
+
+
+def test_edges_before_the_nodes_are_checked_in_a_second_pass(tmp_path):
+    edges = EDGES + [{'source': 'tu-2', 'target': 'tu-3'}]
+    report = validate_graph(__write(tmp_path / 'graph.json', {'edges': edges, 'nodes': NODES}))
+    assert report.problems == {'edge target is not a node': 1}
+    assert report.examples['edge target is not a node'] == ['tu-2 -[None]-> tu-3']
+
+
+def test_documents_without_a_graph_are_invalid(tmp_path):
+    report = validate_graph(__write(tmp_path / 'graph.json', {}))
+    assert report.problems == {'no graph': 1}
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# --coding:utf-8--
+
+import sys
+import argparse
+from typing import Dict, List, Optional, Tuple
+
+from compression import open_input
+from jsongraph import GraphReader
+
+# The members allowed by the JSON Graph Format v2 schema (schema/json-graph-schema_v2.json).
+GRAPH_ATTRIBUTES = {'id': str, 'label': str, 'directed': bool, 'type': str, 'metadata': dict}
+NODE_MEMBERS = {'label': str, 'metadata': dict}
+EDGE_MEMBERS = {'id': str, 'source': str, 'target': str, 'relation': str, 'directed': bool, 'label': str,
+                'metadata': dict}
+EDGE_REQUIRED = ['source', 'target']
+
+# Numbered keys above this are kept in the hash set, so that a bitmap never grows beyond 16 MiB.
+MAX_BITMAP_NUMBER = 1 << 27
+
+
+class KeySet:
+    """A set of node keys.
+
+    Keys made of a prefix and a number, like tu-18063 or vern-42, take a bit in a bitmap per prefix;
+    only the other keys are kept in a hash set.
+    """
+
+    def __init__(self):
+        self.bitmaps: Dict[str, bytearray] = {}
+        self.others = set()
+        self.count = 0
+
+    @staticmethod
+    def __split(key: str) -> Optional[Tuple[str, int]]:
+        (prefix, _, number) = key.rpartition('-')
+        # Numbers with leading zeros would share a bit with their canonical form.
+        if not prefix or not number.isdigit() or not number.isascii() or (number[0] == '0' and number != '0'):
+            return None
+        number = int(number)
+        return (prefix, number) if number <= MAX_BITMAP_NUMBER else None
+
+    def add(self, key: str) -> bool:
+        """Adds a key and tells whether it was new."""
+        split = self.__split(key)
+        if split is None:
+            if key in self.others:
+                return False
+            self.others.add(key)
+        else:
+            (prefix, number) = split
+            bitmap = self.bitmaps.setdefault(prefix, bytearray())
+            (byte, bit) = divmod(number, 8)
+            if byte >= len(bitmap):
+                bitmap.extend(bytes(max(byte + 1, 2 * len(bitmap)) - len(bitmap)))
+            if bitmap[byte] & (1 << bit):
+                return False
+            bitmap[byte] |= 1 << bit
+        self.count += 1
+        return True
+
+    def __contains__(self, key: str) -> bool:
+        split = self.__split(key)
+        if split is None:
+            return key in self.others
+        (prefix, number) = split
+        bitmap = self.bitmaps.get(prefix)
+        (byte, bit) = divmod(number, 8)
+        return bitmap is not None and byte < len(bitmap) and bool(bitmap[byte] & (1 << bit))
+
+    def __len__(self) -> int:
+        return self.count
+
+
+class ValidationReport:
+    """Counts the problems found by kind and keeps the first few examples of each."""
+
+    def __init__(self, max_examples: int = 10):
+        self.max_examples = max_examples
+        self.problems: Dict[str, int] = {}
+        self.examples: Dict[str, List[str]] = {}
+        self.nodes = 0
+        self.edges = 0
+
+    def add(self, kind: str, example: str):
+        self.problems[kind] = self.problems.get(kind, 0) + 1
+        examples = self.examples.setdefault(kind, [])
+        if len(examples) < self.max_examples:
+            examples.append(example)
+
+    @property
+    def valid(self) -> bool:
+        return not self.problems
+
+    def print(self, file=sys.stdout):
+        print(f'{self.nodes} nodes, {self.edges} edges', file=file)
+        for (kind, count) in self.problems.items():
+            print(f'{kind}: {count}', file=file)
+            for example in self.examples[kind]:
+                print(f'    {example}', file=file)
+
+
+def __check_members(report: ValidationReport, kind: str, name: str, value, members: Dict[str, type]):
+    if not isinstance(value, dict):
+        report.add(f'{kind} is not an object', name)
+        return
+    for (member, field) in value.items():
+        if member not in members:
+            report.add(f'unknown {kind} member', f'{name}: {member}')
+        elif not isinstance(field, members[member]):
+            report.add(f'{kind} member of the wrong type', f'{name}: {member} = {field!r}')
+
+
+def __check_endpoints(report: ValidationReport, keys: KeySet, edge):
+    if not isinstance(edge, dict):
+        return
+    for end in EDGE_REQUIRED:
+        if isinstance(edge.get(end), str) and edge[end] not in keys:
+            report.add(f'edge {end} is not a node', f'{edge.get("source")} -[{edge.get("relation")}]-> '
+                                                    f'{edge.get("target")}')
+
+
+def validate_graph(path: str, max_examples: int = 10) -> ValidationReport:
+    """Checks a JSON Graph document, which may be compressed, without loading it.
+
+    The graph attributes, nodes and edges are checked against the members of the JSON Graph schema
+    one at a time, node keys have to be unique and the source and target of every edge have to be
+    nodes of the graph. Only the node keys are held in memory. If edges come before the nodes, the
+    document is read a second time to check their endpoints.
+    """
+    report = ValidationReport(max_examples)
+    keys = KeySet()
+    nodes_read = False
+    deferred = False
+    found_graph = False
+    with open_input(path) as f:
+        for item in GraphReader(f):
+            found_graph = True
+            if item[0] == 'node':
+                (_, key, node) = item
+                report.nodes += 1
+                if not keys.add(key):
+                    report.add('duplicate node key', key)
+                __check_members(report, 'node', key, node, NODE_MEMBERS)
+                continue
+            # The nodes of a graph are a single object, so no node follows anything else once nodes were read.
+            nodes_read = nodes_read or report.nodes > 0
+            if item[0] == 'edge':
+                edge = item[1]
+                report.edges += 1
+                name = f'edge {report.edges}'
+                __check_members(report, 'edge', name, edge, EDGE_MEMBERS)
+                if isinstance(edge, dict):
+                    for end in EDGE_REQUIRED:
+                        if end not in edge:
+                            report.add(f'edge without {end}', name)
+                if nodes_read:
+                    __check_endpoints(report, keys, edge)
+                else:
+                    deferred = True
+            else:
+                (_, attribute, value) = item
+                if attribute not in GRAPH_ATTRIBUTES:
+                    report.add('unknown graph attribute', attribute)
+                elif not isinstance(value, GRAPH_ATTRIBUTES[attribute]):
+                    report.add('graph attribute of the wrong type', f'{attribute} = {value!r}')
+    if not found_graph:
+        report.add('no graph', path)
+
+    if deferred:
+        with open_input(path) as f:
+            for item in GraphReader(f):
+                if item[0] == 'edge':
+                    __check_endpoints(report, keys, item[1])
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Checks a JSON Graph document and the references between its '
+                                                 'nodes and edges without loading it into memory.')
+    parser.add_argument('input', help='the JSON Graph document, optionally compressed with gzip or zstd')
+    parser.add_argument('--examples', type=int, default=10, help='number of examples to print per kind of problem')
+    args = parser.parse_args()
+
+    report = validate_graph(args.input, args.examples)
+    report.print()
+    if not report.valid:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()